@@ -0,0 +1,135 @@
+"""
+Bulk Writer — Execution Module
+Size-bounded, retrying, idempotent upserts into a Supabase table. Used by
+rag_ingest to write `documents` rows without oversized request payloads.
+
+Directive: directives/rag_pipeline.md
+"""
+
+import json
+import random
+import sys
+import threading
+import time
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+DEFAULT_MAX_ROWS = 500
+DEFAULT_MAX_BYTES = 2_000_000     # well under PostgREST / gateway body limits
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 0.5          # seconds, doubled per attempt
+DEFAULT_MAX_DELAY = 30.0
+
+# SQLSTATE classes that will fail the same way on every retry:
+# 22 data exception, 23 integrity violation, 42 syntax/undefined object
+NON_RETRYABLE_SQLSTATE_CLASSES = ("22", "23", "42")
+
+
+def serialize_vector(vec) -> str:
+    """pgvector text literal: ~12 chars/value vs ~20 in a JSON float list.
+
+    9 significant digits is the shortest fixed precision that round-trips
+    every float32 exactly (pgvector stores float32).
+    """
+    return "[" + ",".join(f"{float(x):.9g}" for x in vec) + "]"
+
+
+class BulkWriteError(Exception):
+    """A batch still failed after all retries. `written` rows before it were committed."""
+
+    def __init__(self, message: str, written: int, remaining: int):
+        super().__init__(message)
+        self.written = written
+        self.remaining = remaining
+
+
+class BulkWriter:
+    """Split rows into batches bounded by row count and payload bytes and upsert each.
+
+    Each batch is retried with exponential backoff and full jitter; batches
+    that already succeeded are never re-sent. Upserts use `on_conflict`, so
+    re-running a partially failed write is idempotent.
+    """
+
+    def __init__(
+        self,
+        client,
+        table: str = "documents",
+        on_conflict: str = "source,chunk_index",
+        vector_column: str = "embedding",
+        max_rows: int = DEFAULT_MAX_ROWS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+    ):
+        self.client = client
+        self.table = table
+        self.on_conflict = on_conflict
+        self.vector_column = vector_column
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self.stats = {"rows": 0, "batches": 0, "bytes": 0, "retries": 0}
+
+    # -- batching -----------------------------------------------------------
+
+    def batches(self, rows: list[dict]) -> list[tuple[list[dict], int]]:
+        """Serialize vectors and group rows into (batch, payload bytes) pairs."""
+        batches, current, current_bytes = [], [], 2  # "[]"
+        for row in rows:
+            if self.vector_column in row and not isinstance(row[self.vector_column], str):
+                row = {**row, self.vector_column: serialize_vector(row[self.vector_column])}
+            size = len(json.dumps(row, ensure_ascii=False).encode("utf-8")) + 1
+            if current and (len(current) >= self.max_rows or current_bytes + size > self.max_bytes):
+                batches.append((current, current_bytes))
+                current, current_bytes = [], 2
+            current.append(row)
+            current_bytes += size
+        if current:
+            batches.append((current, current_bytes))
+        return batches
+
+    # -- writing ------------------------------------------------------------
+
+    def write(self, rows: list[dict]) -> int:
+        """Upsert all rows. Returns rows written; raises BulkWriteError on a batch that keeps failing."""
+        written = 0
+        for batch, size in self.batches(rows):
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                raise BulkWriteError(
+                    f"{self.table} upsert failed after {written} rows: {e}",
+                    written=written, remaining=len(rows) - written,
+                ) from e
+            written += len(batch)
+            with self._lock:
+                self.stats["rows"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["bytes"] += size
+        return written
+
+    def _write_batch(self, batch: list[dict]):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.client.table(self.table).upsert(batch, on_conflict=self.on_conflict).execute()
+                return
+            except Exception as e:
+                if attempt == self.max_retries or not self._is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                print(f"  ↻ {self.table} batch of {len(batch)} failed (attempt {attempt}/{self.max_retries}): "
+                      f"{e} — retrying in {delay:.1f}s", file=sys.stderr)
+                with self._lock:
+                    self.stats["retries"] += 1
+                time.sleep(delay)
+
+    @staticmethod
+    def _is_retryable(exc: Exception) -> bool:
+        code = getattr(exc, "code", None)
+        return not (isinstance(code, str) and code[:2] in NON_RETRYABLE_SQLSTATE_CLASSES)
@@ -7,21 +7,41 @@ Directive: directives/chat_analysis.md
 """
 
 import argparse
-import hashlib
+import asyncio
 import json
 import os
 import sys
-from datetime import datetime, timedelta
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
-import requests
 from dotenv import load_dotenv
 
 load_dotenv()
 
-API_URL = os.getenv("AI_API_URL", "https://ai.gateway.lovable.dev/v1/chat/completions")
-API_KEY = os.getenv("AI_API_KEY") or os.getenv("LOVABLE_API_KEY")
+try:
+    from execution.llm_gateway import RateLimitError, get_gateway, message_of, require_api_key
+    from execution.response_cache import cache_key
+    from execution.single_flight import get_single_flight
+except ImportError:
+    sys.path.insert(0, os.path.dirname(__file__))
+    from llm_gateway import RateLimitError, get_gateway, message_of, require_api_key
+    from response_cache import cache_key
+    from single_flight import get_single_flight
+
 USE_RAG = os.getenv("USE_RAG", "false").lower() == "true"
 CACHE_TTL_HOURS = 24
+DEFAULT_CONCURRENCY = 8   # queries in flight in --batch-file mode
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "8"))   # chunks retrieved before context packing
+PREPARE_WORKERS = 16      # threads for the concurrent cache probe + retrieval (batch mode: at least --concurrency)
+
+# Prompt tokens available for retrieved context, per mode
+CONTEXT_TOKEN_BUDGETS = {
+    "general": 1500,
+    "competitive": 2000,
+    "industry": 3000,
+}
 
 SYSTEM_PROMPTS = {
     "general": (
@@ -52,126 +72,187 @@ RAG_SYSTEM_SUFFIX = (
     "Never invent data that contradicts the retrieved sources."
 )
 
-MAX_RETRIES = 3
-RETRY_DELAY_SECONDS = 60
-
 
 # ---------------------------------------------------------------------------
 # RAG helpers (lazy-loaded only when USE_RAG=true)
 # ---------------------------------------------------------------------------
 
-def get_rag_context(query: str) -> tuple[str, list[dict]]:
-    """Retrieve relevant documents for the query. Returns (context_str, sources)."""
+def get_rag_context(
+    query: str,
+    mode: str = "general",
+    cancel: threading.Event | None = None,
+    timings: dict | None = None,
+) -> tuple[str, list[dict], dict]:
+    """Retrieve and pack relevant documents for the query. Returns (context_str, sources, pack stats).
+
+    RAG_TOP_K chunks are retrieved, then pack_context merges neighbours and
+    fits them into the mode's token budget; `sources[N-1]` is [Source N].
+    Setting `cancel` stops retrieval at the next stage boundary; per-stage
+    milliseconds are written into `timings`.
+    """
     try:
-        from execution.rag_query import query_documents, format_context_for_llm
+        from execution.rag_query import query_documents, pack_context
     except ImportError:
         # Fallback: import from same directory
         sys.path.insert(0, os.path.dirname(__file__))
-        from rag_query import query_documents, format_context_for_llm
+        from rag_query import query_documents, pack_context
 
-    result = query_documents(query=query, top_k=5, threshold=0.65)
+    timings = timings if timings is not None else {}
+    result = query_documents(query=query, top_k=RAG_TOP_K, threshold=0.65, cancel=cancel, timings=timings)
     documents = result.get("documents", [])
 
     if not documents:
-        return "", []
+        return "", [], {}
 
-    context = format_context_for_llm(documents)
+    start = time.perf_counter()
+    budget = CONTEXT_TOKEN_BUDGETS.get(mode, CONTEXT_TOKEN_BUDGETS["general"])
+    context, passages, stats = pack_context(documents, budget)
+    timings["pack_ms"] = _ms_since(start)
     sources = [
         {
-            "source": d.get("source", "unknown"),
-            "source_type": d.get("source_type", "unknown"),
-            "similarity": round(d.get("similarity", 0), 3),
-            "preview": d.get("content", "")[:100] + "...",
+            "source": p.get("source", "unknown"),
+            "source_type": p.get("source_type", "unknown"),
+            "similarity": round(p.get("similarity", 0), 3),
+            "chunks": p["chunk_indices"],
+            "preview": p.get("content", "")[:100] + "...",
         }
-        for d in documents
+        for p in passages
     ]
 
-    return context, sources
+    return context, sources, stats
 
 
-def check_cache(query: str, mode: str) -> dict | None:
-    """Check query cache for a previous response. Returns cached result or None."""
-    try:
-        from supabase import create_client
-    except ImportError:
-        return None
+_supabase = None
+_response_cache = None
+_prepare_pool = None
+_prepare_pool_size = 0
 
-    url = os.getenv("VITE_SUPABASE_URL") or os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SERVICE_KEY")
-    if not url or not key:
-        return None
 
-    sb = create_client(url, key)
-    query_hash = hashlib.md5(f"{query.strip().lower()}:{mode}".encode()).hexdigest()
+def _ms_since(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
 
-    result = sb.table("query_cache").select("*").eq("query_hash", query_hash).limit(1).execute()
 
-    if result.data:
-        cached = result.data[0]
-        # Check TTL
-        created = datetime.fromisoformat(cached["created_at"].replace("Z", "+00:00"))
-        if datetime.now(created.tzinfo) - created < timedelta(hours=CACHE_TTL_HOURS):
-            return {
-                "query": cached["query_text"],
-                "mode": cached.get("mode", mode),
-                "response": cached["response"],
-                "sources": cached.get("sources", []),
-                "cached": True,
-                "timestamp": cached["created_at"],
-            }
+def get_prepare_pool(min_workers: int = PREPARE_WORKERS) -> ThreadPoolExecutor:
+    """Shared pool for the cache probe and retrieval that prepare_chat runs side by side.
 
-    return None
+    A caller that needs more retrievals in flight (batch mode above
+    PREPARE_WORKERS) gets a larger pool; the old one finishes its queued work.
+    """
+    global _prepare_pool, _prepare_pool_size
+    if _prepare_pool is None or _prepare_pool_size < min_workers:
+        old = _prepare_pool
+        _prepare_pool_size = max(PREPARE_WORKERS, min_workers)
+        _prepare_pool = ThreadPoolExecutor(max_workers=_prepare_pool_size, thread_name_prefix="prepare")
+        if old is not None:
+            old.shutdown(wait=False)
+    return _prepare_pool
 
 
-def save_to_cache(query: str, mode: str, response: str, sources: list):
-    """Save a response to the query cache."""
-    try:
-        from supabase import create_client
-    except ImportError:
-        return
+def get_supabase():
+    """Shared Supabase client for the query cache (None when not configured)."""
+    global _supabase
+    if _supabase is None:
+        try:
+            from supabase import create_client
+        except ImportError:
+            return None
+        url = os.getenv("VITE_SUPABASE_URL") or os.getenv("SUPABASE_URL")
+        key = os.getenv("SUPABASE_SERVICE_KEY")
+        if not url or not key:
+            return None
+        _supabase = create_client(url, key)
+    return _supabase
+
+
+def get_response_cache():
+    """Lazy-load the layered response cache (memory -> SQLite -> Supabase -> semantic)."""
+    global _response_cache
+    if _response_cache is None:
+        try:
+            from execution.response_cache import ResponseCache
+            from execution.rag_query import embed_query
+        except ImportError:
+            sys.path.insert(0, os.path.dirname(__file__))
+            from response_cache import ResponseCache
+            from rag_query import embed_query
+        # embed_query shares the embedding cache with RAG retrieval, so the
+        # semantic lookup and retrieval encode each query only once
+        _response_cache = ResponseCache(get_supabase, ttl_hours=CACHE_TTL_HOURS, embed_fn=embed_query)
+    return _response_cache
 
-    url = os.getenv("VITE_SUPABASE_URL") or os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SERVICE_KEY")
-    if not url or not key:
-        return
 
-    sb = create_client(url, key)
-    query_hash = hashlib.md5(f"{query.strip().lower()}:{mode}".encode()).hexdigest()
+def check_cache(query: str, mode: str) -> dict | None:
+    """Check the query cache for a previous response. Returns cached result or None."""
+    return get_response_cache().get(query, mode)
 
-    sb.table("query_cache").upsert({
-        "query_hash": query_hash,
-        "query_text": query,
-        "response": response,
-        "sources": sources,
-        "mode": mode,
-    }, on_conflict="query_hash").execute()
+
+def save_to_cache(query: str, mode: str, response: str, sources: list):
+    """Save a response to the query cache (Supabase write happens in the background)."""
+    get_response_cache().put(query, mode, response, sources)
 
 
 # ---------------------------------------------------------------------------
 # Chat
 # ---------------------------------------------------------------------------
 
-def run_chat(query: str, mode: str = "general") -> dict:
-    """Run a chat analysis and return the response."""
-    if not API_KEY:
-        print("ERROR: AI_API_KEY or LOVABLE_API_KEY not found in .env", file=sys.stderr)
-        sys.exit(1)
+def _probe_cache(query: str, mode: str, timings: dict) -> dict | None:
+    start = time.perf_counter()
+    try:
+        return check_cache(query, mode)
+    finally:
+        timings["cache_ms"] = _ms_since(start)
+
+
+def _retrieve(query: str, mode: str, cancel: threading.Event, timings: dict) -> tuple[str, list[dict], dict]:
+    start = time.perf_counter()
+    try:
+        return get_rag_context(query, mode, cancel=cancel, timings=timings)
+    finally:
+        timings["retrieval_ms"] = _ms_since(start)
+
+
+def prepare_chat(query: str, mode: str, verbose: bool = True) -> dict:
+    """Cache check and RAG retrieval. Returns {"cached": result} or the prompt state.
 
+    With RAG on, the cache probe and retrieval start together on the shared
+    pool. A cache hit cancels retrieval and returns without waiting for it;
+    on a miss the two latencies overlap instead of adding up. Per-stage
+    milliseconds are returned under "timings".
+    """
+    started = time.perf_counter()
     sources = []
     rag_context = ""
+    context_stats = {}
+    timings: dict = {}
 
-    # --- RAG: cache check ---
     if USE_RAG:
-        cached = check_cache(query, mode)
+        # --- RAG: cache check and retrieval, concurrently ---
+        pool = get_prepare_pool()
+        cancel = threading.Event()
+        retrieval_timings: dict = {}
+        retrieval = pool.submit(_retrieve, query, mode, cancel, retrieval_timings)
+        try:
+            cached = _probe_cache(query, mode, timings)
+        except BaseException:
+            cancel.set()
+            raise
         if cached:
-            print("✅ Cache hit — returning cached response")
-            return cached
-
-        # --- RAG: retrieve context ---
-        rag_context, sources = get_rag_context(query)
-        if rag_context:
+            cancel.set()
+            timings["total_ms"] = _ms_since(started)
+            if verbose and cached.get("cache_tier") == "semantic":
+                print(f"✅ Semantic cache hit ({cached['similarity']:.2f} similar to \"{cached['query']}\")")
+            elif verbose:
+                print("✅ Cache hit — returning cached response")
+            return {"cached": {**cached, "timings": timings}}
+
+        rag_context, sources, context_stats = retrieval.result()
+        timings.update(retrieval_timings)
+        if verbose and rag_context:
             print(f"📚 RAG: found {len(sources)} relevant sources")
-        else:
+            print(f"✂️  Context: {context_stats['tokens_before']} → {context_stats['tokens_after']} tokens "
+                  f"(-{context_stats['saved_pct']}%), {context_stats['merged']} chunks merged, "
+                  f"{context_stats['dropped']} passages dropped")
+        elif verbose:
             print("📭 RAG: no relevant documents found, using LLM only")
 
     # Build prompt
@@ -190,66 +271,249 @@ def run_chat(query: str, mode: str = "general") -> dict:
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_content},
     ]
+    timings["prepare_ms"] = _ms_since(started)
+    return {
+        "messages": messages,
+        "sources": sources,
+        "rag_context": rag_context,
+        "context_stats": context_stats,
+        "timings": timings,
+        "started": started,
+    }
 
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            resp = requests.post(
-                API_URL,
-                headers={
-                    "Authorization": f"Bearer {API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": "google/gemini-3-flash-preview",
-                    "messages": messages,
-                },
-                timeout=120,
-            )
-
-            if resp.status_code == 429:
-                print(f"Rate limited (attempt {attempt}/{MAX_RETRIES}). Waiting {RETRY_DELAY_SECONDS}s...")
-                import time
-                time.sleep(RETRY_DELAY_SECONDS)
-                continue
 
-            resp.raise_for_status()
-            data = resp.json()
-            content = data["choices"][0]["message"]["content"]
+def finish_chat(query: str, mode: str, prepared: dict, content: str, metrics: dict) -> dict:
+    """Assemble the result dict and write the cache entry."""
+    result = {
+        "query": query,
+        "mode": mode,
+        "response": content,
+        "sources": prepared["sources"],
+        "rag_enabled": USE_RAG and bool(prepared["rag_context"]),
+        "timestamp": datetime.now().isoformat(),
+        "llm": metrics,
+    }
+    if prepared["context_stats"]:
+        result["context"] = prepared["context_stats"]
+    result["timings"] = {
+        **prepared["timings"],
+        "llm_ms": metrics.get("latency_ms"),
+        "total_ms": _ms_since(prepared["started"]),
+    }
+
+    # Save to cache
+    if USE_RAG:
+        save_to_cache(query, mode, content, prepared["sources"])
+
+    return result
 
-            result = {
-                "query": query,
-                "mode": mode,
-                "response": content,
-                "sources": sources,
-                "rag_enabled": USE_RAG and bool(rag_context),
-                "timestamp": datetime.now().isoformat(),
-            }
 
-            # Save to cache
-            if USE_RAG:
-                save_to_cache(query, mode, content, sources)
+def run_chat(query: str, mode: str = "general", verbose: bool = True) -> dict:
+    """Run a chat analysis and return the response.
 
-            return result
+    Identical concurrent requests (same cache key, in this process or another
+    on the same machine) share one computation instead of each calling the LLM.
+    """
+    require_api_key()
 
-        except requests.RequestException as e:
-            print(f"Request error (attempt {attempt}/{MAX_RETRIES}): {e}", file=sys.stderr)
-            if attempt == MAX_RETRIES:
-                raise
+    result, shared = get_single_flight().do(
+        f"chat:{cache_key(query, mode)}", lambda: _run_chat(query, mode, verbose)
+    )
+    if shared:
+        if verbose:
+            print("🔗 Joined an identical in-flight request")
+        return {**result, "coalesced": True}
+    return result
 
-    return {"error": "Max retries exceeded"}
+
+def _run_chat(query: str, mode: str, verbose: bool) -> dict:
+    prepared = prepare_chat(query, mode, verbose)
+    if "cached" in prepared:
+        return prepared["cached"]
+
+    try:
+        data = get_gateway().chat(prepared["messages"])
+    except RateLimitError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return {"error": "Max retries exceeded"}
+
+    content = message_of(data).get("content") or ""
+    return finish_chat(query, mode, prepared, content, data["metrics"])
+
+
+def run_chat_stream(query: str, mode: str = "general", verbose: bool = True):
+    """Streaming run_chat: yields response tokens as they arrive and returns the result dict.
+
+    Usage: `result = yield from run_chat_stream(...)`, or read StopIteration.value.
+    The result (with ttft_ms / total_ms under "llm") and the cache write are
+    produced once, after the last token. A cache hit yields the whole response.
+    """
+    require_api_key()
+
+    prepared = prepare_chat(query, mode, verbose)
+    if "cached" in prepared:
+        yield prepared["cached"]["response"]
+        return prepared["cached"]
+
+    stream = get_gateway().stream_chat(prepared["messages"])
+    try:
+        yield from stream
+    except RateLimitError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return {"error": "Max retries exceeded"}
+
+    return finish_chat(query, mode, prepared, stream.text, stream.metrics)
+
+
+# ---------------------------------------------------------------------------
+# Batch mode
+# ---------------------------------------------------------------------------
+
+def load_batch(path: str) -> list[dict]:
+    """Read {"query", "mode"} items from a JSONL file (mode defaults to general)."""
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            query = (item.get("query") or "").strip()
+            if not query:
+                print(f"⚠️  {path}:{line_no} — empty query, skipping", file=sys.stderr)
+                continue
+            mode = item.get("mode", "general")
+            if mode not in SYSTEM_PROMPTS:
+                print(f"⚠️  {path}:{line_no} — unknown mode '{mode}', using general", file=sys.stderr)
+                mode = "general"
+            items.append({"query": query, "mode": mode})
+    return items
+
+
+def warm_up():
+    """Load the embedding model once before workers start, so threads don't race to load it."""
+    try:
+        from execution.rag_query import get_model
+    except ImportError:
+        sys.path.insert(0, os.path.dirname(__file__))
+        from rag_query import get_model
+    get_model()
+
+
+async def run_batch(items: list[dict], output_path: str, concurrency: int = DEFAULT_CONCURRENCY) -> dict:
+    """Run many queries with at most `concurrency` in flight; append results to JSONL as they finish.
+
+    Each query's blocking stages (cache lookup, embedding, Supabase retrieval,
+    gateway call) run in worker threads, so the stages of different queries
+    overlap. One failed query is recorded as an error line and does not stop
+    the batch.
+    """
+    require_api_key()
+    # Own pool: the loop's default executor has min(32, cpus + 4) threads and would cap concurrency
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch")
+    if USE_RAG:
+        get_prepare_pool(concurrency)  # each query's retrieval runs there; don't cap it below concurrency
+        await loop.run_in_executor(pool, warm_up)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    counts = {"ok": 0, "cached": 0, "errors": 0}
+
+    async def one(index: int, item: dict) -> dict:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(pool, run_chat, item["query"], item["mode"], False)
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            latency_ms = round((time.perf_counter() - start) * 1000, 1)
+            return {"index": index, "query": item["query"], "mode": item["mode"], **result, "latency_ms": latency_ms}
+
+    start = time.perf_counter()
+    try:
+        with open(output_path, "w", encoding="utf-8") as out:
+            tasks = [asyncio.create_task(one(i, item)) for i, item in enumerate(items)]
+            for done, task in enumerate(asyncio.as_completed(tasks), 1):
+                record = await task
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                latencies.append(record["latency_ms"])
+                if record.get("error"):
+                    counts["errors"] += 1
+                    print(f"  ❌ [{done}/{len(items)}] {record['query'][:60]} — {record['error']}")
+                else:
+                    counts["ok"] += 1
+                    counts["cached"] += bool(record.get("cached"))
+                    print(f"  ✅ [{done}/{len(items)}] {record['query'][:60]} — {record['latency_ms']:.0f} ms")
+    finally:
+        pool.shutdown(wait=False)
+    elapsed = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    return {
+        "queries": len(items),
+        **counts,
+        "seconds": round(elapsed, 2),
+        "queries_per_sec": round(len(items) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": ordered[len(ordered) // 2] if ordered else 0.0,
+        "p95_ms": ordered[max(0, round(0.95 * len(ordered)) - 1)] if ordered else 0.0,
+    }
+
+
+def print_cache_stats():
+    stats = get_response_cache().stats()
+    if not stats["lookups"]:
+        return
+    tiers = ", ".join(f"{tier} {stats['hits'][tier]} ({rate:.0%})" for tier, rate in stats["tier_hit_rates"].items())
+    print(f"🗄️  Response cache: {stats['hit_rate']:.0%} hit rate over {stats['lookups']} lookups — {tiers}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Run AI-powered market research chat analysis")
-    parser.add_argument("--query", required=True, help="Market research question")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--query", help="Market research question")
+    source.add_argument("--batch-file", help='JSONL of {"query": ..., "mode": ...} items to run concurrently')
     parser.add_argument("--mode", choices=["general", "competitive", "industry"], default="general")
-    parser.add_argument("--output", help="Output file path (default: .tmp/chat_<timestamp>.json)")
+    parser.add_argument("--stream", action="store_true", help="Print response tokens as they arrive")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Queries in flight with --batch-file (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--output", help="Output file path (default: .tmp/chat_<timestamp>.json, "
+                                         ".tmp/chat_batch_<timestamp>.jsonl with --batch-file)")
     args = parser.parse_args()
 
     if USE_RAG:
         print("🔍 RAG mode enabled")
 
-    result = run_chat(args.query, args.mode)
+    if args.batch_file:
+        items = load_batch(args.batch_file)
+        if not items:
+            print(f"ERROR: no queries in {args.batch_file}", file=sys.stderr)
+            sys.exit(1)
+        os.makedirs(".tmp", exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = args.output or f".tmp/chat_batch_{timestamp}.jsonl"
+        print(f"Running {len(items)} queries (concurrency {args.concurrency})")
+        summary = asyncio.run(run_batch(items, output_path, max(1, args.concurrency)))
+        print(f"\nSaved to: {output_path}")
+        print(f"📊 {summary['ok']}/{summary['queries']} ok ({summary['cached']} cached, {summary['errors']} failed) "
+              f"in {summary['seconds']}s — {summary['queries_per_sec']} queries/s, "
+              f"p50 {summary['p50_ms']:.0f} ms, p95 {summary['p95_ms']:.0f} ms")
+        if USE_RAG:
+            print_cache_stats()
+        return
+
+    if args.stream:
+        print("\nResponse:")
+        stream = run_chat_stream(args.query, args.mode)
+        while True:
+            try:
+                print(next(stream), end="", flush=True)
+            except StopIteration as stop:
+                result = stop.value
+                break
+        print()
+    else:
+        result = run_chat(args.query, args.mode)
 
     # Save to .tmp/
     os.makedirs(".tmp", exist_ok=True)
@@ -262,7 +526,19 @@ def main():
     print(f"Saved to: {output_path}")
     if result.get("cached"):
         print("(from cache)")
-    print(f"\nResponse:\n{result.get('response', result.get('error', 'No response'))}")
+    if not args.stream:
+        print(f"\nResponse:\n{result.get('response', result.get('error', 'No response'))}")
+    elif result.get("error"):
+        print(result["error"])
+
+    if result.get("llm"):
+        llm = result["llm"]
+        ttft = f"TTFT {llm['ttft_ms']:.0f} ms, " if llm.get("ttft_ms") is not None else ""
+        print(f"\n⏱️  LLM: {ttft}{llm['latency_ms']:.0f} ms total, {llm['total_tokens']} tokens, "
+              f"{llm['attempts']} attempt(s)")
+
+    if USE_RAG:
+        print_cache_stats()
 
     if result.get("sources"):
         print(f"\n📎 Sources ({len(result['sources'])}):")
@@ -0,0 +1,264 @@
+"""
+Chunking — Execution Module
+Token-aware, structure-aware markdown chunker for rag_ingest. Splits on
+headings, then paragraphs/blocks, then sentences (or lines for tables, lists
+and code), then words, and packs the pieces greedily up to the embedding
+model's token budget with a small sentence-level overlap. Each chunk is
+prefixed with its heading breadcrumb instead of a per-page header.
+
+Runs in one pass over a stream of text pieces: every character is tokenized
+a bounded number of times, so the cost is linear in document size.
+
+Directive: directives/rag_pipeline.md
+"""
+
+import os
+import re
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+MAX_CHUNK_TOKENS = 500        # model limit is 512 incl. [CLS]/[SEP]
+CHUNK_OVERLAP_TOKENS = 50     # whole trailing sentences carried into the next chunk
+MIN_CHUNK_TOKENS = 64         # smaller chunks absorb the following heading instead of ending at it
+SPECIAL_TOKENS = 2            # [CLS] + [SEP]
+CHARS_PER_TOKEN = 4           # estimate when no tokenizer is available
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_LINE_BLOCK = re.compile(r"^\s*(\||[-*+]\s|\d+[.)]\s|>)")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WHITESPACE = re.compile(r"\s+")
+
+_tokenizer = None
+_tokenizer_loaded = False
+
+
+def get_tokenizer():
+    """Lazy-load the model's fast tokenizer (None if `tokenizers` is unavailable)."""
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        _tokenizer_loaded = True
+        try:
+            from tokenizers import Tokenizer
+            _tokenizer = Tokenizer.from_pretrained(os.getenv("EMBEDDING_MODEL", EMBEDDING_MODEL))
+            _tokenizer.no_truncation()
+            _tokenizer.no_padding()
+        except Exception as e:
+            print(f"⚠️  Tokenizer unavailable ({e}); estimating {CHARS_PER_TOKEN} chars/token")
+    return _tokenizer
+
+
+def count_tokens(texts: list[str]) -> list[int]:
+    """Token count per text, without special tokens.
+
+    WordPiece pre-tokenizes on whitespace and punctuation, so counts of pieces
+    joined by whitespace add up to the count of the joined text.
+    """
+    if not texts:
+        return []
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return [-(-len(t) // CHARS_PER_TOKEN) for t in texts]
+    return [len(enc.ids) for enc in tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+
+# ---------------------------------------------------------------------------
+# Markdown blocks
+# ---------------------------------------------------------------------------
+
+def iter_lines(pieces):
+    """Lines from a stream of text pieces; only the current partial line is buffered."""
+    partial: list[str] = []
+    for piece in pieces:
+        if "\n" not in piece:
+            partial.append(piece)
+            continue
+        lines = piece.split("\n")
+        partial.append(lines[0])
+        yield "".join(partial)
+        yield from lines[1:-1]
+        partial = [lines[-1]]
+    if partial and any(partial):
+        yield "".join(partial)
+
+
+def iter_blocks(lines):
+    """Yield ("heading", level, title) and ("text"|"lines", None, text) blocks.
+
+    Paragraphs end at blank lines. Fenced code is one block; tables, lists,
+    quotes and code are "lines" blocks that split on line boundaries.
+    """
+    block: list[str] = []
+    fence = None
+
+    def flush():
+        if not block:
+            return None
+        text = "\n".join(block)
+        kind = "lines" if _LINE_BLOCK.match(block[0]) else "text"
+        block.clear()
+        return (kind, None, text)
+
+    for line in lines:
+        if fence is not None:
+            block.append(line)
+            if line.strip().startswith(fence):
+                fence = None
+                yield ("lines", None, "\n".join(block))
+                block.clear()
+            continue
+
+        fence_match = _FENCE.match(line)
+        if fence_match:
+            pending = flush()
+            if pending:
+                yield pending
+            fence = fence_match.group(1)
+            block.append(line)
+            continue
+
+        heading = _HEADING.match(line)
+        if heading:
+            pending = flush()
+            if pending:
+                yield pending
+            yield ("heading", len(heading.group(1)), heading.group(2))
+        elif not line.strip():
+            pending = flush()
+            if pending:
+                yield pending
+        else:
+            block.append(line)
+
+    pending = flush()
+    if pending:
+        yield pending
+
+
+# ---------------------------------------------------------------------------
+# Splitting oversized blocks
+# ---------------------------------------------------------------------------
+
+def split_block(kind: str, text: str, tokens: int, budget: int) -> list[tuple[str, int, str]]:
+    """Split a block into (text, tokens, separator) units of at most `budget` tokens.
+
+    Falls back from sentences/lines to words to characters. Each level only
+    tokenizes the pieces of an oversized parent.
+    """
+    if tokens <= budget:
+        return [(text, tokens, "\n\n")]
+
+    if kind == "lines":
+        parts, sep = text.split("\n"), "\n"
+    else:
+        parts, sep = _SENTENCE_END.split(text), " "
+    parts = [p for p in parts if p.strip()]
+    if len(parts) <= 1:
+        parts, sep = _WHITESPACE.split(text.strip()), " "
+
+    units = []
+    for part, part_tokens in zip(parts, count_tokens(parts)):
+        if part_tokens <= budget:
+            units.append((part, part_tokens, sep))
+        elif " " in part.strip():
+            units.extend(split_block("text", part, part_tokens, budget))
+        else:
+            # A single "word" longer than the budget (e.g. a data URI): cut by characters
+            step = max(1, len(part) * budget // part_tokens)
+            pieces = [part[i:i + step] for i in range(0, len(part), step)]
+            units.extend((p, t, "") for p, t in zip(pieces, count_tokens(pieces)))
+    if units:
+        units[0] = (units[0][0], units[0][1], "\n\n")
+    return units
+
+
+# ---------------------------------------------------------------------------
+# Packing
+# ---------------------------------------------------------------------------
+
+def iter_markdown_chunks(
+    pieces,
+    max_tokens: int = MAX_CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    min_tokens: int = MIN_CHUNK_TOKENS,
+):
+    """Yield {"content", "section", "tokens"} chunks from markdown text pieces.
+
+    `content` is the heading breadcrumb (if any) followed by the body, sized
+    to `max_tokens`; `tokens` is its length including special tokens. A
+    heading ends the current chunk once it holds `min_tokens`; chunks cut by
+    the budget inside a section repeat up to `overlap_tokens` of trailing
+    sentences.
+    """
+    path: list[tuple[int, str]] = []
+    header_cache: dict[tuple, tuple[str, int]] = {}
+
+    def header_for(current_path):
+        key = tuple(title for _, title in current_path)
+        if key not in header_cache:
+            text = " > ".join(key) + "\n\n" if key else ""
+            header_cache[key] = (text, count_tokens([text])[0] if text else 0)
+        return header_cache[key]
+
+    units: list[tuple[str, int, str]] = []
+    used = fresh = 0
+    header, header_tokens = header_for(path)
+
+    def build() -> dict:
+        body = units[0][0] + "".join(sep + text for text, _, sep in units[1:])
+        return {
+            "content": header + body,
+            "section": header.strip(),
+            "tokens": header_tokens + used + SPECIAL_TOKENS,
+        }
+
+    def restart(keep_overlap: bool):
+        nonlocal units, used, fresh, header, header_tokens
+        carried, carried_tokens = [], 0
+        if keep_overlap and overlap_tokens > 0:
+            for unit in reversed(units):
+                if carried_tokens + unit[1] > overlap_tokens:
+                    break
+                carried.insert(0, unit)
+                carried_tokens += unit[1]
+        units, used, fresh = carried, carried_tokens, 0
+        header, header_tokens = header_for(path)
+
+    budget = lambda: max(1, max_tokens - header_tokens)  # noqa: E731
+
+    for kind, level, text in iter_blocks(iter_lines(pieces)):
+        if kind == "heading":
+            if fresh and used >= min_tokens:
+                yield build()
+                restart(keep_overlap=False)
+            elif not fresh:
+                restart(keep_overlap=False)  # no overlap across a section boundary
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, text.strip()))
+            if not units:
+                header, header_tokens = header_for(path)
+                continue
+            text = "#" * level + " " + text.strip()
+
+        block_tokens = count_tokens([text])[0]
+        for unit in split_block(kind, text, block_tokens, budget()):
+            if units and used + unit[1] > budget():
+                if fresh:
+                    yield build()
+                restart(keep_overlap=True)
+                if units and used + unit[1] > budget():
+                    restart(keep_overlap=False)
+            units.append(unit)
+            used += unit[1]
+            fresh += 1
+
+    if fresh:
+        yield build()
+
+
+def chunk_markdown(text: str, **kwargs) -> list[dict]:
+    """Chunk a whole markdown string (see iter_markdown_chunks)."""
+    return list(iter_markdown_chunks([text], **kwargs))
@@ -11,16 +11,16 @@ import os
 import sys
 from datetime import datetime
 
-import requests
 from dotenv import load_dotenv
 
 load_dotenv()
 
-API_URL = os.getenv("AI_API_URL", "https://ai.gateway.lovable.dev/v1/chat/completions")
-API_KEY = os.getenv("AI_API_KEY") or os.getenv("LOVABLE_API_KEY")
+try:
+    from execution.llm_gateway import RateLimitError, get_gateway, message_of, require_api_key
+except ImportError:
+    sys.path.insert(0, os.path.dirname(__file__))
+    from llm_gateway import RateLimitError, get_gateway, message_of, require_api_key
 
-MAX_RETRIES = 3
-RETRY_DELAY_SECONDS = 60
 
 TOOL_SPEC = {
     "type": "function",
@@ -58,9 +58,7 @@ TOOL_SPEC = {
 
 def discover_competitors(query: str) -> dict:
     """Discover competitors in a given market."""
-    if not API_KEY:
-        print("ERROR: AI_API_KEY or LOVABLE_API_KEY not found in .env", file=sys.stderr)
-        sys.exit(1)
+    require_api_key()
 
     prompt = (
         f'Discover the top 6-8 competitors in this market: "{query}". '
@@ -69,58 +67,37 @@ def discover_competitors(query: str) -> dict:
         "and your confidence level (high/medium/low) in the data accuracy."
     )
 
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            resp = requests.post(
-                API_URL,
-                headers={
-                    "Authorization": f"Bearer {API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": "google/gemini-3-flash-preview",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": (
-                                "You are a competitive intelligence analyst. "
-                                "Discover and analyze competitors in a given market. "
-                                "Be specific with real company names, funding amounts, "
-                                "and data points where possible."
-                            ),
-                        },
-                        {"role": "user", "content": prompt},
-                    ],
-                    "tools": [TOOL_SPEC],
-                    "tool_choice": {"type": "function", "function": {"name": "deliver_competitors"}},
-                },
-                timeout=120,
-            )
-
-            if resp.status_code == 429:
-                print(f"Rate limited (attempt {attempt}/{MAX_RETRIES}). Waiting {RETRY_DELAY_SECONDS}s...")
-                import time
-                time.sleep(RETRY_DELAY_SECONDS)
-                continue
-
-            resp.raise_for_status()
-            data = resp.json()
-
-            tool_call = data.get("choices", [{}])[0].get("message", {}).get("tool_calls", [None])[0]
-            if tool_call:
-                result = json.loads(tool_call["function"]["arguments"])
-                result["query"] = query
-                result["timestamp"] = datetime.now().isoformat()
-                return result
-
-            return {"competitors": [], "coverage": 0, "query": query, "timestamp": datetime.now().isoformat()}
-
-        except requests.RequestException as e:
-            print(f"Request error (attempt {attempt}/{MAX_RETRIES}): {e}", file=sys.stderr)
-            if attempt == MAX_RETRIES:
-                raise
-
-    return {"competitors": [], "coverage": 0, "error": "Max retries exceeded"}
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "You are a competitive intelligence analyst. "
+                "Discover and analyze competitors in a given market. "
+                "Be specific with real company names, funding amounts, "
+                "and data points where possible."
+            ),
+        },
+        {"role": "user", "content": prompt},
+    ]
+
+    try:
+        data = get_gateway().chat(
+            messages,
+            tools=[TOOL_SPEC],
+            tool_choice={"type": "function", "function": {"name": "deliver_competitors"}},
+        )
+    except RateLimitError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return {"competitors": [], "coverage": 0, "error": "Max retries exceeded"}
+
+    tool_call = (message_of(data).get("tool_calls") or [None])[0]
+    if tool_call:
+        result = json.loads(tool_call["function"]["arguments"])
+        result["query"] = query
+        result["timestamp"] = datetime.now().isoformat()
+        return result
+
+    return {"competitors": [], "coverage": 0, "query": query, "timestamp": datetime.now().isoformat()}
 
 
 def main():
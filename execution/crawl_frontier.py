@@ -0,0 +1,166 @@
+"""
+Crawl Frontier — Execution Module
+Breadth-first URL frontier for scrape_website's --crawl mode: normalizes
+and de-duplicates discovered links, applies domain, include/exclude, depth
+and page-budget limits, and hands out URLs in FIFO (breadth-first) order.
+Links come from the markdown Firecrawl already returned, so discovering
+them costs no extra requests.
+
+Directive: directives/scrape_website.md
+"""
+
+import hashlib
+import math
+import os
+import re
+import sys
+from collections import deque
+from urllib.parse import urldefrag, urljoin, urlparse
+
+try:
+    from execution.scrape_scheduler import domain_of, normalize_url
+except ImportError:
+    sys.path.insert(0, os.path.dirname(__file__))
+    from scrape_scheduler import domain_of, normalize_url
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+DEFAULT_MAX_DEPTH = 2
+DEFAULT_MAX_PAGES = 100
+BLOOM_MIN_PAGES = 10_000     # crawls with a larger budget track seen URLs in a Bloom filter
+LINKS_PER_PAGE = 100         # expected distinct links discovered per page, for sizing the filter
+BLOOM_ERROR_RATE = 1e-4      # a false positive skips one URL that was never crawled
+
+# Links to files that are not pages
+SKIP_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico", ".pdf", ".zip", ".gz",
+    ".css", ".js", ".json", ".xml", ".mp4", ".mp3", ".woff", ".woff2",
+}
+
+# [text](url "title") and <https://...>. Images are removed first, so a linked
+# image ([![logo](/logo.png)](/home)) yields its link target, not the image
+_IMAGE = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+_MARKDOWN_LINK = re.compile(r"\[[^\]]*\]\(\s*<?([^)\s>]+)>?(?:\s+[\"'][^)]*[\"'])?\s*\)")
+_AUTOLINK = re.compile(r"<(https?://[^>\s]+)>")
+
+
+def extract_links(markdown: str, base_url: str) -> list[str]:
+    """Absolute http(s) page links in a page's markdown, in order of appearance.
+
+    Links are resolved against the page URL and lose their fragment, but are
+    otherwise left as written: the frontier normalizes them only to check
+    whether they were seen, and fetches them as they are.
+    """
+    text = _IMAGE.sub(r"\1", markdown)
+    hrefs = _MARKDOWN_LINK.findall(text) + _AUTOLINK.findall(text)
+
+    out = {}
+    for href in hrefs:
+        absolute = urldefrag(urljoin(base_url, href))[0]
+        parts = urlparse(absolute)
+        if parts.scheme not in ("http", "https"):
+            continue  # mailto:, tel:, javascript:
+        if os.path.splitext(parts.path)[1].lower() in SKIP_EXTENSIONS:
+            continue
+        out.setdefault(normalize_url(absolute), absolute)
+    return list(out.values())
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one blake2b digest)."""
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+def make_seen_set(max_pages: int):
+    """A plain set for ordinary crawls; a Bloom filter once the budget makes a set large."""
+    if max_pages >= BLOOM_MIN_PAGES:
+        return BloomFilter(max_pages * LINKS_PER_PAGE)
+    return set()
+
+
+class CrawlFrontier:
+    """FIFO queue of (url, depth) with a seen-set and crawl limits.
+
+    The seen-set is keyed on normalize_url(url), so "www.", tracking
+    parameters and query order don't cause refetches; the queue holds the
+    URL as found, which is what gets fetched.
+
+    Seeds are always crawled (depth 0). Discovered links must stay on a seed's
+    domain, match an `include` pattern (if any) and no `exclude` pattern, and
+    be at most `max_depth` links from a seed. `pop` stops handing out URLs
+    after `max_pages`. Not thread-safe: the crawl loop owns it.
+    """
+
+    def __init__(
+        self,
+        seeds: list[str],
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        max_pages: int = DEFAULT_MAX_PAGES,
+        include: list[str] = (),
+        exclude: list[str] = (),
+    ):
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.include = [re.compile(p) for p in include]
+        self.exclude = [re.compile(p) for p in exclude]
+        self.seeds = [s.strip() for s in seeds if s.strip()]
+        self.domains = {domain_of(s) for s in self.seeds}
+        self.seen = make_seen_set(max_pages)
+        self.queue: deque = deque()
+        self.issued = 0
+        self.stats = {"queued": 0, "duplicate": 0, "filtered": 0, "too_deep": 0}
+        for seed in self.seeds:
+            key = normalize_url(seed)
+            if key in self.seen:
+                continue
+            self.seen.add(key)
+            self.queue.append((seed, 0))
+            self.stats["queued"] += 1
+
+    def allows(self, url: str) -> bool:
+        if domain_of(url) not in self.domains:
+            return False
+        if self.include and not any(p.search(url) for p in self.include):
+            return False
+        return not any(p.search(url) for p in self.exclude)
+
+    def push(self, url: str, depth: int) -> bool:
+        """Queue a discovered link; False if it was seen, filtered or too deep."""
+        if depth > self.max_depth:
+            self.stats["too_deep"] += 1
+            return False
+        key = normalize_url(url)
+        if key in self.seen:
+            self.stats["duplicate"] += 1
+            return False
+        self.seen.add(key)
+        if not self.allows(url):
+            self.stats["filtered"] += 1
+            return False
+        self.queue.append((url, depth))
+        self.stats["queued"] += 1
+        return True
+
+    def pop(self) -> tuple[str, int] | None:
+        """Next (url, depth) to fetch, or None if the queue is empty or the budget is spent."""
+        if not self.queue or self.issued >= self.max_pages:
+            return None
+        self.issued += 1
+        return self.queue.popleft()
@@ -0,0 +1,227 @@
+"""
+Dedup — Execution Module
+Removes repeated content from scraped pages before rag_ingest embeds it:
+
+1. Boilerplate: markdown blocks (nav bars, footers, cookie banners) that
+   appear on many pages of the same domain. A pre-pass counts, per domain,
+   how many pages contain each block; blocks above the threshold are cut
+   from every page of that domain before chunking.
+2. Near-duplicate chunks: MinHash signatures over word shingles, bucketed
+   with banded LSH, so each chunk is compared only with its few candidates
+   (linear in the number of chunks). Chunks are indexed in a fixed order
+   during the pre-pass, and one whose estimated Jaccard similarity to an
+   earlier one reaches the threshold is dropped, so the same copy survives
+   on every run. This catches localized or lightly edited copies of a page.
+
+Directive: directives/rag_pipeline.md
+"""
+
+import hashlib
+import os
+import re
+import sys
+import threading
+import zlib
+from collections import Counter, defaultdict
+from urllib.parse import urlparse
+
+import numpy as np
+
+try:
+    from execution.chunking import iter_blocks, iter_lines
+except ImportError:
+    sys.path.insert(0, os.path.dirname(__file__))
+    from chunking import iter_blocks, iter_lines
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+BOILERPLATE_MIN_PAGES = 3        # a block must repeat on at least this many pages...
+BOILERPLATE_PAGE_RATIO = 0.3     # ...and on at least this share of the domain's pages
+NEAR_DUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))  # estimated Jaccard to drop a chunk
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 16                   # 16 bands x 8 rows: pairs above ~0.7 Jaccard become candidates
+SHINGLE_WORDS = 5
+MINHASH_SEED = 1
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_WORD = re.compile(r"\w+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _domain(url: str) -> str:
+    host = (urlparse(url or "").hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def block_fingerprint(text: str) -> int:
+    """64-bit fingerprint of a block, ignoring case and whitespace."""
+    normalized = _WHITESPACE.sub(" ", text).strip().lower()
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _chunk_key(chunk: dict) -> str:
+    return f"{chunk['source']}#{chunk['chunk_index']}"
+
+
+def _render(kind: str, level: int | None, text: str) -> str:
+    return ("#" * level + " " + text if kind == "heading" else text) + "\n\n"
+
+
+# ---------------------------------------------------------------------------
+# Boilerplate
+# ---------------------------------------------------------------------------
+
+class BoilerplateIndex:
+    """Per-domain document frequency of block fingerprints (headings excluded)."""
+
+    def __init__(self, min_pages: int = BOILERPLATE_MIN_PAGES, page_ratio: float = BOILERPLATE_PAGE_RATIO):
+        self.min_pages = min_pages
+        self.page_ratio = page_ratio
+        self.pages: Counter = Counter()
+        self.df: dict[str, Counter] = defaultdict(Counter)
+
+    def add_page(self, url: str, pieces) -> None:
+        domain = _domain(url)
+        self.pages[domain] += 1
+        self.df[domain].update({
+            block_fingerprint(text) for kind, _, text in iter_blocks(iter_lines(pieces)) if kind != "heading"
+        })
+
+    def is_boilerplate(self, domain: str, fingerprint: int) -> bool:
+        pages = self.pages[domain]
+        needed = max(self.min_pages, self.page_ratio * pages)
+        return pages >= self.min_pages and self.df[domain][fingerprint] >= needed
+
+    def boilerplate_count(self) -> int:
+        return sum(1 for domain, counts in self.df.items() for fp in counts if self.is_boilerplate(domain, fp))
+
+
+# ---------------------------------------------------------------------------
+# Near duplicates
+# ---------------------------------------------------------------------------
+
+class MinHasher:
+    """MinHash signatures from universal hashes (a*x + b) mod p over crc32 shingle hashes."""
+
+    def __init__(self, permutations: int = MINHASH_PERMUTATIONS, seed: int = MINHASH_SEED):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _MERSENNE_PRIME, size=(permutations, 1), dtype=np.uint64)
+        self.b = rng.integers(0, _MERSENNE_PRIME, size=(permutations, 1), dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower())
+        if len(words) <= SHINGLE_WORDS:
+            shingles = {" ".join(words)}
+        else:
+            shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # a, b < 2^31 and hashes < 2^32, so a * x + b fits in uint64
+        return ((self.a * hashes + self.b) % _MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """Banded LSH over MinHash signatures. `check_and_add` is thread-safe."""
+
+    def __init__(self, threshold: float = NEAR_DUP_THRESHOLD, bands: int = LSH_BANDS,
+                 permutations: int = MINHASH_PERMUTATIONS):
+        if permutations % bands:
+            raise ValueError("permutations must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = permutations // bands
+        self.hasher = MinHasher(permutations)
+        self._buckets: list[dict[bytes, list[int]]] = [defaultdict(list) for _ in range(bands)]
+        self._signatures: list[np.ndarray] = []
+        self._keys: list[str] = []
+        self._lock = threading.Lock()
+
+    def check_and_add(self, key: str, text: str) -> str | None:
+        """Key of an earlier near-duplicate of `text`, or None (then `text` is indexed under `key`)."""
+        signature = self.hasher.signature(text)
+        bands = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+        with self._lock:
+            candidates = set()
+            for bucket, band in zip(self._buckets, bands):
+                candidates.update(bucket.get(band, ()))
+            for candidate in sorted(candidates):
+                if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                    return self._keys[candidate]
+            row = len(self._signatures)
+            self._signatures.append(signature)
+            self._keys.append(key)
+            for bucket, band in zip(self._buckets, bands):
+                bucket[band].append(row)
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Pipeline stage
+# ---------------------------------------------------------------------------
+
+class Deduplicator:
+    """Boilerplate stripping + near-duplicate chunk filter for one ingest run.
+
+    The pre-pass feeds every scraped page to `add_page`, then every scraped
+    chunk to `add_chunk` in a fixed order, and calls `end_scan`. After that,
+    use `strip_boilerplate` on page text before chunking and
+    `is_near_duplicate` on each chunk.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUP_THRESHOLD):
+        self.boilerplate = BoilerplateIndex()
+        self.near_dups = NearDuplicateIndex(threshold)
+        self.duplicate_of: dict[str, str] = {}   # dropped chunk key -> key of the copy kept
+        self.scanning = True
+        self._lock = threading.Lock()
+        self.stats = {
+            "pages": 0, "boilerplate_blocks_removed": 0, "boilerplate_chars_removed": 0,
+            "near_duplicate_chunks": 0, "embeddings_saved": 0,
+        }
+
+    def add_page(self, url: str, pieces) -> None:
+        self.boilerplate.add_page(url, pieces)
+        self.stats["pages"] += 1
+
+    def strip_boilerplate(self, url: str, pieces):
+        """Yield the page's markdown without its domain's boilerplate blocks."""
+        domain = _domain(url)
+        removed = removed_chars = 0
+        for kind, level, text in iter_blocks(iter_lines(pieces)):
+            if kind != "heading" and self.boilerplate.is_boilerplate(domain, block_fingerprint(text)):
+                removed += 1
+                removed_chars += len(text)
+                continue
+            yield _render(kind, level, text)
+        if self.scanning:
+            return  # the pre-pass chunks pages too; count removals once, in the ingest pass
+        with self._lock:
+            self.stats["boilerplate_blocks_removed"] += removed
+            self.stats["boilerplate_chars_removed"] += removed_chars
+
+    def add_chunk(self, chunk: dict) -> None:
+        """Pre-pass: index a chunk, or record it as a duplicate of one added before it."""
+        body = chunk["content"]
+        section = chunk.get("metadata", {}).get("section")
+        if section and body.startswith(section):
+            body = body[len(section):]  # compare bodies, not breadcrumbs
+        key = _chunk_key(chunk)
+        original = self.near_dups.check_and_add(key, body)
+        if original is not None:
+            self.duplicate_of[key] = original
+
+    def end_scan(self) -> None:
+        self.scanning = False
+
+    def is_near_duplicate(self, chunk: dict, would_embed: bool) -> bool:
+        """True if the pre-pass found the chunk repeats an earlier one; `would_embed` marks
+        chunks that were not already indexed, i.e. dropping them saves an embedding call."""
+        if _chunk_key(chunk) not in self.duplicate_of:
+            return False
+        with self._lock:
+            self.stats["near_duplicate_chunks"] += 1
+            self.stats["embeddings_saved"] += int(would_embed)
+        return True
+
+    def summary(self) -> dict:
+        return {**self.stats, "boilerplate_blocks": self.boilerplate.boilerplate_count()}
@@ -0,0 +1,173 @@
+"""
+Embedding Backend — Execution Module
+Selects how the bge-small embedding model runs on this machine:
+
+- "torch" (default): sentence_transformers on PyTorch
+- "onnx": an ONNX Runtime export of the same model, fp32
+- "onnx-int8": the ONNX export with int8 dynamic quantization of the weights
+
+The ONNX backends need only onnxruntime + tokenizers at run time (no torch
+import), and produce the same CLS-pooled, L2-normalized 384-dim vectors as
+the torch path, so they are interchangeable with the stored pgvector data.
+The export (torch + transformers) runs once, on first use, into
+ONNX_MODEL_DIR.
+
+Directive: directives/rag_pipeline.md
+"""
+
+import inspect
+import os
+
+import numpy as np
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", ".tmp/onnx")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))   # 0 = onnxruntime default (all physical cores)
+ONNX_OPSET = 14
+MAX_SEQ_LENGTH = 512
+DEFAULT_BATCH_SIZE = 32
+
+
+def load_model(model_name: str, backend: str | None = None):
+    """SentenceTransformer for "torch", OnnxEmbedder for the ONNX backends."""
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}' (expected one of {', '.join(BACKENDS)})")
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    return OnnxEmbedder(model_name, quantize=backend == "onnx-int8")
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+def model_dir(model_name: str) -> str:
+    return os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "__"))
+
+
+def export_onnx(model_name: str, out_dir: str, quantize: bool) -> str:
+    """Export (and optionally quantize) the model once; returns the .onnx path to load.
+
+    The graph ends at the [CLS] hidden state, which is what the
+    sentence_transformers config for bge pools; normalization happens in numpy.
+    """
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    int8_path = os.path.join(out_dir, "model.int8.onnx")
+
+    if not os.path.exists(fp32_path):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        print(f"Exporting {model_name} to ONNX (one-time)...")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+
+        class ClsPooling(torch.nn.Module):
+            def __init__(self, encoder):
+                super().__init__()
+                self.encoder = encoder
+
+            def forward(self, input_ids, attention_mask, token_type_ids):
+                out = self.encoder(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
+                return out.last_hidden_state[:, 0]
+
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        inputs = ("input_ids", "attention_mask", "token_type_ids")
+        os.makedirs(out_dir, exist_ok=True)
+        tmp = fp32_path + ".tmp"
+        # torch >= 2.9 defaults to the dynamo exporter (needs onnxscript); dynamic_axes is TorchScript's
+        legacy = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+        with torch.no_grad():
+            torch.onnx.export(
+                ClsPooling(model), tuple(sample[name] for name in inputs), tmp,
+                input_names=list(inputs), output_names=["embedding"],
+                dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in inputs}, "embedding": {0: "batch"}},
+                opset_version=ONNX_OPSET, **legacy,
+            )
+        tokenizer.save_pretrained(out_dir)  # tokenizer.json for the runtime
+        os.replace(tmp, fp32_path)
+
+    if not quantize:
+        return fp32_path
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print("Quantizing ONNX model to int8 (one-time)...")
+        tmp = int8_path + ".tmp"
+        quantize_dynamic(fp32_path, tmp, weight_type=QuantType.QInt8)
+        os.replace(tmp, int8_path)
+    return int8_path
+
+
+# ---------------------------------------------------------------------------
+# Runtime
+# ---------------------------------------------------------------------------
+
+class OnnxEmbedder:
+    """The SentenceTransformer calls the pipeline makes (`encode`, `max_seq_length`,
+    `get_sentence_embedding_dimension`, `token_lengths`) on ONNX Runtime."""
+
+    def __init__(self, model_name: str, quantize: bool = False):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.backend = "onnx-int8" if quantize else "onnx"
+        directory = model_dir(model_name)
+        path = export_onnx(model_name, directory, quantize)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.no_padding()
+        self.max_seq_length = MAX_SEQ_LENGTH
+        self._pad_id = self.tokenizer.token_to_id("[PAD]") or 0
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._dim = self.session.get_outputs()[0].shape[-1]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dim
+
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        """Token counts with [CLS]/[SEP], truncated at max_seq_length."""
+        return [len(enc.ids) for enc in self.tokenizer.encode_batch(texts)]
+
+    def encode(self, sentences, batch_size: int = DEFAULT_BATCH_SIZE, normalize_embeddings: bool = False,
+               show_progress_bar=None, **kwargs) -> np.ndarray:
+        """Encode texts in length-sorted batches (as sentence_transformers does) and restore input order."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.zeros((len(texts), self._dim), dtype=np.float32)
+        if not texts:
+            return out
+
+        encodings = self.tokenizer.encode_batch(texts)
+        order = sorted(range(len(texts)), key=lambda i: -len(encodings[i].ids))
+        batch_size = max(1, batch_size)
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            width = max(len(encodings[i].ids) for i in idx)
+            ids = np.full((len(idx), width), self._pad_id, dtype=np.int64)
+            mask = np.zeros((len(idx), width), dtype=np.int64)
+            for row, i in enumerate(idx):
+                n = len(encodings[i].ids)
+                ids[row, :n] = encodings[i].ids
+                mask[row, :n] = 1
+            out[idx] = self.session.run(None, {
+                "input_ids": ids, "attention_mask": mask, "token_type_ids": np.zeros_like(ids),
+            })[0]
+
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.where(norms == 0, 1, norms)
+        return out[0] if single else out
@@ -0,0 +1,173 @@
+"""
+Embedding Cache — Execution Module
+Two-tier cache for text embeddings shared by rag_query (query vectors) and
+rag_ingest (chunk vectors): a bounded in-memory LRU in front of an optional
+SQLite tier that survives process restarts.
+
+Directive: directives/rag_pipeline.md
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from execution.embedding_backend import EMBEDDING_BACKEND
+except ImportError:
+    sys.path.insert(0, os.path.dirname(__file__))
+    from embedding_backend import EMBEDDING_BACKEND
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+DEFAULT_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+# Empty string disables the on-disk tier
+DEFAULT_DB_PATH = os.getenv("EMBEDDING_CACHE_DB", ".tmp/embedding_cache.sqlite")
+# Backends whose vectors differ from torch's and so get their own keys;
+# fp32 onnx matches torch (cosine 1.0) and shares them
+SEPARATE_KEY_BACKENDS = {"onnx-int8"}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize and collapse whitespace; tokenization is unchanged by this."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class EmbeddingCache:
+    """LRU + SQLite cache keyed on sha256(model name [+ backend] + normalized text).
+
+    The backend is part of the key only for SEPARATE_KEY_BACKENDS, so torch and
+    onnx share entries but int8 vectors never stand in for fp32 ones.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = DEFAULT_MAX_ENTRIES, db_path: str | None = DEFAULT_DB_PATH,
+                 backend: str | None = None):
+        self.model_name = model_name
+        self.backend = (backend or EMBEDDING_BACKEND).lower()
+        self._namespace = f"{model_name}\0{self.backend}" if self.backend in SEPARATE_KEY_BACKENDS else model_name
+        self.max_entries = max_entries
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("pragma journal_mode=wal")
+            self._db.execute("create table if not exists embeddings (key text primary key, vector blob not null)")
+            self._db.commit()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self._namespace}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    # -- lookup -------------------------------------------------------------
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        """Cached vectors for `texts` (None for misses), promoting disk hits to memory."""
+        return self._get_keys([self.key(t) for t in texts])
+
+    def _get_keys(self, keys: list[str]) -> list[np.ndarray | None]:
+        found: list[np.ndarray | None] = [None] * len(keys)
+
+        with self._lock:
+            disk_lookup = []
+            for i, k in enumerate(keys):
+                vec = self._memory.get(k)
+                if vec is not None:
+                    self._memory.move_to_end(k)
+                    found[i] = vec
+                    self.memory_hits += 1
+                else:
+                    disk_lookup.append(i)
+
+            if disk_lookup and self._db is not None:
+                wanted = sorted({keys[i] for i in disk_lookup})
+                rows = {}
+                for start in range(0, len(wanted), 500):
+                    batch = wanted[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows.update(self._db.execute(
+                        f"select key, vector from embeddings where key in ({placeholders})", batch
+                    ).fetchall())
+                for i in disk_lookup:
+                    blob = rows.get(keys[i])
+                    if blob is not None:
+                        found[i] = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(keys[i], found[i])
+                        self.disk_hits += 1
+
+            self.misses += sum(1 for v in found if v is None)
+        return found
+
+    def put_many(self, texts: list[str], vectors) -> None:
+        """Store vectors in both tiers."""
+        self._put_keys([self.key(t) for t in texts], vectors)
+
+    def _put_keys(self, keys: list[str], vectors) -> None:
+        entries = [(k, np.asarray(v, dtype=np.float32)) for k, v in zip(keys, vectors)]
+        with self._lock:
+            for k, vec in entries:
+                self._remember(k, vec)
+            if self._db is not None:
+                self._db.executemany(
+                    "insert or replace into embeddings (key, vector) values (?, ?)",
+                    [(k, vec.tobytes()) for k, vec in entries],
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, vec: np.ndarray) -> None:
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    # -- encode-through -----------------------------------------------------
+
+    def encode(self, texts: list[str], encode_fn) -> np.ndarray:
+        """Embeddings for `texts`, calling encode_fn(list[str]) -> (n, dim) only for misses.
+
+        Texts with the same cache key within one call are encoded once.
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [self.key(t) for t in texts]
+        found = self._get_keys(keys)
+
+        missing: dict[str, list[int]] = {}
+        for i, vec in enumerate(found):
+            if vec is None:
+                missing.setdefault(keys[i], []).append(i)
+
+        if missing:
+            new_keys = list(missing)
+            new_vecs = np.asarray(encode_fn([texts[missing[k][0]] for k in new_keys]), dtype=np.float32)
+            self._put_keys(new_keys, new_vecs)
+            for k, vec in zip(new_keys, new_vecs):
+                for i in missing[k]:
+                    found[i] = vec
+
+        return np.vstack(found)
+
+    # -- stats --------------------------------------------------------------
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
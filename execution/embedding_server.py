@@ -0,0 +1,419 @@
+"""
+Embedding Server — Execution Script
+Long-lived local process that keeps the embedding model loaded and serves
+encode requests over a Unix socket, so CLI runs of rag_query, rag_ingest and
+chat_analysis skip the multi-second sentence_transformers/torch startup.
+Concurrent requests (from threads or processes) are micro-batched into one
+forward pass.
+
+`connect()` returns an EmbeddingClient with the SentenceTransformer methods
+the pipeline uses, or None when no server is running; each module's
+get_model() tries it before loading the model in-process.
+
+Usage:
+    python execution/embedding_server.py              # serve in the foreground
+    python execution/embedding_server.py --status     # ping a running server
+
+Directive: directives/rag_pipeline.md
+"""
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+try:
+    from execution.embedding_backend import BACKENDS, EMBEDDING_BACKEND, load_model
+except ImportError:
+    sys.path.insert(0, os.path.dirname(__file__))
+    from embedding_backend import BACKENDS, EMBEDDING_BACKEND, load_model
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+SOCKET_PATH = os.getenv("EMBEDDING_SOCKET", ".tmp/embedding.sock")
+# "auto": use a running server if there is one; "off": always load in-process
+EMBEDDING_SERVER = os.getenv("EMBEDDING_SERVER", "auto").lower()
+MAX_BATCH_TEXTS = 64        # texts per forward pass when coalescing requests
+MAX_WAIT_MS = 5             # how long the first request waits for others to join its batch
+CONNECT_TIMEOUT = 0.5       # seconds; a server that doesn't answer this fast is treated as absent
+# Read timeout per request: base + per text. A server that misses it (stuck forward pass,
+# stopped process) is abandoned and the client falls back to an in-process model
+REQUEST_TIMEOUT = float(os.getenv("EMBEDDING_SERVER_TIMEOUT", "30"))
+REQUEST_TIMEOUT_PER_TEXT = 0.05
+
+_HEADER = struct.Struct("!II")  # header length, payload length
+
+
+class EmbeddingServerError(RuntimeError):
+    """The server answered with an error."""
+
+
+# ---------------------------------------------------------------------------
+# Wire format: [header len][payload len] JSON header, raw payload
+# ---------------------------------------------------------------------------
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("Embedding server connection closed")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def send_message(sock: socket.socket, header: dict, payload: bytes = b"") -> None:
+    raw = json.dumps(header).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(raw), len(payload)) + raw + payload)
+
+
+def recv_message(sock: socket.socket) -> tuple[dict, bytes]:
+    header_len, payload_len = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    header = json.loads(_recv_exact(sock, header_len))
+    payload = _recv_exact(sock, payload_len) if payload_len else b""
+    return header, payload
+
+
+# ---------------------------------------------------------------------------
+# Server
+# ---------------------------------------------------------------------------
+
+class _Job:
+    def __init__(self, texts: list[str], normalize: bool):
+        self.texts = texts
+        self.normalize = normalize
+        self.done = threading.Event()
+        self.result: np.ndarray | None = None
+        self.error: Exception | None = None
+
+
+class MicroBatcher:
+    """Single model thread that merges queued encode jobs into shared forward passes.
+
+    The first job in an empty queue waits up to `max_wait_ms` for others;
+    jobs are merged until `max_batch` texts. Jobs larger than that run alone.
+    """
+
+    def __init__(self, model, max_batch: int = MAX_BATCH_TEXTS, max_wait_ms: float = MAX_WAIT_MS):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: queue.Queue[_Job] = queue.Queue()
+        self.stats = {"requests": 0, "texts": 0, "forward_passes": 0, "seconds": 0.0}
+        threading.Thread(target=self._loop, daemon=True, name="embed-batcher").start()
+
+    def encode(self, texts: list[str], normalize: bool) -> np.ndarray:
+        job = _Job(texts, normalize)
+        self._queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _loop(self):
+        while True:
+            jobs = [self._queue.get()]
+            count = len(jobs[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                count += len(job.texts)
+
+            for normalize in (True, False):
+                group = [j for j in jobs if j.normalize == normalize]
+                if group:
+                    self._run(group, normalize)
+
+    def _run(self, jobs: list[_Job], normalize: bool):
+        texts = [t for j in jobs for t in j.texts]
+        start = time.perf_counter()
+        try:
+            vectors = np.asarray(self.model.encode(
+                texts, batch_size=min(len(texts), self.max_batch) or 1,
+                normalize_embeddings=normalize, show_progress_bar=False,
+            ), dtype=np.float32)
+        except Exception as e:
+            for j in jobs:
+                j.error = e
+                j.done.set()
+            return
+
+        self.stats["requests"] += len(jobs)
+        self.stats["texts"] += len(texts)
+        self.stats["forward_passes"] += 1
+        self.stats["seconds"] += time.perf_counter() - start
+        offset = 0
+        for j in jobs:
+            j.result = vectors[offset:offset + len(j.texts)]
+            offset += len(j.texts)
+            j.done.set()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """One client connection; serves requests until the client disconnects."""
+
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                header, _ = recv_message(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+            try:
+                op = header.get("op")
+                if op == "encode":
+                    vectors = server.batcher.encode(header["texts"], bool(header.get("normalize")))
+                    send_message(self.request, {"shape": list(vectors.shape)}, vectors.tobytes())
+                elif op == "token_lengths":
+                    send_message(self.request, {"lengths": server.token_lengths(header["texts"])})
+                elif op == "info":
+                    send_message(self.request, server.info())
+                else:
+                    send_message(self.request, {"error": f"Unknown op: {op}"})
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:
+                send_message(self.request, {"error": f"{type(e).__name__}: {e}"})
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128    # many threads/processes connect at once in batch runs
+
+    def __init__(self, socket_path: str, model_name: str = EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND,
+                 max_batch: int = MAX_BATCH_TEXTS, max_wait_ms: float = MAX_WAIT_MS):
+        print(f"Loading embedding model: {model_name} ({backend})...")
+        start = time.perf_counter()
+        self.model = load_model(model_name, backend)
+        self.model_name = model_name
+        self.backend = backend
+        self.load_seconds = time.perf_counter() - start
+        self.started = time.time()
+        self.batcher = MicroBatcher(self.model, max_batch, max_wait_ms)
+
+        os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # stale socket from a previous run (main() checked nothing answers)
+        super().__init__(socket_path, _Handler)
+
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        if hasattr(self.model, "token_lengths"):
+            return self.model.token_lengths(texts)
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if tokenizer is None:
+            return [max(1, len(t) // 4) for t in texts]
+        encoded = tokenizer(texts, add_special_tokens=True, truncation=True, max_length=self.max_seq_length(),
+                            return_attention_mask=False, return_token_type_ids=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def max_seq_length(self) -> int:
+        return getattr(self.model, "max_seq_length", None) or 512
+
+    def info(self) -> dict:
+        stats = self.batcher.stats
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "dim": self.model.get_sentence_embedding_dimension(),
+            "max_seq_length": self.max_seq_length(),
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started),
+            "load_seconds": round(self.load_seconds, 2),
+            **{k: round(v, 2) if isinstance(v, float) else v for k, v in stats.items()},
+            "texts_per_pass": round(stats["texts"] / stats["forward_passes"], 1) if stats["forward_passes"] else 0.0,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+class EmbeddingClient:
+    """Drop-in for the SentenceTransformer calls the pipeline makes (`encode`,
+    `max_seq_length`, `get_sentence_embedding_dimension`, `token_lengths`).
+
+    Each thread keeps its own connection so concurrent callers reach the
+    server's batcher together. If the server goes away mid-run, the model is
+    loaded in-process and used from then on.
+    """
+
+    def __init__(self, socket_path: str, info: dict):
+        self.socket_path = socket_path
+        self.model_name = info["model"]
+        self.max_seq_length = info["max_seq_length"]
+        self._dim = info["dim"]
+        self._local = threading.local()
+        self._fallback_model = None
+        self._fallback_lock = threading.Lock()
+
+    def _request(self, header: dict) -> tuple[dict, bytes]:
+        """Send one request; retries once on a fresh connection (e.g. after a server restart).
+
+        Raises TimeoutError (an OSError) without retrying if the server does not
+        answer within REQUEST_TIMEOUT + REQUEST_TIMEOUT_PER_TEXT per text.
+        """
+        timeout = REQUEST_TIMEOUT + REQUEST_TIMEOUT_PER_TEXT * len(header.get("texts", ()))
+        for attempt in range(2):
+            sock = getattr(self._local, "sock", None)
+            try:
+                if sock is None:
+                    sock = self._local.sock = _connect(self.socket_path, timeout=timeout)
+                sock.settimeout(timeout)
+                send_message(sock, header)
+                response, payload = recv_message(sock)
+                break
+            except (ConnectionError, OSError) as e:
+                self._local.sock = None
+                if sock is not None:
+                    sock.close()
+                if attempt or isinstance(e, TimeoutError) or server_info(self.socket_path) is None:
+                    raise
+        if "error" in response:
+            raise EmbeddingServerError(response["error"])
+        return response, payload
+
+    def _fallback(self):
+        with self._fallback_lock:
+            if self._fallback_model is None:
+                print(f"⚠️  Embedding server at {self.socket_path} went away or stopped answering; "
+                      f"loading {self.model_name} in-process")
+                self._fallback_model = load_model(self.model_name)
+        return self._fallback_model
+
+    def encode(self, sentences, normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """Encode texts; batch_size/show_progress_bar are accepted and left to the server."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if self._fallback_model is None:
+            try:
+                response, payload = self._request({"op": "encode", "texts": texts, "normalize": normalize_embeddings})
+                vectors = np.frombuffer(payload, dtype=np.float32).reshape(response["shape"])
+                return vectors[0] if single else vectors
+            except (ConnectionError, OSError):
+                pass
+        return self._fallback().encode(sentences, normalize_embeddings=normalize_embeddings, **kwargs)
+
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        """Token counts (with special tokens, truncated at max_seq_length) from the server's tokenizer."""
+        if self._fallback_model is None:
+            try:
+                return self._request({"op": "token_lengths", "texts": texts})[0]["lengths"]
+            except (ConnectionError, OSError):
+                pass
+        model = self._fallback()
+        if hasattr(model, "token_lengths"):
+            return model.token_lengths(texts)
+        encoded = model.tokenizer(texts, add_special_tokens=True, truncation=True, max_length=self.max_seq_length,
+                                  return_attention_mask=False, return_token_type_ids=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dim
+
+
+def _connect(socket_path: str, timeout: float | None) -> socket.socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        raise
+    sock.settimeout(timeout)
+    return sock
+
+
+def server_info(socket_path: str = SOCKET_PATH) -> dict | None:
+    """The running server's info, or None if nothing answers on `socket_path`."""
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+    try:
+        with _connect(socket_path, timeout=CONNECT_TIMEOUT) as sock:
+            send_message(sock, {"op": "info"})
+            return recv_message(sock)[0]
+    except (ConnectionError, OSError, ValueError):
+        return None
+
+
+def connect(model_name: str = EMBEDDING_MODEL, socket_path: str = SOCKET_PATH,
+            backend: str | None = None) -> EmbeddingClient | None:
+    """A client for the running server, or None (disabled, not running, or serving
+    another model or backend than EMBEDDING_BACKEND / `backend`)."""
+    if EMBEDDING_SERVER == "off":
+        return None
+    info = server_info(socket_path)
+    if info is None:
+        return None
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    served = (info.get("model"), info.get("backend", "torch"))
+    if served != (model_name, backend):
+        print(f"⚠️  Embedding server serves {served[0]} ({served[1]}), not {model_name} ({backend}); "
+              f"loading in-process")
+        return None
+    return EmbeddingClient(socket_path, info)
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the embedding model loaded and serve encode requests")
+    parser.add_argument("--socket", default=SOCKET_PATH, help=f"Unix socket path (default: {SOCKET_PATH})")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help=f"Model to serve (default: {EMBEDDING_MODEL})")
+    parser.add_argument("--backend", choices=BACKENDS, default=EMBEDDING_BACKEND,
+                        help=f"Model runtime (default: EMBEDDING_BACKEND or {EMBEDDING_BACKEND})")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_TEXTS,
+                        help=f"Texts per coalesced forward pass (default: {MAX_BATCH_TEXTS})")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS,
+                        help=f"Wait for more requests before encoding (default: {MAX_WAIT_MS})")
+    parser.add_argument("--status", action="store_true", help="Print a running server's stats and exit")
+    args = parser.parse_args()
+
+    if not hasattr(socket, "AF_UNIX"):
+        print("ERROR: Unix sockets are not available on this platform", file=sys.stderr)
+        sys.exit(1)
+
+    info = server_info(args.socket)
+    if args.status:
+        if info is None:
+            print(f"❌ No embedding server on {args.socket}")
+            sys.exit(1)
+        print(json.dumps(info, indent=2))
+        return
+    if info is not None:
+        print(f"⏭️  Embedding server already running on {args.socket} (pid {info['pid']})")
+        return
+
+    server = EmbeddingServer(args.socket, args.model, args.backend, args.max_batch, args.max_wait_ms)
+    print(f"✅ Serving {args.model} ({args.backend}) on {args.socket} (loaded in {server.load_seconds:.1f}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        print(f"\n📊 {json.dumps(server.info())}")
+
+
+if __name__ == "__main__":
+    main()
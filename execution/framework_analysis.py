@@ -1,26 +1,33 @@
 """
 Framework Analysis — Execution Script
 Runs strategic analysis frameworks: SWOT, Porter's Five Forces, TAM/SAM/SOM.
+Several frameworks for the same inputs run concurrently over the shared
+gateway and are saved as one combined document.
 
 Directive: directives/framework_analysis.md
 """
 
 import argparse
+import hashlib
 import json
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-import requests
 from dotenv import load_dotenv
 
 load_dotenv()
 
-API_URL = os.getenv("AI_API_URL", "https://ai.gateway.lovable.dev/v1/chat/completions")
-API_KEY = os.getenv("AI_API_KEY") or os.getenv("LOVABLE_API_KEY")
+try:
+    from execution.llm_gateway import RateLimitError, get_gateway, message_of, require_api_key
+    from execution.single_flight import get_single_flight
+except ImportError:
+    sys.path.insert(0, os.path.dirname(__file__))
+    from llm_gateway import RateLimitError, get_gateway, message_of, require_api_key
+    from single_flight import get_single_flight
 
-MAX_RETRIES = 3
-RETRY_DELAY_SECONDS = 60
 
 FRAMEWORK_PROMPTS = {
     "swot": lambda inputs: (
@@ -69,9 +76,7 @@ TOOL_SPEC = {
 
 def run_framework(framework: str, inputs: dict) -> dict:
     """Run a strategic analysis framework."""
-    if not API_KEY:
-        print("ERROR: AI_API_KEY or LOVABLE_API_KEY not found in .env", file=sys.stderr)
-        sys.exit(1)
+    require_api_key()
 
     prompt_fn = FRAMEWORK_PROMPTS.get(framework)
     if not prompt_fn:
@@ -79,71 +84,112 @@ def run_framework(framework: str, inputs: dict) -> dict:
         print(f"ERROR: Unknown framework '{framework}'. Valid: {valid}", file=sys.stderr)
         sys.exit(1)
 
-    for attempt in range(1, MAX_RETRIES + 1):
+    # Identical concurrent requests (same framework + inputs) share one LLM call
+    normalized = json.dumps({str(k).strip().lower(): str(v).strip().lower() for k, v in inputs.items()},
+                            sort_keys=True)
+    key = "framework:" + hashlib.md5(f"{framework}:{normalized}".encode()).hexdigest()
+    result, shared = get_single_flight().do(key, lambda: _run_framework(framework, inputs, prompt_fn))
+    if shared:
+        print("🔗 Joined an identical in-flight request")
+        return {**result, "coalesced": True}
+    return result
+
+
+def _run_framework(framework: str, inputs: dict, prompt_fn) -> dict:
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "You are a strategic analysis AI. Return ONLY valid JSON, "
+                "no markdown formatting or code blocks. Be specific and data-driven."
+            ),
+        },
+        {"role": "user", "content": prompt_fn(inputs)},
+    ]
+
+    try:
+        data = get_gateway().chat(
+            messages,
+            tools=[TOOL_SPEC],
+            tool_choice={"type": "function", "function": {"name": "deliver_analysis"}},
+        )
+    except RateLimitError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return {"error": "Max retries exceeded"}
+
+    message = message_of(data)
+    tool_call = (message.get("tool_calls") or [None])[0]
+    if tool_call:
+        result = json.loads(tool_call["function"]["arguments"]).get("result", {})
+    else:
+        # Fallback: try parsing the content directly
+        content = message.get("content", "")
         try:
-            resp = requests.post(
-                API_URL,
-                headers={
-                    "Authorization": f"Bearer {API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": "google/gemini-3-flash-preview",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": (
-                                "You are a strategic analysis AI. Return ONLY valid JSON, "
-                                "no markdown formatting or code blocks. Be specific and data-driven."
-                            ),
-                        },
-                        {"role": "user", "content": prompt_fn(inputs)},
-                    ],
-                    "tools": [TOOL_SPEC],
-                    "tool_choice": {"type": "function", "function": {"name": "deliver_analysis"}},
-                },
-                timeout=120,
-            )
-
-            if resp.status_code == 429:
-                print(f"Rate limited (attempt {attempt}/{MAX_RETRIES}). Waiting {RETRY_DELAY_SECONDS}s...")
-                import time
-                time.sleep(RETRY_DELAY_SECONDS)
-                continue
-
-            resp.raise_for_status()
-            data = resp.json()
-
-            tool_call = data.get("choices", [{}])[0].get("message", {}).get("tool_calls", [None])[0]
-            if tool_call:
-                result = json.loads(tool_call["function"]["arguments"]).get("result", {})
-            else:
-                # Fallback: try parsing the content directly
-                content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-                try:
-                    result = json.loads(content)
-                except json.JSONDecodeError:
-                    result = content
-
-            return {
-                "framework": framework,
-                "inputs": inputs,
-                "result": result,
-                "timestamp": datetime.now().isoformat(),
-            }
-
-        except requests.RequestException as e:
-            print(f"Request error (attempt {attempt}/{MAX_RETRIES}): {e}", file=sys.stderr)
-            if attempt == MAX_RETRIES:
-                raise
-
-    return {"error": "Max retries exceeded"}
+            result = json.loads(content)
+        except json.JSONDecodeError:
+            result = content
+
+    return {
+        "framework": framework,
+        "inputs": inputs,
+        "result": result,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
+def run_frameworks(frameworks: list[str], inputs: dict) -> dict:
+    """Run several frameworks concurrently for the same inputs.
+
+    Every call goes through the shared gateway (one connection pool). Each
+    framework gets its own wall-clock timing, and an exception in one is
+    recorded as that framework's "error" instead of discarding the rest.
+    """
+    require_api_key()
+
+    if not frameworks:
+        print("ERROR: No frameworks to run", file=sys.stderr)
+        sys.exit(1)
+    unknown = [f for f in frameworks if f not in FRAMEWORK_PROMPTS]
+    if unknown:
+        valid = ", ".join(FRAMEWORK_PROMPTS.keys())
+        print(f"ERROR: Unknown framework(s) {', '.join(unknown)}. Valid: {valid}", file=sys.stderr)
+        sys.exit(1)
+    frameworks = list(dict.fromkeys(frameworks))
+
+    def timed(framework: str) -> dict:
+        start = time.perf_counter()
+        try:
+            output = run_framework(framework, inputs)
+            entry = {"result": output["result"]} if "error" not in output else {"error": output["error"]}
+        except Exception as e:
+            entry = {"error": f"{type(e).__name__}: {e}"}
+        entry["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        if "error" in entry:
+            print(f"  ❌ {framework} — {entry['duration_ms']:.0f} ms: {entry['error']}")
+        else:
+            print(f"  ✅ {framework} — {entry['duration_ms']:.0f} ms")
+        return entry
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(frameworks), thread_name_prefix="framework") as pool:
+        entries = dict(zip(frameworks, pool.map(timed, frameworks)))
+
+    return {
+        "frameworks": entries,
+        "inputs": inputs,
+        "succeeded": [f for f, entry in entries.items() if "error" not in entry],
+        "failed": [f for f, entry in entries.items() if "error" in entry],
+        "total_ms": round((time.perf_counter() - start) * 1000, 1),
+        "timestamp": datetime.now().isoformat(),
+    }
 
 
 def main():
     parser = argparse.ArgumentParser(description="Run strategic framework analysis")
-    parser.add_argument("--framework", required=True, choices=["swot", "porters", "tam"],
-                        help="Framework to run")
+    which = parser.add_mutually_exclusive_group(required=True)
+    which.add_argument("--framework", choices=list(FRAMEWORK_PROMPTS), help="Framework to run")
+    which.add_argument("--frameworks",
+                       help="Comma-separated frameworks to run concurrently, or 'all' (e.g. swot,porters)")
     parser.add_argument("--inputs", required=True,
                         help='JSON string of inputs, e.g. \'{"Company/Product": "Slack"}\'')
     parser.add_argument("--output", help="Output file path")
@@ -155,6 +201,32 @@ def main():
         print(f"ERROR: Invalid JSON for --inputs: {e}", file=sys.stderr)
         sys.exit(1)
 
+    if args.frameworks:
+        frameworks = (list(FRAMEWORK_PROMPTS) if args.frameworks.strip().lower() == "all"
+                      else [f.strip().lower() for f in args.frameworks.split(",") if f.strip()])
+        if not frameworks:
+            parser.error("--frameworks needs at least one framework name, or 'all'")
+        unknown = [f for f in frameworks if f not in FRAMEWORK_PROMPTS]
+        if unknown:
+            parser.error(f"--frameworks: unknown framework(s) {', '.join(unknown)} "
+                         f"(choose from {', '.join(FRAMEWORK_PROMPTS)}, or 'all')")
+        print(f"Running {len(frameworks)} frameworks concurrently: {', '.join(frameworks)}")
+        combined = run_frameworks(frameworks, inputs)
+
+        os.makedirs(".tmp", exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = args.output or f".tmp/framework_combined_{timestamp}.json"
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(combined, f, indent=2, ensure_ascii=False)
+
+        serial_ms = sum(entry["duration_ms"] for entry in combined["frameworks"].values())
+        print(f"\n⏱️  {combined['total_ms']:.0f} ms total ({serial_ms:.0f} ms if run one after another); "
+              f"{len(combined['succeeded'])} succeeded, {len(combined['failed'])} failed")
+        print(f"Saved to: {output_path}")
+        if not combined["succeeded"]:
+            sys.exit(1)
+        return
+
     result = run_framework(args.framework, inputs)
 
     # Save to .tmp/
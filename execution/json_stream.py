@@ -0,0 +1,203 @@
+"""
+JSON Stream — Execution Module
+Incremental reader for JSON / JSONL files whose records carry one very large
+string field (e.g. the `markdown` of a scraped page). Small fields are parsed
+normally; the large field is yielded as decoded text pieces, so memory stays
+bounded by the read block size, not the file size.
+
+Directive: directives/rag_pipeline.md
+"""
+
+import json
+import re
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+DEFAULT_BLOCK_SIZE = 65536
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null")
+_DELIMITER = re.compile(r"[,}\]\s]")
+
+
+class JSONStreamError(ValueError):
+    """Malformed JSON in a streamed file."""
+
+
+class _Reader:
+    """Character reader over a text file with a refillable buffer."""
+
+    def __init__(self, fp, block_size: int):
+        self.fp = fp
+        self.block_size = block_size
+        self.buf = ""
+        self.pos = 0
+
+    def fill(self, need: int = 1) -> bool:
+        """Ensure at least `need` unread chars are buffered. False at EOF."""
+        while len(self.buf) - self.pos < need:
+            block = self.fp.read(self.block_size)
+            if not block:
+                return len(self.buf) - self.pos >= need
+            self.buf = self.buf[self.pos:] + block
+            self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        return self.buf[self.pos] if self.fill() else ""
+
+    def skip_ws(self) -> str:
+        """Skip whitespace and return the next char without consuming it ('' at EOF)."""
+        while self.fill():
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+        return ""
+
+    def expect(self, char: str):
+        if self.skip_ws() != char:
+            raise JSONStreamError(f"Expected '{char}', got '{self.peek() or 'EOF'}'")
+        self.pos += 1
+
+    # -- strings ------------------------------------------------------------
+
+    def iter_string(self):
+        """Yield decoded pieces of the string at the cursor (opening quote included)."""
+        self.expect('"')
+        while True:
+            if not self.fill():
+                raise JSONStreamError("Unterminated string")
+            match = _STRING_SPECIAL.search(self.buf, self.pos)
+            if match is None:
+                piece, self.pos = self.buf[self.pos:], len(self.buf)
+                yield piece
+                continue
+
+            end = match.start()
+            if end > self.pos:
+                yield self.buf[self.pos:end]
+            self.pos = end + 1
+            if match.group() == '"':
+                return
+            yield self._read_escape()
+
+    def _read_escape(self) -> str:
+        if not self.fill():
+            raise JSONStreamError("Unterminated escape")
+        code = self.buf[self.pos]
+        self.pos += 1
+        if code != "u":
+            if code not in _ESCAPES:
+                raise JSONStreamError(f"Invalid escape '\\{code}'")
+            return _ESCAPES[code]
+
+        char = self._read_hex4()
+        # Surrogate pair: \\uD83D\\uDE00
+        if 0xD800 <= ord(char) < 0xDC00 and self.fill(6) and self.buf.startswith("\\u", self.pos):
+            self.pos += 2
+            low = self._read_hex4()
+            if 0xDC00 <= ord(low) < 0xE000:
+                return chr(0x10000 + ((ord(char) - 0xD800) << 10) + (ord(low) - 0xDC00))
+            return char + low
+        return char
+
+    def _read_hex4(self) -> str:
+        if not self.fill(4):
+            raise JSONStreamError("Truncated \\u escape")
+        digits = self.buf[self.pos:self.pos + 4]
+        self.pos += 4
+        try:
+            return chr(int(digits, 16))
+        except ValueError:
+            raise JSONStreamError(f"Invalid \\u escape '{digits}'") from None
+
+    # -- other values -------------------------------------------------------
+
+    def read_value(self):
+        """Parse the (non-streamed) value at the cursor."""
+        char = self.skip_ws()
+        if char == '"':
+            return "".join(self.iter_string())
+        if char in "{[":
+            return json.loads(self._read_container())
+
+        # Scalars end at a delimiter; make sure the whole token is buffered
+        while not _DELIMITER.search(self.buf, self.pos) and self.fill(len(self.buf) - self.pos + 1):
+            pass
+        match = _SCALAR.match(self.buf, self.pos)
+        if not match:
+            raise JSONStreamError(f"Unexpected '{self.peek() or 'EOF'}'")
+        self.pos = match.end()
+        return json.loads(match.group())
+
+    def _read_container(self) -> str:
+        """Raw text of a nested object/array, tracked by bracket depth outside strings."""
+        parts, depth, in_string, escaped = [], 0, False, False
+        while self.fill():
+            start = self.pos
+            for i in range(self.pos, len(self.buf)):
+                c = self.buf[i]
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif c == "\\":
+                        escaped = True
+                    elif c == '"':
+                        in_string = False
+                elif c == '"':
+                    in_string = True
+                elif c in "{[":
+                    depth += 1
+                elif c in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        parts.append(self.buf[start:i + 1])
+                        self.pos = i + 1
+                        return "".join(parts)
+            parts.append(self.buf[start:])
+            self.pos = len(self.buf)
+        raise JSONStreamError("Unterminated object or array")
+
+
+def iter_records(fp, stream_field: str = "markdown", block_size: int = DEFAULT_BLOCK_SIZE):
+    """Yield (fields, pieces) for each top-level object in a JSON or JSONL stream.
+
+    `fields` holds every other key parsed so far. When the object has
+    `stream_field` as a string, `pieces` is a generator of its decoded text and
+    `fields` only contains the keys that came before it (scrape_website writes
+    url and page_type first); keys after it are added to the same dict when
+    iteration moves on to the next record. Otherwise `pieces` is None and `fields` is complete.
+    """
+    reader = _Reader(fp, block_size)
+    while reader.skip_ws():
+        reader.expect("{")
+        fields: dict = {}
+        streamed = False
+
+        if reader.skip_ws() == "}":
+            reader.pos += 1
+        else:
+            while True:
+                key = "".join(reader.iter_string())
+                reader.expect(":")
+                if key == stream_field and reader.skip_ws() == '"' and not streamed:
+                    streamed = True
+                    pieces = reader.iter_string()
+                    yield fields, pieces
+                    for _ in pieces:  # drain whatever the consumer left
+                        pass
+                else:
+                    fields[key] = reader.read_value()
+
+                sep = reader.skip_ws()
+                reader.pos += 1
+                if sep == "}":
+                    break
+                if sep != ",":
+                    raise JSONStreamError(f"Expected ',' or '}}', got '{sep or 'EOF'}'")
+
+        if not streamed:
+            yield fields, None
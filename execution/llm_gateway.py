@@ -0,0 +1,384 @@
+"""
+LLM Gateway — Execution Module
+Shared client for the OpenAI-compatible AI gateway used by chat_analysis,
+competitor_discovery and framework_analysis. One keep-alive connection pool
+per process (HTTP/2 via httpx when installed, else a pooled requests
+Session), Retry-After aware exponential backoff with jitter, and per-call
+latency / token metrics.
+
+Directive: directives/chat_analysis.md
+"""
+
+import email.utils
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+API_URL = os.getenv("AI_API_URL", "https://ai.gateway.lovable.dev/v1/chat/completions")
+API_KEY = os.getenv("AI_API_KEY") or os.getenv("LOVABLE_API_KEY")
+DEFAULT_MODEL = os.getenv("AI_MODEL", "google/gemini-3-flash-preview")
+
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+BASE_DELAY_SECONDS = 1.0      # doubled per attempt, full jitter
+MAX_DELAY_SECONDS = 60.0      # also caps a server-sent Retry-After
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class GatewayError(Exception):
+    """The gateway call failed (non-retryable status, or retries exhausted).
+
+    `retries` is how many times the request was retried before giving up.
+    """
+
+    def __init__(self, message: str, status: int | None = None, retries: int = 0):
+        super().__init__(message)
+        self.status = status
+        self.retries = retries
+
+
+class RateLimitError(GatewayError):
+    """Still rate limited (429) after all retries."""
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class LLMGateway:
+    """Pooled, retrying chat-completions client. Safe to share across threads."""
+
+    def __init__(
+        self,
+        url: str = API_URL,
+        api_key: str | None = API_KEY,
+        model: str = DEFAULT_MODEL,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = BASE_DELAY_SECONDS,
+        max_delay: float = MAX_DELAY_SECONDS,
+        pool_size: int = POOL_SIZE,
+        timeout: float = READ_TIMEOUT,
+    ):
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.max_retries = max(1, max_retries)  # attempts, including the first
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._client = None
+        self.http2 = False
+        self._lock = threading.Lock()
+        self.calls: list[dict] = []
+
+    # -- transport ----------------------------------------------------------
+
+    def _get_client(self):
+        """Create the pooled HTTP client on first use."""
+        with self._lock:
+            if self._client is None:
+                try:
+                    import h2  # noqa: F401  (httpx needs it for http2=True)
+                    import httpx
+                    self._client = httpx.Client(
+                        http2=True,
+                        timeout=httpx.Timeout(self.timeout, connect=CONNECT_TIMEOUT),
+                        limits=httpx.Limits(max_connections=self.pool_size,
+                                            max_keepalive_connections=self.pool_size),
+                    )
+                    self.http2 = True
+                except ImportError:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._client = session
+            return self._client
+
+    def _post(self, payload: dict):
+        """One POST. Returns (status, headers, response); raises ConnectionError/TimeoutError."""
+        client = self._get_client()
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        if self.http2:
+            import httpx
+            try:
+                resp = client.post(self.url, headers=headers, json=payload)
+            except httpx.TimeoutException as e:
+                raise TimeoutError(str(e)) from e
+            except httpx.TransportError as e:
+                raise ConnectionError(str(e)) from e
+        else:
+            import requests
+            try:
+                resp = client.post(self.url, headers=headers, json=payload,
+                                   timeout=(CONNECT_TIMEOUT, self.timeout))
+            except requests.Timeout as e:
+                raise TimeoutError(str(e)) from e
+            except requests.RequestException as e:
+                raise ConnectionError(str(e)) from e
+        return resp.status_code, resp.headers, resp
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """Delay before retry `attempt` (1-based): Retry-After if sent, else full jitter."""
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    # -- calls --------------------------------------------------------------
+
+    def chat(self, messages: list[dict], model: str | None = None, **options) -> dict:
+        """POST a chat completion and return the parsed JSON response.
+
+        `options` (tools, tool_choice, temperature, ...) are passed through.
+        Retries 429/5xx/timeouts; the response gets a "metrics" key with this
+        call's latency, attempts and token usage.
+        """
+        payload = {"model": model or self.model, "messages": messages, **options}
+        start = time.perf_counter()
+        status, retries = None, 0
+
+        for attempt in range(1, self.max_retries + 1):
+            retry_after = None
+            try:
+                status, headers, resp = self._post(payload)
+            except (ConnectionError, TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if status < 400:
+                    data = resp.json()
+                    data["metrics"] = self._record(start, retries, status, data.get("usage") or {})
+                    return data
+                error = f"HTTP {status}: {resp.text[:200]}"
+                if status not in RETRYABLE_STATUS:
+                    self._record(start, retries, status, {})
+                    raise GatewayError(error, status, retries)
+                retry_after = parse_retry_after(headers.get("Retry-After"))
+
+            if attempt == self.max_retries:
+                break
+            delay = self.backoff(attempt, retry_after)
+            label = "Rate limited" if status == 429 else "Request error"
+            print(f"{label} (attempt {attempt}/{self.max_retries}): {error} — retrying in {delay:.1f}s",
+                  file=sys.stderr)
+            retries += 1
+            time.sleep(delay)
+
+        self._record(start, retries, status, {})
+        cls = RateLimitError if status == 429 else GatewayError
+        raise cls(f"Max retries exceeded: {error}", status, retries)
+
+    def stream_chat(self, messages: list[dict], model: str | None = None, **options) -> "ChatStream":
+        """Streaming chat completion (SSE). Iterate the result for content deltas.
+
+        Connection errors, timeouts and retryable statuses are retried until
+        the first byte of the stream arrives; after that a failure is raised.
+        """
+        payload = {
+            "model": model or self.model,
+            "messages": messages,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+            **options,
+        }
+        return ChatStream(self, payload)
+
+    def _open_stream(self, payload: dict):
+        """Open a streaming POST with retries. Returns (status, retries, line iterator, close fn)."""
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json",
+                   "Accept": "text/event-stream"}
+        status, retries, error = None, 0, ""
+        for attempt in range(1, self.max_retries + 1):
+            retry_after = None
+            client = self._get_client()
+            try:
+                if self.http2:
+                    import httpx
+                    try:
+                        ctx = client.stream("POST", self.url, headers=headers, json=payload)
+                        resp = ctx.__enter__()
+                    except httpx.TimeoutException as e:
+                        raise TimeoutError(str(e)) from e
+                    except httpx.TransportError as e:
+                        raise ConnectionError(str(e)) from e
+                    close = lambda: ctx.__exit__(None, None, None)  # noqa: E731
+                    lines = resp.iter_lines()
+                else:
+                    import requests
+                    try:
+                        resp = client.post(self.url, headers=headers, json=payload, stream=True,
+                                           timeout=(CONNECT_TIMEOUT, self.timeout))
+                    except requests.Timeout as e:
+                        raise TimeoutError(str(e)) from e
+                    except requests.RequestException as e:
+                        raise ConnectionError(str(e)) from e
+                    close = resp.close
+                    # text/event-stream is UTF-8; without a charset requests would decode it as ISO-8859-1
+                    resp.encoding = "utf-8"
+                    lines = resp.iter_lines(chunk_size=None, decode_unicode=True)  # no 512-byte buffering
+            except (ConnectionError, TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                status = resp.status_code
+                if status < 400:
+                    return status, retries, lines, close
+                body = resp.read() if self.http2 else resp.content
+                close()
+                error = f"HTTP {status}: {body[:200]!r}"
+                if status not in RETRYABLE_STATUS:
+                    raise GatewayError(error, status, retries)
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+
+            if attempt == self.max_retries:
+                break
+            delay = self.backoff(attempt, retry_after)
+            label = "Rate limited" if status == 429 else "Request error"
+            print(f"{label} (attempt {attempt}/{self.max_retries}): {error} — retrying in {delay:.1f}s",
+                  file=sys.stderr)
+            retries += 1
+            time.sleep(delay)
+
+        cls = RateLimitError if status == 429 else GatewayError
+        raise cls(f"Max retries exceeded: {error}", status, retries)
+
+    # -- metrics ------------------------------------------------------------
+
+    def _record(self, start: float, retries: int, status: int | None, usage: dict, **extra) -> dict:
+        call = {
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "attempts": retries + 1,
+            "status": status,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+            **extra,
+        }
+        with self._lock:
+            self.calls.append(call)
+        return call
+
+    def stats(self) -> dict:
+        """Aggregate metrics over all calls made through this gateway."""
+        with self._lock:
+            calls = list(self.calls)
+        if not calls:
+            return {"calls": 0}
+        latencies = sorted(c["latency_ms"] for c in calls)
+        ttfts = sorted(c["ttft_ms"] for c in calls if c.get("ttft_ms") is not None)
+        return {
+            "calls": len(calls),
+            "errors": sum(1 for c in calls if not c["status"] or c["status"] >= 400),
+            "retries": sum(c["attempts"] - 1 for c in calls),
+            "p50_ms": round(statistics.median(latencies), 1),
+            "p95_ms": latencies[max(0, round(0.95 * len(latencies)) - 1)],
+            **({"ttft_p50_ms": round(statistics.median(ttfts), 1)} if ttfts else {}),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+            "completion_tokens": sum(c["completion_tokens"] for c in calls),
+            "http2": self.http2,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+class ChatStream:
+    """Iterator over the content deltas of a streaming chat completion.
+
+    After iteration, `text` holds the full response and `metrics` the call
+    record, with `ttft_ms` (time to first content token) and `total_ms`.
+    """
+
+    def __init__(self, gateway: LLMGateway, payload: dict):
+        self.gateway = gateway
+        self.payload = payload
+        self.text = ""
+        self.metrics: dict | None = None
+
+    def __iter__(self):
+        gateway = self.gateway
+        start = time.perf_counter()
+        try:
+            status, retries, lines, close = gateway._open_stream(self.payload)
+        except GatewayError as e:
+            self.metrics = gateway._record(start, e.retries, e.status, {})
+            raise
+
+        parts, usage, ttft_ms = [], {}, None
+        try:
+            for line in lines:
+                if not line or not line.startswith("data:"):
+                    continue  # blank separators, comments, event: lines
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                usage = event.get("usage") or usage
+                delta = ((event.get("choices") or [{}])[0].get("delta") or {}).get("content")
+                if delta:
+                    if ttft_ms is None:
+                        ttft_ms = round((time.perf_counter() - start) * 1000, 1)
+                    parts.append(delta)
+                    yield delta
+        finally:
+            close()
+            self.text = "".join(parts)
+            total_ms = round((time.perf_counter() - start) * 1000, 1)
+            self.metrics = gateway._record(start, retries, status, usage, ttft_ms=ttft_ms, total_ms=total_ms)
+
+
+# ---------------------------------------------------------------------------
+# Shared instance
+# ---------------------------------------------------------------------------
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """Process-wide gateway, so every script call reuses the same warm connections."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
+
+
+def require_api_key():
+    """Exit with the standard message when no gateway key is configured."""
+    if not get_gateway().api_key:
+        print("ERROR: AI_API_KEY or LOVABLE_API_KEY not found in .env", file=sys.stderr)
+        sys.exit(1)
+
+
+def message_of(data: dict) -> dict:
+    """choices[0].message of a chat-completions response ({} if missing)."""
+    return (data.get("choices") or [{}])[0].get("message", {}) or {}
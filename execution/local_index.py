@@ -0,0 +1,376 @@
+"""
+Local Vector Index — Execution Module
+In-process alternative to the Supabase `documents` table + `match_documents`
+RPC. Embeddings live in a memory-mapped matrix (float32, float16 or int8)
+with a JSONL metadata sidecar; search is a brute-force matmul top-k, with an
+optional IVF (inverted file) index for large corpora.
+
+Directive: directives/rag_pipeline.md
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+SEARCH_BLOCK_ROWS = 65536  # rows dequantized/scored at a time
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLE = 50000
+TOMBSTONE = 0xFFFF  # types.bin code marking a deleted row
+COMPACT_DELETED_FRACTION = 0.25  # compact() is a no-op below this share of deleted rows
+
+MANIFEST_FILE = "index.json"
+EMBEDDINGS_FILE = "embeddings.bin"
+SCALES_FILE = "scales.bin"      # int8 only: per-row float32 dequantization scale
+TYPES_FILE = "types.bin"        # uint16 code per row into manifest["source_types"]
+OFFSETS_FILE = "offsets.bin"    # uint64 byte offset per row into metadata.jsonl
+METADATA_FILE = "metadata.jsonl"
+IVF_FILE = "ivf.npz"
+
+
+class LocalVectorIndex:
+    """Append-only on-disk vector store searched in-process.
+
+    Files under `path`:
+      index.json      dim, dtype, row count, source_type names
+      embeddings.bin  (count, dim) row-major in `dtype`, memory-mapped for search
+      scales.bin      int8 only — per-row float32 scale
+      types.bin       uint16 source_type code per row (filtering without JSON);
+                      TOMBSTONE marks deleted rows until compact() rewrites them
+      offsets.bin     uint64 offset per row into metadata.jsonl
+      metadata.jsonl  content, source, source_type, metadata, chunk_index per row
+      ivf.npz         optional IVF centroids + inverted lists (see build_ivf)
+    """
+
+    def __init__(self, path: str, dim: int = 384, dtype: str = "float32"):
+        self.path = path
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        else:
+            if dtype not in DTYPES:
+                raise ValueError(f"Unsupported index dtype '{dtype}'. Valid: {', '.join(DTYPES)}")
+            self.manifest = {"dim": dim, "dtype": dtype, "count": 0, "deleted": 0, "source_types": []}
+        self._ivf = None
+
+    # -- properties ---------------------------------------------------------
+
+    @property
+    def dim(self) -> int:
+        return self.manifest["dim"]
+
+    @property
+    def dtype(self) -> str:
+        return self.manifest["dtype"]
+
+    @property
+    def count(self) -> int:
+        return self.manifest["count"]
+
+    @property
+    def deleted(self) -> int:
+        return self.manifest.get("deleted", 0)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _memmap(self, name: str, dtype, shape: tuple):
+        if self.count == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=shape)
+
+    # -- write --------------------------------------------------------------
+
+    def add(self, chunks: list[dict], embeddings) -> int:
+        """Append chunks and their (normalized) embeddings. Returns rows added."""
+        if not chunks:
+            return 0
+        vecs = np.asarray(embeddings, dtype=np.float32).reshape(len(chunks), self.dim)
+        os.makedirs(self.path, exist_ok=True)
+        self._discard_uncommitted()
+
+        if self.dtype == "int8":
+            scales = np.abs(vecs).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            stored = np.round(vecs / scales[:, None]).astype(np.int8)
+            with open(self._file(SCALES_FILE), "ab") as f:
+                f.write(scales.astype(np.float32).tobytes())
+        else:
+            stored = vecs.astype(DTYPES[self.dtype])
+
+        type_names = self.manifest["source_types"]
+        codes = []
+        for chunk in chunks:
+            if chunk["source_type"] not in type_names:
+                type_names.append(chunk["source_type"])
+            codes.append(type_names.index(chunk["source_type"]))
+
+        offsets = []
+        with open(self._file(METADATA_FILE), "ab") as f:
+            for chunk in chunks:
+                offsets.append(f.tell())
+                row = {
+                    "content": chunk["content"],
+                    "source": chunk["source"],
+                    "source_type": chunk["source_type"],
+                    "metadata": chunk.get("metadata", {}),
+                    "chunk_index": chunk.get("chunk_index", 0),
+                    "content_hash": chunk.get("content_hash"),
+                }
+                f.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+
+        with open(self._file(EMBEDDINGS_FILE), "ab") as f:
+            f.write(stored.tobytes())
+        with open(self._file(TYPES_FILE), "ab") as f:
+            f.write(np.array(codes, dtype=np.uint16).tobytes())
+        with open(self._file(OFFSETS_FILE), "ab") as f:
+            f.write(np.array(offsets, dtype=np.uint64).tobytes())
+
+        # Manifest last: a crash mid-append leaves only bytes past `count`, which the next add() cuts
+        self.manifest["count"] += len(chunks)
+        self._save_manifest()
+        self._ivf = None
+        return len(chunks)
+
+    def _discard_uncommitted(self):
+        """Truncate every file to the rows the manifest counts.
+
+        A crash between the appends and the manifest write leaves extra bytes
+        at the end of each file; appending after them would shift every later
+        row out of line with `count`.
+        """
+        row_bytes = {
+            EMBEDDINGS_FILE: self.dim * np.dtype(DTYPES[self.dtype]).itemsize,
+            TYPES_FILE: np.dtype(np.uint16).itemsize,
+            OFFSETS_FILE: np.dtype(np.uint64).itemsize,
+        }
+        if self.dtype == "int8":
+            row_bytes[SCALES_FILE] = np.dtype(np.float32).itemsize
+        for name, size in row_bytes.items():
+            path = self._file(name)
+            if os.path.exists(path) and os.path.getsize(path) > self.count * size:
+                os.truncate(path, self.count * size)
+
+        path = self._file(METADATA_FILE)
+        if not os.path.exists(path):
+            return
+        end = 0
+        if self.count:
+            last = int(np.fromfile(self._file(OFFSETS_FILE), dtype=np.uint64, count=1,
+                                   offset=(self.count - 1) * row_bytes[OFFSETS_FILE])[0])
+            with open(path, "rb") as f:
+                f.seek(last)
+                end = last + len(f.readline())
+        if os.path.getsize(path) > end:
+            os.truncate(path, end)
+
+    def delete(self, rows) -> int:
+        """Tombstone rows so search skips them. Returns rows newly deleted."""
+        rows = np.unique(np.asarray(list(rows), dtype=np.int64))
+        if len(rows) == 0:
+            return 0
+        types = np.memmap(self._file(TYPES_FILE), dtype=np.uint16, mode="r+", shape=(self.count,))
+        newly = int(np.count_nonzero(types[rows] != TOMBSTONE))
+        types[rows] = TOMBSTONE
+        types.flush()
+        del types
+
+        self.manifest["deleted"] = self.deleted + newly
+        self._save_manifest()
+        return newly
+
+    def compact(self, min_deleted_fraction: float = COMPACT_DELETED_FRACTION) -> int:
+        """Rewrite the index without tombstoned rows (row ids change).
+
+        Skipped unless more than `min_deleted_fraction` of rows are deleted.
+        Returns rows dropped.
+        """
+        dropped = self.deleted
+        if dropped == 0 or dropped <= min_deleted_fraction * self.count:
+            return 0
+        types = self._memmap(TYPES_FILE, np.uint16, (self.count,))
+        live = np.flatnonzero(np.asarray(types) != TOMBSTONE)
+
+        tmp_path = self.path.rstrip("/\\") + ".compact"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        fresh = LocalVectorIndex(tmp_path, dim=self.dim, dtype=self.dtype)
+        fresh._save_manifest()
+        for start in range(0, len(live), SEARCH_BLOCK_ROWS):
+            rows = live[start:start + SEARCH_BLOCK_ROWS]
+            fresh.add(self.documents(rows), self.vectors(rows))
+
+        old_path = self.path.rstrip("/\\") + ".old"
+        os.replace(self.path, old_path)
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(old_path)
+
+        self.manifest = fresh.manifest
+        self._ivf = None
+        return dropped
+
+    def _save_manifest(self):
+        tmp_path = self._file(MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self._file(MANIFEST_FILE))
+
+    # -- read ---------------------------------------------------------------
+
+    def vectors(self, rows=None) -> np.ndarray:
+        """Dequantized float32 embeddings for `rows` (slice or index array), default all."""
+        rows = slice(None) if rows is None else rows
+        raw = self._memmap(EMBEDDINGS_FILE, DTYPES[self.dtype], (self.count, self.dim))[rows]
+        vecs = np.asarray(raw, dtype=np.float32)
+        if self.dtype == "int8":
+            scales = self._memmap(SCALES_FILE, np.float32, (self.count,))[rows]
+            vecs *= np.asarray(scales)[:, None]
+        return vecs
+
+    def documents(self, rows) -> list[dict]:
+        """Load metadata rows by index via the offsets sidecar."""
+        offsets = self._memmap(OFFSETS_FILE, np.uint64, (self.count,))
+        docs = []
+        with open(self._file(METADATA_FILE), "rb") as f:
+            for row in rows:
+                f.seek(int(offsets[row]))
+                docs.append(json.loads(f.readline()))
+        return docs
+
+    def entries(self):
+        """Yield (row, source, chunk_index, content_hash) for every live row (scans metadata.jsonl)."""
+        if self.count == 0:
+            return
+        types = self._memmap(TYPES_FILE, np.uint16, (self.count,))
+        with open(self._file(METADATA_FILE), "r", encoding="utf-8") as f:
+            for row, line in zip(range(self.count), f):
+                if types[row] == TOMBSTONE:
+                    continue
+                meta = json.loads(line)
+                yield row, meta["source"], meta.get("chunk_index", 0), meta.get("content_hash")
+
+    # -- search -------------------------------------------------------------
+
+    def search(
+        self,
+        query_embedding,
+        threshold: float = 0.65,
+        count: int = 10,
+        source_type: str = None,
+        nprobe: int = None,
+    ) -> tuple[list[dict], np.ndarray]:
+        """Top-`count` rows by cosine similarity, mirroring `match_documents`.
+
+        Keeps rows with similarity > threshold (strict, as in the SQL function),
+        optionally restricted to one source_type, ordered by similarity desc.
+        Uses the IVF index when one is built for the current row count.
+        Returns (documents with "similarity", their float32 embeddings).
+        """
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        if self.count == 0 or count <= 0:
+            return [], np.zeros((0, self.dim), dtype=np.float32)
+
+        type_code = None
+        if source_type is not None:
+            if source_type not in self.manifest["source_types"]:
+                return [], np.zeros((0, self.dim), dtype=np.float32)
+            type_code = self.manifest["source_types"].index(source_type)
+
+        ivf = self._load_ivf()
+        if ivf is not None:
+            candidates = self._ivf_candidates(ivf, query, nprobe or DEFAULT_NPROBE)
+            blocks = [candidates[i:i + SEARCH_BLOCK_ROWS] for i in range(0, len(candidates), SEARCH_BLOCK_ROWS)]
+        else:
+            blocks = [np.arange(i, min(i + SEARCH_BLOCK_ROWS, self.count))
+                      for i in range(0, self.count, SEARCH_BLOCK_ROWS)]
+
+        types = self._memmap(TYPES_FILE, np.uint16, (self.count,))
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_sims = np.zeros(0, dtype=np.float32)
+
+        for rows in blocks:
+            if type_code is not None:
+                rows = rows[np.asarray(types[rows]) == type_code]
+            elif self.deleted:
+                rows = rows[np.asarray(types[rows]) != TOMBSTONE]
+            if len(rows) == 0:
+                continue
+            sims = self.vectors(rows) @ query
+            keep = sims > threshold
+            rows, sims = rows[keep], sims[keep]
+
+            # Merge with the running top-k
+            best_rows = np.concatenate([best_rows, rows])
+            best_sims = np.concatenate([best_sims, sims])
+            if len(best_rows) > count:
+                top = np.argpartition(-best_sims, count - 1)[:count]
+                best_rows, best_sims = best_rows[top], best_sims[top]
+
+        order = np.argsort(-best_sims, kind="stable")
+        best_rows, best_sims = best_rows[order], best_sims[order]
+
+        documents = self.documents(best_rows)
+        for doc, row, sim in zip(documents, best_rows, best_sims):
+            doc["id"] = int(row)
+            doc["similarity"] = float(sim)
+        return documents, self.vectors(best_rows)
+
+    # -- IVF ----------------------------------------------------------------
+
+    def build_ivf(self, nlist: int = None, seed: int = 0) -> int:
+        """Cluster rows with spherical k-means and write inverted lists.
+
+        Search then scores only the `nprobe` lists closest to the query.
+        Adding rows invalidates the index (search falls back to brute force
+        until it is rebuilt). Returns the number of lists.
+        """
+        if self.count == 0:
+            return 0
+        nlist = nlist or max(1, int(np.sqrt(self.count)))
+        rng = np.random.default_rng(seed)
+
+        sample_rows = np.sort(rng.choice(self.count, size=min(self.count, KMEANS_SAMPLE), replace=False))
+        sample = self.vectors(sample_rows)
+        centroids = sample[rng.choice(len(sample), size=min(nlist, len(sample)), replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = sample[assign == c]
+                if len(members):
+                    mean = members.sum(axis=0)
+                    centroids[c] = mean / max(np.linalg.norm(mean), 1e-12)
+
+        assign = np.concatenate([
+            np.argmax(self.vectors(slice(i, i + SEARCH_BLOCK_ROWS)) @ centroids.T, axis=1)
+            for i in range(0, self.count, SEARCH_BLOCK_ROWS)
+        ])
+        order = np.argsort(assign, kind="stable")
+        list_offsets = np.searchsorted(assign[order], np.arange(len(centroids) + 1))
+
+        np.savez(self._file(IVF_FILE), centroids=centroids, order=order,
+                 list_offsets=list_offsets, count=self.count)
+        self._ivf = None
+        return len(centroids)
+
+    def _load_ivf(self):
+        if self._ivf is None and os.path.exists(self._file(IVF_FILE)):
+            ivf = np.load(self._file(IVF_FILE))
+            if int(ivf["count"]) == self.count:
+                self._ivf = {k: ivf[k] for k in ("centroids", "order", "list_offsets")}
+        return self._ivf
+
+    @staticmethod
+    def _ivf_candidates(ivf: dict, query: np.ndarray, nprobe: int) -> np.ndarray:
+        centroids = ivf["centroids"]
+        probe = np.argsort(-(centroids @ query))[:min(nprobe, len(centroids))]
+        offsets = ivf["list_offsets"]
+        rows = np.concatenate([ivf["order"][offsets[c]:offsets[c + 1]] for c in probe])
+        return np.sort(rows)
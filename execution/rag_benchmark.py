@@ -0,0 +1,421 @@
+"""
+RAG Benchmark — Execution Script
+Measures latency of the RAG pipeline stages. `retrieval` runs against the
+live vector store; `mmr` is offline and also checks reranker parity;
+`embed` reports ingest embedding throughput per batch size; `chunking`
+compares the structure-aware chunker with the legacy 2000-char slicer;
+`backends` compares the torch, ONNX and int8 ONNX embedding backends
+(cold start, throughput, memory, cosine parity).
+
+Directive: directives/rag_pipeline.md
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import random
+import re
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import embedding_backend  # noqa: E402
+import rag_ingest  # noqa: E402
+import rag_query  # noqa: E402
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    idx = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def time_calls(fn, repeats: int) -> list[float]:
+    """Call fn() `repeats` times and return per-call latency in milliseconds."""
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def mmr_rerank_reference(query_embedding, doc_embeddings, documents, k=5, lambda_mult=0.7):
+    """The original per-candidate MMR loop, kept as the parity baseline."""
+    if not documents:
+        return []
+    if len(documents) <= k:
+        return documents
+
+    query_emb = np.array(query_embedding).reshape(1, -1)
+    doc_embs = np.array(doc_embeddings)
+    query_sims = np.dot(doc_embs, query_emb.T).flatten()
+
+    selected_indices = [int(np.argmax(query_sims))]
+    remaining_indices = [i for i in range(len(documents)) if i != selected_indices[0]]
+
+    while len(selected_indices) < k and remaining_indices:
+        best_score = -float("inf")
+        best_remaining = -1
+        for idx in remaining_indices:
+            relevance = query_sims[idx]
+            selected_embs = doc_embs[selected_indices]
+            redundancy = float(np.max(np.dot(selected_embs, doc_embs[idx].reshape(-1, 1))))
+            score = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best_score = score
+                best_remaining = idx
+        if best_remaining >= 0:
+            selected_indices.append(best_remaining)
+            remaining_indices.remove(best_remaining)
+
+    return [documents[i] for i in selected_indices]
+
+
+def legacy_scrape_chunks(data: dict) -> list[str]:
+    """The original fixed 2000-char / 200-overlap slicer, kept as the chunking baseline."""
+    markdown = data.get("markdown", "")
+    chunk_size, overlap = 2000, 200
+    return [
+        f"Source URL: {data.get('url', 'unknown')}\n"
+        f"Page Type: {data.get('page_type', 'unknown')}\n"
+        f"Content:\n{markdown[i:i + chunk_size]}"
+        for i in range(0, len(markdown), chunk_size - overlap)
+    ]
+
+
+def random_unit_vectors(rng: np.random.Generator, n: int, dim: int) -> np.ndarray:
+    """Random L2-normalized float32 vectors, like model.encode(normalize_embeddings=True)."""
+    vecs = rng.standard_normal((n, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def bench_retrieval(query: str, fetch_ks: list[int], repeats: int, threshold: float):
+    """Per-query latency of query_documents: re-encoding candidates vs stored embeddings."""
+    # Warm up: model load and first connection are not part of per-query cost
+    rag_query.query_documents(query, threshold=threshold, fetch_k=fetch_ks[0])
+
+    print(f"{'fetch_k':>8} {'mode':>10} {'cands':>6} {'p50 ms':>9} {'p95 ms':>9}")
+    for fetch_k in fetch_ks:
+        for mode, reencode in (("reencode", True), ("stored", False)):
+            result = {}
+
+            def call():
+                result.update(rag_query.query_documents(
+                    query, threshold=threshold, fetch_k=fetch_k, reencode=reencode,
+                ))
+
+            latencies = time_calls(call, repeats)
+            print(
+                f"{fetch_k:>8} {mode:>10} {result.get('total_candidates', 0):>6} "
+                f"{statistics.median(latencies):>9.1f} {percentile(latencies, 95):>9.1f}"
+            )
+
+
+def bench_mmr(fetch_ks: list[int], top_k: int, queries: int, seed: int):
+    """Reference loop vs vectorized MMR: parity check and per-query latency."""
+    rng = np.random.default_rng(seed)
+    dim = rag_query.EMBEDDING_DIM
+
+    print(f"{'fetch_k':>8} {'loop ms':>9} {'numpy ms':>9} {'batch ms':>9} {'parity':>7}")
+    for fetch_k in fetch_ks:
+        q_embs = [random_unit_vectors(rng, 1, dim)[0].tolist() for _ in range(queries)]
+        d_embs = [random_unit_vectors(rng, fetch_k, dim) for _ in range(queries)]
+        docs = [[{"id": i} for i in range(fetch_k)] for _ in range(queries)]
+
+        start = time.perf_counter()
+        expected = [mmr_rerank_reference(np.array(q), d, ds, k=top_k) for q, d, ds in zip(q_embs, d_embs, docs)]
+        loop_ms = (time.perf_counter() - start) * 1000 / queries
+
+        start = time.perf_counter()
+        single = [rag_query.mmr_rerank(np.array(q), d, ds, k=top_k) for q, d, ds in zip(q_embs, d_embs, docs)]
+        single_ms = (time.perf_counter() - start) * 1000 / queries
+
+        start = time.perf_counter()
+        batched = rag_query.mmr_rerank_batch(q_embs, d_embs, docs, k=top_k)
+        batch_ms = (time.perf_counter() - start) * 1000 / queries
+
+        parity = single == expected and batched == expected
+        print(f"{fetch_k:>8} {loop_ms:>9.2f} {single_ms:>9.2f} {batch_ms:>9.2f} {'ok' if parity else 'FAIL':>7}")
+        if not parity:
+            sys.exit(1)
+
+
+def load_chunk_texts(source_dir: str, limit: int) -> list[list[str]]:
+    """Chunk texts per file from a directory of pipeline JSON outputs."""
+    per_file = []
+    for filepath in sorted(glob.glob(os.path.join(source_dir, "*.json"))):
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            continue
+        source_type = rag_ingest.detect_source_type(data)
+        if source_type == "unknown":
+            continue
+        chunks = rag_ingest.chunk_data(data, os.path.basename(filepath), source_type)
+        per_file.append([c["content"] for c in chunks])
+        if sum(len(texts) for texts in per_file) >= limit:
+            break
+    return per_file
+
+
+def bench_embed(source_dir: str, batch_sizes: list[int], limit: int):
+    """Chunks/sec: per-file encode (old path) vs cross-file length-bucketed batches."""
+    per_file = load_chunk_texts(source_dir, limit)
+    texts = [t for file_texts in per_file for t in file_texts]
+    if not texts:
+        print(f"No chunks found in {source_dir}")
+        return
+    model = rag_ingest.get_model()
+    model.encode(texts[:8], normalize_embeddings=True)  # warm up
+
+    start = time.perf_counter()
+    for file_texts in per_file:
+        model.encode(file_texts, normalize_embeddings=True, show_progress_bar=False)
+    baseline = len(texts) / (time.perf_counter() - start)
+    print(f"{len(texts)} chunks from {len(per_file)} files")
+    print(f"{'batching':>14} {'chunks/s':>9} {'padding':>8}")
+    print(f"{'per-file':>14} {baseline:>9.1f} {'-':>8}")
+
+    for batch_size in batch_sizes:
+        rag_ingest._embed_stats.update(chunks=0, batches=0, tokens=0, padded_tokens=0, seconds=0.0)
+        rag_ingest.encode_batched(texts, batch_size=batch_size)
+        stats = rag_ingest.embedding_stats()
+        print(f"{'bucketed/' + str(batch_size):>14} {stats['chunks_per_sec']:>9.1f} "
+              f"{stats['padding_efficiency']:>8.0%}")
+
+
+def load_scrapes(source_dir: str) -> list[dict]:
+    """scrape_website records from .json and .jsonl files."""
+    records = []
+    for filepath in sorted(glob.glob(os.path.join(source_dir, "*.json*"))):
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                if filepath.endswith(".jsonl"):
+                    items = [json.loads(line) for line in f if line.strip()]
+                else:
+                    items = [json.load(f)]
+        except (json.JSONDecodeError, IOError):
+            continue
+        records.extend(d for d in items if isinstance(d, dict) and rag_ingest.detect_source_type(d) == "scrape_website")
+    return records
+
+
+def sample_probes(records: list[dict], per_doc: int, seed: int) -> list[str]:
+    """Random prose sentences (8+ words) from each page, used as self-supervised queries."""
+    rng = random.Random(seed)
+    probes = []
+    for data in records:
+        sentences = [
+            " ".join(s.split()) for s in re.split(r"(?<=[.!?])\s+|\n\s*\n", data.get("markdown", ""))
+            if len(s.split()) >= 8 and not s.lstrip().startswith(("|", "#", "```"))
+        ]
+        probes.extend(rng.sample(sentences, min(per_doc, len(sentences))))
+    return probes
+
+
+def bench_chunking(source_dir: str, probes_per_doc: int, top_k: int, seed: int):
+    """Legacy slicer vs structure-aware chunker: chunk count, token fit, embed time, hit rate.
+
+    Hit rate is self-supervised: sentences sampled from the pages are used as
+    queries, and a query hits when one of the top_k chunks contains it whole.
+    """
+    records = load_scrapes(source_dir)
+    if not records:
+        print(f"No scrape_website JSON found in {source_dir}")
+        return
+    probes = sample_probes(records, probes_per_doc, seed)
+    model = rag_ingest.get_model()
+    probe_embs = model.encode(probes, normalize_embeddings=True, show_progress_bar=False) if probes else None
+    max_len = getattr(model, "max_seq_length", None) or 512
+
+    strategies = {
+        "legacy": lambda d: legacy_scrape_chunks(d),
+        "structured": lambda d: [c["content"] for c in rag_ingest.chunk_scrape_website(d, "bench")],
+    }
+    print(f"{len(records)} pages, {len(probes)} probe sentences")
+    print(f"{'chunker':>11} {'chunks':>7} {'avg tok':>8} {'truncated':>10} {'chunk ms':>9} "
+          f"{'embed s':>8} {f'hit@{top_k}':>7}")
+    for name, chunker in strategies.items():
+        start = time.perf_counter()
+        texts = [t for d in records for t in chunker(d)]
+        chunk_ms = (time.perf_counter() - start) * 1000
+
+        lengths = rag_ingest.token_lengths(texts)
+        # token_lengths truncates at the model limit, so a full-length chunk was cut off
+        truncated = sum(1 for n in lengths if n >= max_len) / len(texts) if texts else 0.0
+
+        rag_ingest._embed_stats.update(chunks=0, batches=0, tokens=0, padded_tokens=0, seconds=0.0)
+        embs = rag_ingest.encode_batched(texts)
+        embed_s = rag_ingest.embedding_stats()["seconds"]
+
+        hits = 0
+        if probes:
+            flat = [" ".join(t.split()) for t in texts]
+            top = np.argsort(-(probe_embs @ embs.T), axis=1)[:, :top_k]
+            hits = sum(1 for probe, row in zip(probes, top) if any(probe in flat[i] for i in row))
+        print(f"{name:>11} {len(texts):>7} {statistics.mean(lengths) if lengths else 0:>8.0f} "
+              f"{truncated:>10.1%} {chunk_ms:>9.1f} {embed_s:>8.2f} "
+              f"{hits / len(probes) if probes else 0:>7.1%}")
+
+
+def _backend_worker(model_name: str, backend: str, texts: list[str], queries: list[str], batch_size: int) -> dict:
+    """Runs in a fresh process, so import + load time and peak RSS belong to this backend alone."""
+    start = time.perf_counter()
+    model = embedding_backend.load_model(model_name, backend)
+    model.encode(["warm up"], normalize_embeddings=True)
+    cold_start = time.perf_counter() - start
+
+    start = time.perf_counter()
+    docs = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=False)
+    encode_s = time.perf_counter() - start
+    query_embs = model.encode(queries, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=False)
+
+    try:
+        import resource
+        rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    except ImportError:
+        rss_mb = float("nan")
+    return {
+        "cold_start_s": cold_start,
+        "chunks_per_sec": len(texts) / encode_s if encode_s else 0.0,
+        "rss_mb": rss_mb,
+        "docs": np.asarray(docs, dtype=np.float32),
+        "queries": np.asarray(query_embs, dtype=np.float32),
+    }
+
+
+def bench_backends(
+    source_dir: str,
+    model_name: str,
+    backends: list[str],
+    limit: int,
+    batch_size: int,
+    top_k: int,
+    min_cosine: float,
+):
+    """Cold start, chunks/s and peak RSS per backend, plus parity against the first backend.
+
+    Parity: per-chunk cosine between the two backends' vectors, the largest
+    change in any query-chunk similarity score, and top_k overlap of the
+    rankings. Exits non-zero when a backend's minimum cosine is below `min_cosine`.
+    """
+    texts = [t for file_texts in load_chunk_texts(source_dir, limit) for t in file_texts][:limit]
+    if not texts:
+        print(f"No chunks found in {source_dir}")
+        return
+    # Queries: the opening words of evenly spaced chunks
+    queries = [" ".join(t.split()[:12]) for t in texts[::max(1, len(texts) // 50)]]
+    print(f"{len(texts)} chunks, {len(queries)} queries, batch size {batch_size}")
+
+    results = {}
+    spawn = multiprocessing.get_context("spawn")
+    for backend in backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            results[backend] = pool.submit(_backend_worker, model_name, backend, texts, queries, batch_size).result()
+
+    reference = backends[0]
+    ref = results[reference]
+    ref_scores = ref["queries"] @ ref["docs"].T
+    ref_top = np.argsort(-ref_scores, axis=1)[:, :top_k]
+
+    print(f"{'backend':>10} {'cold s':>7} {'chunks/s':>9} {'RSS MB':>7} "
+          f"{'min cos':>8} {'mean cos':>9} {'max Δscore':>11} {f'top{top_k} agree':>11}")
+    failed = False
+    for backend in backends:
+        r = results[backend]
+        cosines = np.sum(r["docs"] * ref["docs"], axis=1)
+        scores = r["queries"] @ r["docs"].T
+        top = np.argsort(-scores, axis=1)[:, :top_k]
+        agree = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(top, ref_top)])
+        ok = cosines.min() >= min_cosine
+        failed |= not ok
+        print(f"{backend:>10} {r['cold_start_s']:>7.2f} {r['chunks_per_sec']:>9.1f} {r['rss_mb']:>7.0f} "
+              f"{cosines.min():>8.4f} {cosines.mean():>9.4f} {np.abs(scores - ref_scores).max():>11.4f} "
+              f"{agree:>11.1%}{'' if ok else '  FAIL'}")
+    if failed:
+        print(f"❌ Parity below {min_cosine} cosine vs {reference}")
+        sys.exit(1)
+    print(f"✅ All backends within {min_cosine} cosine of {reference}")
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAG pipeline latency")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("retrieval", help="query_documents latency: re-encode vs stored embeddings")
+    p.add_argument("--query", default="SaaS CRM market size and key competitors", help="Benchmark query")
+    p.add_argument("--fetch-k", default="20,50,100", help="Comma-separated fetch_k values")
+    p.add_argument("--repeats", type=int, default=10, help="Calls per configuration")
+    p.add_argument("--threshold", type=float, default=0.0,
+                   help="Similarity threshold (low so every fetch_k is filled)")
+
+    p = sub.add_parser("mmr", help="Vectorized MMR vs reference loop (parity + latency)")
+    p.add_argument("--fetch-k", default="20,100,500", help="Comma-separated candidate counts")
+    p.add_argument("--top-k", type=int, default=rag_query.DEFAULT_TOP_K, help="Documents selected per query")
+    p.add_argument("--queries", type=int, default=20, help="Random queries per candidate count")
+    p.add_argument("--seed", type=int, default=0, help="RNG seed")
+
+    p = sub.add_parser("embed", help="Embedding throughput by batch size (CPU tuning)")
+    p.add_argument("--source-dir", default=".tmp", help="Directory with JSON files to chunk")
+    p.add_argument("--batch-sizes", default="16,32,64,128", help="Comma-separated batch sizes")
+    p.add_argument("--limit", type=int, default=2000, help="Max chunks to embed")
+
+    p = sub.add_parser("chunking", help="Structure-aware chunker vs legacy 2000-char slicer")
+    p.add_argument("--source-dir", default=".tmp", help="Directory with scrape_website JSON/JSONL files")
+    p.add_argument("--probes-per-doc", type=int, default=10, help="Probe sentences sampled per page")
+    p.add_argument("--top-k", type=int, default=rag_query.DEFAULT_TOP_K, help="Chunks retrieved per probe")
+    p.add_argument("--seed", type=int, default=0, help="RNG seed")
+
+    p = sub.add_parser("backends", help="torch vs ONNX vs int8 ONNX: cold start, throughput, RSS, parity")
+    p.add_argument("--source-dir", default=".tmp", help="Directory with JSON files to chunk")
+    p.add_argument("--model", default=rag_ingest.EMBEDDING_MODEL, help="Model name or local directory")
+    p.add_argument("--backends", default=",".join(embedding_backend.BACKENDS),
+                   help="Comma-separated backends; the first is the parity reference")
+    p.add_argument("--limit", type=int, default=1000, help="Max chunks to embed")
+    p.add_argument("--batch-size", type=int, default=rag_ingest.DEFAULT_BATCH_SIZE, help="Texts per forward pass")
+    p.add_argument("--top-k", type=int, default=rag_query.DEFAULT_TOP_K, help="Ranking depth for agreement")
+    p.add_argument("--min-cosine", type=float, default=0.99,
+                   help="Fail if any chunk's vector is less similar than this to the reference")
+
+    args = parser.parse_args()
+
+    if args.bench == "retrieval":
+        fetch_ks = [int(k) for k in args.fetch_k.split(",") if k.strip()]
+        bench_retrieval(args.query, fetch_ks, args.repeats, args.threshold)
+    elif args.bench == "mmr":
+        fetch_ks = [int(k) for k in args.fetch_k.split(",") if k.strip()]
+        bench_mmr(fetch_ks, args.top_k, args.queries, args.seed)
+    elif args.bench == "embed":
+        batch_sizes = [int(b) for b in args.batch_sizes.split(",") if b.strip()]
+        bench_embed(args.source_dir, batch_sizes, args.limit)
+    elif args.bench == "chunking":
+        bench_chunking(args.source_dir, args.probes_per_doc, args.top_k, args.seed)
+    elif args.bench == "backends":
+        backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+        bench_backends(args.source_dir, args.model, backends, args.limit, args.batch_size, args.top_k, args.min_cosine)
+
+
+if __name__ == "__main__":
+    main()
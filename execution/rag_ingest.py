@@ -7,10 +7,15 @@ Directive: directives/rag_pipeline.md
 """
 
 import argparse
+import hashlib
 import json
 import os
 import sys
 import glob
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import numpy as np
@@ -24,20 +29,53 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("VITE_SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")  # service role key for writes
 EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
-MAX_CHUNK_TOKENS = 500
+EMBEDDING_DIM = 384
+MAX_CHUNK_TOKENS = 500       # model tokens per chunk body (bge-small limit is 512)
+MANIFEST_PAGE_SIZE = 1000  # PostgREST max rows per response
+RAG_BACKEND = os.getenv("RAG_BACKEND", "supabase")  # "supabase" | "local"
+LOCAL_INDEX_DIR = os.getenv("RAG_LOCAL_INDEX", ".tmp/rag_index")
+
+# Pipeline defaults (see ingest_directory)
+DEFAULT_WORKERS = 4          # file read/parse/chunk threads
+DEFAULT_BATCH_SIZE = 64      # max chunks per model forward pass
+DEFAULT_BATCH_TOKENS = 16384  # max padded tokens (rows x longest row) per forward pass
+EMBED_WINDOW_BATCHES = 8     # chunks gathered across files before length-sorting
+
+# Streaming ingest: JSONL files and JSON files above this size are read incrementally
+STREAM_THRESHOLD_BYTES = 1_000_000
+STREAM_PLAN_CHUNKS = 64      # chunks handed to the embed stage at a time per streamed file
+DEFAULT_INSERT_WORKERS = 4   # concurrent Supabase writes
 
 # Lazy-load heavy imports
 _model = None
 _supabase = None
+_local_index = None
+_embedding_cache = None
+_bulk_writer = None
+_embed_stats = {"chunks": 0, "batches": 0, "tokens": 0, "padded_tokens": 0, "seconds": 0.0}
 
 
 def get_model():
-    """Lazy-load the embedding model (avoids slow startup if not needed)."""
+    """Lazy-load the embedding model (avoids slow startup if not needed).
+
+    Uses a running embedding_server when there is one, so the model is not
+    loaded again in this process; otherwise loads it on EMBEDDING_BACKEND.
+    """
     global _model
     if _model is None:
-        from sentence_transformers import SentenceTransformer
-        print(f"Loading embedding model: {EMBEDDING_MODEL}...")
-        _model = SentenceTransformer(EMBEDDING_MODEL)
+        try:
+            from execution.embedding_backend import EMBEDDING_BACKEND, load_model
+            from execution.embedding_server import connect
+        except ImportError:
+            sys.path.insert(0, os.path.dirname(__file__))
+            from embedding_backend import EMBEDDING_BACKEND, load_model
+            from embedding_server import connect
+        _model = connect(EMBEDDING_MODEL)
+        if _model is not None:
+            print(f"Using embedding server for {EMBEDDING_MODEL}")
+        else:
+            print(f"Loading embedding model: {EMBEDDING_MODEL} ({EMBEDDING_BACKEND})...")
+            _model = load_model(EMBEDDING_MODEL)
     return _model
 
 
@@ -53,6 +91,51 @@ def get_supabase():
     return _supabase
 
 
+def get_local_index(dtype: str = "float32"):
+    """Lazy-load the local vector index (dtype only applies when creating it)."""
+    global _local_index
+    if _local_index is None:
+        try:
+            from execution.local_index import LocalVectorIndex
+        except ImportError:
+            sys.path.insert(0, os.path.dirname(__file__))
+            from local_index import LocalVectorIndex
+        _local_index = LocalVectorIndex(LOCAL_INDEX_DIR, dim=EMBEDDING_DIM, dtype=dtype)
+    return _local_index
+
+
+def get_bulk_writer(max_rows: int = None, max_bytes: int = None):
+    """Lazy-create the batched, retrying `documents` writer (limits only apply on creation)."""
+    global _bulk_writer
+    if _bulk_writer is None:
+        try:
+            from execution.bulk_writer import BulkWriter, DEFAULT_MAX_BYTES, DEFAULT_MAX_ROWS
+        except ImportError:
+            sys.path.insert(0, os.path.dirname(__file__))
+            from bulk_writer import BulkWriter, DEFAULT_MAX_BYTES, DEFAULT_MAX_ROWS
+        _bulk_writer = BulkWriter(
+            get_supabase(),
+            table="documents",
+            on_conflict="source,chunk_index",
+            max_rows=max_rows or DEFAULT_MAX_ROWS,
+            max_bytes=max_bytes or DEFAULT_MAX_BYTES,
+        )
+    return _bulk_writer
+
+
+def get_embedding_cache():
+    """Lazy-load the embedding cache shared with rag_query."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        try:
+            from execution.embedding_cache import EmbeddingCache
+        except ImportError:
+            sys.path.insert(0, os.path.dirname(__file__))
+            from embedding_cache import EmbeddingCache
+        _embedding_cache = EmbeddingCache(EMBEDDING_MODEL)
+    return _embedding_cache
+
+
 # ---------------------------------------------------------------------------
 # Chunking strategies per source type
 # ---------------------------------------------------------------------------
@@ -84,15 +167,26 @@ def chunk_competitor_discovery(data: dict, source_file: str) -> list[dict]:
 
 
 def chunk_framework_analysis(data: dict, source_file: str) -> list[dict]:
-    """One chunk per framework section."""
-    chunks = []
-    framework = data.get("framework", "unknown")
+    """One chunk per framework section; combined runs ("frameworks") chunk every framework that succeeded."""
     inputs_data = data.get("inputs", {})
+    if "frameworks" in data:
+        chunks = []
+        for framework, entry in data["frameworks"].items():
+            if "result" in entry:
+                chunks.extend(framework_section_chunks(framework, entry["result"], inputs_data, source_file, len(chunks)))
+        return chunks
+    # framework_analysis.py writes "result"; "analysis" is the older key
+    analysis = data.get("analysis", data.get("result", {}))
+    return framework_section_chunks(data.get("framework", "unknown"), analysis, inputs_data, source_file)
+
+
+def framework_section_chunks(framework: str, analysis, inputs_data: dict, source_file: str,
+                             start_index: int = 0) -> list[dict]:
+    chunks = []
 
     # If the analysis has sections (e.g. SWOT quadrants)
-    analysis = data.get("analysis", {})
     if isinstance(analysis, dict):
-        for i, (section, content) in enumerate(analysis.items()):
+        for i, (section, content) in enumerate(analysis.items(), start_index):
             text_content = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
             text = (
                 f"Framework: {framework}\n"
@@ -113,7 +207,7 @@ def chunk_framework_analysis(data: dict, source_file: str) -> list[dict]:
             "source": source_file,
             "source_type": "framework_analysis",
             "metadata": {"framework": framework},
-            "chunk_index": 0,
+            "chunk_index": start_index,
         })
 
     return chunks
@@ -137,43 +231,41 @@ def chunk_chat_analysis(data: dict, source_file: str) -> list[dict]:
         "chunk_index": 0,
     }]
 
+def iter_scrape_chunks(fields: dict, pieces, source_file: str, start_index: int = 0, dedup=None):
+    """Chunk scraped markdown given as text pieces (streamed or whole).
+
+    Chunks follow headings, paragraphs and sentences within MAX_CHUNK_TOKENS
+    model tokens and start with their heading breadcrumb; url and page_type
+    stay in metadata rather than being repeated in every chunk's text.
+    With a Deduplicator, the domain's boilerplate blocks are cut first.
+    """
+    try:
+        from execution.chunking import iter_markdown_chunks
+    except ImportError:
+        sys.path.insert(0, os.path.dirname(__file__))
+        from chunking import iter_markdown_chunks
+
+    url = fields.get("url", "unknown")
+    page_type = fields.get("page_type", "unknown")
+    if dedup is not None:
+        pieces = dedup.strip_boilerplate(url, pieces)
+
+    for chunk_index, chunk in enumerate(iter_markdown_chunks(pieces, max_tokens=MAX_CHUNK_TOKENS), start_index):
+        yield {
+            "content": chunk["content"],
+            "source": source_file,
+            "source_type": "scrape_website",
+            "metadata": {"url": url, "page_type": page_type, "section": chunk["section"]},
+            "chunk_index": chunk_index,
+        }
+
+
 def chunk_scrape_website(data: dict, source_file: str) -> list[dict]:
-    """Naive chunking for markdown content (approx 2000 chars per chunk)."""
-    chunks = []
+    """Structure-aware chunking for scraped markdown (see execution/chunking.py)."""
     markdown = data.get("markdown", "")
-    url = data.get("url", "unknown")
-    page_type = data.get("page_type", "unknown")
-    
     if not markdown:
         return []
-        
-    chunk_size = 2000
-    overlap = 200
-    
-    start = 0
-    chunk_index = 0
-    while start < len(markdown):
-        end = start + chunk_size
-        text_chunk = markdown[start:end]
-        
-        content = (
-            f"Source URL: {url}\n"
-            f"Page Type: {page_type}\n"
-            f"Content:\n{text_chunk}"
-        )
-        
-        chunks.append({
-            "content": content,
-            "source": source_file,
-            "source_type": "scrape_website",
-            "metadata": {"url": url, "page_type": page_type},
-            "chunk_index": chunk_index,
-        })
-        
-        start = end - overlap
-        chunk_index += 1
-        
-    return chunks
+    return list(iter_scrape_chunks(data, [markdown], source_file))
 
 
 # ---------------------------------------------------------------------------
@@ -184,7 +276,7 @@ def detect_source_type(data: dict) -> str:
     """Detect what kind of script produced this JSON."""
     if "competitors" in data:
         return "competitor_discovery"
-    if "framework" in data or "analysis" in data:
+    if "framework" in data or "frameworks" in data or "analysis" in data:
         return "framework_analysis"
     if "response" in data and "mode" in data:
         return "chat_analysis"
@@ -218,29 +310,108 @@ def chunk_data(data: dict, source_file: str, source_type: str) -> list[dict]:
 # Embedding & Insert
 # ---------------------------------------------------------------------------
 
-def generate_embeddings(texts: list[str]) -> list[list[float]]:
-    """Generate embeddings for a batch of texts using local model."""
+def token_lengths(texts: list[str]) -> list[int]:
+    """Token count per text with the model's tokenizer (chars / 4 if it has none)."""
+    model = get_model()
+    if hasattr(model, "token_lengths"):  # embedding_server client: the server tokenizes
+        return model.token_lengths(texts)
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None:
+        return [max(1, len(t) // 4) for t in texts]
+
+    max_len = getattr(model, "max_seq_length", None) or 512
+    encoded = tokenizer(texts, add_special_tokens=True, truncation=True, max_length=max_len,
+                        return_attention_mask=False, return_token_type_ids=False)
+    return [len(ids) for ids in encoded["input_ids"]]
+
+
+def plan_batches(lengths: list[int], batch_size: int, batch_tokens: int) -> list[list[int]]:
+    """Group text indices into length-sorted batches.
+
+    Texts are sorted longest first so each batch holds similar lengths (little
+    padding). A batch closes at `batch_size` rows or when rows x longest row
+    would exceed `batch_tokens`, so short texts get larger batches.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches, current = [], []
+    for i in order:
+        longest = lengths[current[0]] if current else lengths[i]
+        if current and (len(current) >= batch_size or (len(current) + 1) * longest > batch_tokens):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def encode_batched(
+    texts: list[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    batch_tokens: int = DEFAULT_BATCH_TOKENS,
+) -> np.ndarray:
+    """Encode texts in length-bucketed batches and scatter results back to input order."""
+    if not texts:
+        return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
     model = get_model()
-    embeddings = model.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+    lengths = token_lengths(texts)
+    out = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+
+    start = time.perf_counter()
+    batches = plan_batches(lengths, batch_size, batch_tokens)
+    for idx in batches:
+        out[idx] = model.encode([texts[i] for i in idx], batch_size=len(idx),
+                                normalize_embeddings=True, show_progress_bar=False)
+
+    _embed_stats["seconds"] += time.perf_counter() - start
+    _embed_stats["chunks"] += len(texts)
+    _embed_stats["batches"] += len(batches)
+    _embed_stats["tokens"] += sum(lengths)
+    _embed_stats["padded_tokens"] += sum(len(idx) * lengths[idx[0]] for idx in batches)
+    return out
+
+
+def embedding_stats() -> dict:
+    """Model-side throughput so far (cache hits excluded)."""
+    seconds = _embed_stats["seconds"]
+    padded = _embed_stats["padded_tokens"]
+    return {
+        "chunks": _embed_stats["chunks"],
+        "batches": _embed_stats["batches"],
+        "seconds": round(seconds, 2),
+        "chunks_per_sec": round(_embed_stats["chunks"] / seconds, 1) if seconds else 0.0,
+        "tokens_per_sec": round(_embed_stats["tokens"] / seconds, 1) if seconds else 0.0,
+        "padding_efficiency": round(_embed_stats["tokens"] / padded, 3) if padded else 1.0,
+    }
+
+
+def generate_embeddings(texts: list[str], batch_size: int = DEFAULT_BATCH_SIZE) -> list[list[float]]:
+    """Generate embeddings for texts (any mix of files) using the local model.
+
+    Texts already in the embedding cache are not re-encoded; the model is
+    only loaded if something misses. Misses go through encode_batched.
+    """
+    embeddings = get_embedding_cache().encode(
+        texts, lambda misses: encode_batched(misses, batch_size=batch_size)
+    )
     return embeddings.tolist()
 
 
-def is_already_indexed(source_file: str) -> bool:
-    """Check if a source file has already been indexed."""
-    sb = get_supabase()
-    result = sb.table("documents").select("id").eq("source", source_file).limit(1).execute()
-    return len(result.data) > 0
-
+def write_chunks(chunks: list[dict], embeddings: list, backend: str = RAG_BACKEND, replaced_ids: list = ()) -> int:
+    """Upsert embedded chunks into Supabase or the local index.
 
-def insert_chunks(chunks: list[dict]) -> int:
-    """Generate embeddings and insert chunks into Supabase."""
+    Supabase rows go through the BulkWriter: size-bounded batches, compact
+    vector literals, retried upserts on (source, chunk_index). The local index
+    is append-only, so the rows being replaced (`replaced_ids`) are tombstoned first.
+    """
     if not chunks:
         return 0
 
-    texts = [c["content"] for c in chunks]
-    embeddings = generate_embeddings(texts)
+    if backend == "local":
+        index = get_local_index()
+        index.delete(replaced_ids)
+        return index.add(chunks, embeddings)
 
-    sb = get_supabase()
     rows = []
     for chunk, emb in zip(chunks, embeddings):
         rows.append({
@@ -250,70 +421,499 @@ def insert_chunks(chunks: list[dict]) -> int:
             "source_type": chunk["source_type"],
             "metadata": chunk["metadata"],
             "chunk_index": chunk["chunk_index"],
+            "content_hash": chunk["content_hash"],
         })
 
-    # Batch insert
-    sb.table("documents").insert(rows).execute()
-    return len(rows)
+    return get_bulk_writer().write(rows)
+
+
+def delete_rows(ids: list, backend: str = RAG_BACKEND) -> int:
+    """Delete indexed chunks by row id."""
+    if not ids:
+        return 0
+    if backend == "local":
+        return get_local_index().delete(ids)
+
+    sb = get_supabase()
+    sb.table("documents").delete().in_("id", list(ids)).execute()
+    return len(ids)
 
 
 # ---------------------------------------------------------------------------
-# Main
+# Ingestion manifest (content hashes of what is already indexed)
 # ---------------------------------------------------------------------------
 
-def ingest_directory(source_dir: str, force: bool = False) -> dict:
-    """Ingest all JSON files from a directory."""
-    json_files = glob.glob(os.path.join(source_dir, "*.json"))
+def content_hash(text: str) -> str:
+    """SHA-256 hex of chunk content (matches the backfill in migration 004)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-    if not json_files:
-        print(f"No JSON files found in {source_dir}")
-        return {"files": 0, "chunks": 0}
 
-    total_chunks = 0
-    total_files = 0
+def load_manifest(backend: str = RAG_BACKEND) -> dict[str, dict[int, dict]]:
+    """Everything indexed, as {source: {chunk_index: {"id": row id, "hash": content_hash}}}.
 
-    for filepath in json_files:
-        filename = os.path.basename(filepath)
+    Supabase: one paged bulk SELECT of (id, source, chunk_index, content_hash)
+    instead of one existence query per file. Local: a scan of the index sidecar.
+    """
+    manifest: dict[str, dict[int, dict]] = {}
 
-        # Skip if already indexed (unless force)
-        if not force and is_already_indexed(filename):
-            print(f"  ⏭️  {filename} — already indexed, skipping")
-            continue
+    if backend == "local":
+        for row, source, chunk_index, digest in get_local_index().entries():
+            manifest.setdefault(source, {})[chunk_index] = {"id": row, "hash": digest}
+        return manifest
 
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"  ❌ {filename} — failed to read: {e}")
-            continue
+    sb = get_supabase()
+    start = 0
+    while True:
+        result = (
+            sb.table("documents")
+            .select("id,source,chunk_index,content_hash")
+            .order("id")
+            .range(start, start + MANIFEST_PAGE_SIZE - 1)
+            .execute()
+        )
+        for row in result.data:
+            manifest.setdefault(row["source"], {})[row["chunk_index"]] = {
+                "id": row["id"], "hash": row.get("content_hash"),
+            }
+        if len(result.data) < MANIFEST_PAGE_SIZE:
+            return manifest
+        start += MANIFEST_PAGE_SIZE
+
+
+def classify_chunks(chunks: list[dict], indexed: dict[int, dict], force: bool = False) -> tuple[list[dict], list]:
+    """Set each chunk's "content_hash" and pick the new/changed ones.
+
+    Returns (changed chunks to upsert, ids of the indexed rows they replace).
+    """
+    changed, replaced_ids = [], []
+    for chunk in chunks:
+        chunk["content_hash"] = content_hash(chunk["content"])
+        existing = indexed.get(chunk["chunk_index"])
+        if force or existing is None or existing["hash"] != chunk["content_hash"]:
+            changed.append(chunk)
+            if existing is not None:
+                replaced_ids.append(existing["id"])
+    return changed, replaced_ids
+
+
+def stale_row_ids(indexed: dict[int, dict], seen_indices: set) -> list:
+    """Ids of indexed rows whose chunk_index the file no longer produces."""
+    return [entry["id"] for idx, entry in indexed.items() if idx not in seen_indices]
+
+
+def diff_chunks(chunks: list[dict], indexed: dict[int, dict], force: bool = False) -> tuple[list[dict], list, list]:
+    """Compare a file's chunks with what is indexed for that file.
+
+    Returns (changed chunks to upsert, ids of the indexed rows they replace,
+    ids of stale rows whose chunk_index no longer exists).
+    """
+    changed, replaced_ids = classify_chunks(chunks, indexed, force)
+    return changed, replaced_ids, stale_row_ids(indexed, {c["chunk_index"] for c in chunks})
+
+
+# ---------------------------------------------------------------------------
+# File reading (whole or streamed)
+# ---------------------------------------------------------------------------
+
+def iter_file_chunks(filepath: str, dedup=None):
+    """Yield every chunk of a file.
+
+    Small .json files are loaded whole. JSONL files and .json files above
+    STREAM_THRESHOLD_BYTES are read with json_stream: scraped markdown is
+    chunked from a generator of text pieces, so memory stays flat regardless
+    of file size. Chunk indices run across all records of a JSONL file.
+    """
+    filename = os.path.basename(filepath)
+    streamed = filepath.endswith(".jsonl") or os.path.getsize(filepath) > STREAM_THRESHOLD_BYTES
 
+    if not streamed:
+        with open(filepath, "r", encoding="utf-8") as f:
+            data = json.load(f)
         source_type = detect_source_type(data)
         if source_type == "unknown":
             print(f"  ⚠️  {filename} — unknown format, skipping")
+            return
+        if source_type == "scrape_website" and dedup is not None:
+            yield from iter_scrape_chunks(data, [data["markdown"]], filename, dedup=dedup)
+            return
+        yield from chunk_data(data, filename, source_type)
+        return
+
+    try:
+        from execution.json_stream import iter_records
+    except ImportError:
+        sys.path.insert(0, os.path.dirname(__file__))
+        from json_stream import iter_records
+
+    next_index = 0
+    with open(filepath, "r", encoding="utf-8") as f:
+        for record, (fields, pieces) in enumerate(iter_records(f, stream_field="markdown")):
+            if pieces is not None:
+                # Streamed markdown: source type is known from the field itself
+                for chunk in iter_scrape_chunks(fields, pieces, filename, next_index, dedup):
+                    next_index += 1
+                    yield chunk
+                continue
+
+            source_type = detect_source_type(fields)
+            if source_type == "unknown":
+                print(f"  ⚠️  {filename} — record {record}: unknown format, skipping")
+                continue
+            for chunk in chunk_data(fields, filename, source_type):
+                chunk["chunk_index"] = next_index
+                next_index += 1
+                yield chunk
+
+
+def scan_scrape_pages(json_files: list[str], dedup) -> None:
+    """Dedup pre-pass, in sorted file order.
+
+    First every scraped page goes to `dedup`, so boilerplate blocks are known
+    before any page is chunked. Then those pages are chunked and their chunks
+    added in (file name, chunk index) order, so the first copy of a
+    near-duplicate survives whichever worker reads its file first: reruns
+    keep the same copy instead of swapping it for another. Unreadable files
+    are left for the ingest pass to report.
+    """
+    try:
+        from execution.json_stream import iter_records
+    except ImportError:
+        sys.path.insert(0, os.path.dirname(__file__))
+        from json_stream import iter_records
+
+    scrape_files = []
+    for filepath in sorted(json_files):
+        pages = 0
+        try:
+            if filepath.endswith(".jsonl") or os.path.getsize(filepath) > STREAM_THRESHOLD_BYTES:
+                with open(filepath, "r", encoding="utf-8") as f:
+                    for fields, pieces in iter_records(f, stream_field="markdown"):
+                        if pieces is not None:
+                            dedup.add_page(fields.get("url", ""), pieces)
+                            pages += 1
+            else:
+                with open(filepath, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if detect_source_type(data) == "scrape_website":
+                    dedup.add_page(data["url"], [data["markdown"]])
+                    pages += 1
+        except (ValueError, IOError):
             continue
+        if pages:
+            scrape_files.append(filepath)
 
-        chunks = chunk_data(data, filename, source_type)
-        if not chunks:
-            print(f"  ⚠️  {filename} — no chunks generated")
+    for filepath in scrape_files:
+        try:
+            for chunk in iter_file_chunks(filepath, dedup):
+                if chunk["source_type"] == "scrape_website":
+                    dedup.add_chunk(chunk)
+        except Exception:
             continue
+    dedup.end_scan()
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+def failed_plan(filename: str) -> dict:
+    """Final plan for a file that could not be read or chunked: nothing written, nothing deleted."""
+    return {"filename": filename, "changed": [], "replaced_ids": [], "stale_ids": [],
+            "unchanged": 0, "final": True, "failed": True}
+
+
+def prepare_file(filepath: str, manifest: dict, force: bool = False, dedup=None):
+    """Read, chunk and diff one file (pipeline stage 1, runs in a worker thread).
+
+    Yields plans of at most STREAM_PLAN_CHUNKS changed chunks as the file is
+    read, then a final plan carrying the stale row ids. Stale rows are only
+    deleted if the whole file was read successfully. With a Deduplicator,
+    near-duplicate scrape chunks are dropped here, before they are diffed,
+    so an indexed copy of a dropped chunk is removed as stale.
+    """
+    filename = os.path.basename(filepath)
+    indexed = manifest.get(filename, {})
+    seen, group = set(), []
+    unchanged = changed_total = duplicates = 0
+
+    def plan(chunks: list[dict]) -> dict:
+        nonlocal unchanged, changed_total
+        changed, replaced_ids = classify_chunks(chunks, indexed, force)
+        unchanged += len(chunks) - len(changed)
+        changed_total += len(changed)
+        return {"filename": filename, "changed": changed, "replaced_ids": replaced_ids,
+                "stale_ids": [], "unchanged": len(chunks) - len(changed), "final": False}
+
+    try:
+        for chunk in iter_file_chunks(filepath, dedup):
+            if dedup is not None and chunk["source_type"] == "scrape_website":
+                existing = indexed.get(chunk["chunk_index"])
+                would_embed = force or existing is None or existing["hash"] != content_hash(chunk["content"])
+                if dedup.is_near_duplicate(chunk, would_embed):
+                    duplicates += 1
+                    continue
+            seen.add(chunk["chunk_index"])
+            group.append(chunk)
+            if len(group) >= STREAM_PLAN_CHUNKS:
+                yield plan(group)
+                group = []
+        if group:
+            yield plan(group)
+    except (ValueError, IOError) as e:  # JSONDecodeError / JSONStreamError are ValueErrors
+        print(f"  ❌ {filename} — failed to read: {e}")
+        yield failed_plan(filename)
+        return
+
+    produced = bool(seen) or duplicates > 0
+    if not seen:
+        if duplicates:
+            print(f"  ⏭️  {filename} — all {duplicates} chunks are near-duplicates, skipping")
+        else:
+            print(f"  ⚠️  {filename} — no chunks generated")
+    stale_ids = stale_row_ids(indexed, seen) if produced else []
+    if not changed_total and not stale_ids and seen:
+        print(f"  ⏭️  {filename} — unchanged, skipping")
+    yield {"filename": filename, "changed": [], "replaced_ids": [], "stale_ids": stale_ids,
+           "unchanged": 0, "final": True, "changed_total": changed_total, "unchanged_total": unchanged}
+
+
+def ingest_directory(
+    source_dir: str,
+    force: bool = False,
+    backend: str = RAG_BACKEND,
+    workers: int = DEFAULT_WORKERS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    insert_workers: int = DEFAULT_INSERT_WORKERS,
+    dedup: bool = False,
+) -> dict:
+    """Ingest all JSON/JSONL files from a directory, embedding only new or changed chunks.
+
+    Runs as three overlapping stages connected by bounded queues:
+      1. `workers` threads read, parse, chunk and diff files (prepare_file),
+         streaming large files in groups of STREAM_PLAN_CHUNKS
+      2. this thread gathers changed chunks across files (EMBED_WINDOW_BATCHES x
+         `batch_size` at a time) and embeds them in length-bucketed batches
+      3. `insert_workers` threads write batches; at most 2x that many batches are
+         in flight, after which embedding blocks (backpressure)
+    The local index is not thread-safe, so it always uses one insert worker.
+
+    With `dedup`, a pre-pass over the scraped pages finds per-domain
+    boilerplate, which is cut before chunking, and near-duplicate chunks are
+    dropped in stage 1 (see execution/dedup.py). The pre-pass picks which
+    copy of a duplicate is kept, in sorted file order, so it does not depend
+    on which worker reads a file first. Dedup counts are returned under
+    "dedup".
+    """
+    json_files = sorted(glob.glob(os.path.join(source_dir, "*.json")) + glob.glob(os.path.join(source_dir, "*.jsonl")))
 
-        count = insert_chunks(chunks)
-        total_chunks += count
-        total_files += 1
-        print(f"  ✅ {filename} — {count} chunks ({source_type})")
+    if not json_files:
+        print(f"No JSON files found in {source_dir}")
+        return {"files": 0, "chunks": 0, "unchanged": 0, "deleted": 0}
+
+    deduplicator = None
+    if dedup:
+        try:
+            from execution.dedup import Deduplicator
+        except ImportError:
+            sys.path.insert(0, os.path.dirname(__file__))
+            from dedup import Deduplicator
+        deduplicator = Deduplicator()
+        scan_scrape_pages(json_files, deduplicator)
+
+    manifest = load_manifest(backend)
+    workers = max(1, min(workers, len(json_files)))
+    if backend == "local":
+        insert_workers = 1
+
+    totals = {"files": 0, "chunks": 0, "unchanged": 0, "deleted": 0, "failed": 0, "failed_files": 0}
+    pending = {}     # filename -> chunks queued but not yet written
+    sealed = set()   # files whose final plan has been seen
+    lock = threading.Lock()
+
+    def finish_if_done(filename: str):
+        """Count a file once it is fully read and all its chunks are written (call under lock)."""
+        if filename in sealed and pending.get(filename, 0) == 0:
+            sealed.discard(filename)
+            totals["files"] += 1
+            print(f"  ✅ {filename} — written")
+
+    # -- stage 1: readers ---------------------------------------------------
+    files_q: queue.Queue = queue.Queue()
+    for filepath in json_files:
+        files_q.put(filepath)
+    plans_q: queue.Queue = queue.Queue(maxsize=workers * 2)
 
-    return {"files": total_files, "chunks": total_chunks}
+    def reader():
+        try:
+            while True:
+                try:
+                    filepath = files_q.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    for plan in prepare_file(filepath, manifest, force, deduplicator):
+                        plans_q.put(plan)
+                except Exception as e:
+                    # A chunker bug on one file must not stall or abort the run
+                    filename = os.path.basename(filepath)
+                    print(f"  ❌ {filename} — failed to chunk: {type(e).__name__}: {e}")
+                    plans_q.put(failed_plan(filename))
+        finally:
+            plans_q.put(None)  # the embed stage counts one sentinel per reader
+
+    readers = [threading.Thread(target=reader, daemon=True) for _ in range(workers)]
+    for t in readers:
+        t.start()
+
+    # -- stage 3: writers ---------------------------------------------------
+    inflight = threading.BoundedSemaphore(insert_workers * 2)
+    pool = ThreadPoolExecutor(max_workers=insert_workers)
+
+    def write(chunks: list[dict], embeddings: list, replaced_ids: list, stale_ids: list):
+        try:
+            written = write_chunks(chunks, embeddings, backend, replaced_ids)
+            deleted = delete_rows(stale_ids, backend)
+        except Exception as e:
+            # BulkWriteError reports rows committed before the failing batch
+            written = getattr(e, "written", 0)
+            names = sorted({c["source"] for c in chunks[written:]})
+            print(f"  ❌ write failed for {', '.join(names)}: {e}", file=sys.stderr)
+            with lock:
+                totals["chunks"] += written
+                totals["failed"] += len(chunks) - written
+            return
+        finally:
+            inflight.release()
+
+        with lock:
+            totals["chunks"] += written
+            totals["deleted"] += deleted
+            for chunk in chunks:
+                pending[chunk["source"]] -= 1
+            for filename in {c["source"] for c in chunks}:
+                finish_if_done(filename)
+
+    def submit(chunks: list[dict], embeddings: list, replaced_ids: list, stale_ids: list):
+        inflight.acquire()
+        pool.submit(write, chunks, embeddings, replaced_ids, stale_ids)
+
+    # -- stage 2: cross-file embedding batches ------------------------------
+    batch, batch_replaced, batch_stale = [], [], []
+
+    def flush():
+        nonlocal batch, batch_replaced, batch_stale
+        if batch or batch_stale:
+            embeddings = generate_embeddings([c["content"] for c in batch], batch_size) if batch else []
+            submit(batch, embeddings, batch_replaced, batch_stale)
+        batch, batch_replaced, batch_stale = [], [], []
+
+    start = time.perf_counter()
+    finished_readers = 0
+    while finished_readers < workers:
+        plan = plans_q.get()
+        if plan is None:
+            finished_readers += 1
+            continue
+
+        filename = plan["filename"]
+        totals["unchanged"] += plan["unchanged"]
+        totals["failed_files"] += int(plan.get("failed", False))
+        if plan["changed"]:
+            with lock:
+                pending[filename] = pending.get(filename, 0) + len(plan["changed"])
+        if plan["final"]:
+            if plan.get("changed_total"):
+                print(f"  📄 {filename} — {plan['changed_total']} new/changed, "
+                      f"{plan['unchanged_total']} unchanged, {len(plan['stale_ids'])} stale")
+            elif plan["stale_ids"]:
+                print(f"  🧹 {filename} — removing {len(plan['stale_ids'])} stale chunks")
+            if plan.get("changed_total") or plan["stale_ids"]:
+                with lock:
+                    sealed.add(filename)
+                    finish_if_done(filename)
+
+        batch_replaced.extend(plan["replaced_ids"])
+        batch_stale.extend(plan["stale_ids"])
+        for chunk in plan["changed"]:
+            batch.append(chunk)
+            if len(batch) >= batch_size * EMBED_WINDOW_BATCHES:
+                flush()
+    flush()
+
+    pool.shutdown(wait=True)
+    totals["seconds"] = round(time.perf_counter() - start, 2)
+
+    if backend == "local":
+        get_local_index().compact()
+    if deduplicator is not None:
+        totals["dedup"] = deduplicator.summary()
+
+    return totals
 
 
 def main():
     parser = argparse.ArgumentParser(description="Ingest JSON data into RAG vector store")
-    parser.add_argument("--source-dir", default=".tmp", help="Directory with JSON files (default: .tmp)")
-    parser.add_argument("--force", action="store_true", help="Re-index even if already indexed")
+    parser.add_argument("--source-dir", default=".tmp", help="Directory with JSON/JSONL files (default: .tmp)")
+    parser.add_argument("--force", action="store_true", help="Re-embed and upsert every chunk, even unchanged ones")
+    parser.add_argument("--backend", choices=["supabase", "local"], default=RAG_BACKEND,
+                        help="Vector store backend (default: RAG_BACKEND env or supabase)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"File read/parse threads (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Max chunks per embedding forward pass (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--insert-workers", type=int, default=DEFAULT_INSERT_WORKERS,
+                        help=f"Concurrent insert requests (default: {DEFAULT_INSERT_WORKERS})")
+    parser.add_argument("--write-batch-rows", type=int, help="Max rows per upsert request (default: 500)")
+    parser.add_argument("--write-batch-bytes", type=int, help="Max payload bytes per upsert request (default: 2MB)")
+    parser.add_argument("--index-dtype", choices=["float32", "float16", "int8"], default="float32",
+                        help="Storage type when creating a local index")
+    parser.add_argument("--ivf-lists", type=int, default=0,
+                        help="Build an IVF index with N lists after a local ingest (0 = brute force only)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Cut per-domain boilerplate and drop near-duplicate chunks from scraped pages")
     args = parser.parse_args()
 
-    print(f"RAG Ingest — scanning {args.source_dir}/")
-    result = ingest_directory(args.source_dir, force=args.force)
-    print(f"\nDone: ingested {result['chunks']} chunks from {result['files']} files")
+    if args.backend == "local":
+        get_local_index(args.index_dtype)
+    else:
+        get_bulk_writer(args.write_batch_rows, args.write_batch_bytes)
+
+    print(f"RAG Ingest — scanning {args.source_dir}/ ({args.backend})")
+    result = ingest_directory(
+        args.source_dir,
+        force=args.force,
+        backend=args.backend,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        insert_workers=args.insert_workers,
+        dedup=args.dedup,
+    )
+    print(
+        f"\nDone: upserted {result['chunks']} chunks from {result['files']} files "
+        f"({result['unchanged']} unchanged, {result['deleted']} stale removed)"
+    )
+    if result.get("failed"):
+        print(f"⚠️  {result['failed']} chunks failed to write — re-run to retry them")
+    if result.get("failed_files"):
+        print(f"⚠️  {result['failed_files']} files could not be read or chunked — see ❌ lines above")
+    if _embed_stats["chunks"]:
+        stats = embedding_stats()
+        print(f"Embedding: {stats['chunks']} chunks in {stats['batches']} batches, "
+              f"{stats['chunks_per_sec']} chunks/sec, padding efficiency {stats['padding_efficiency']:.0%}")
+    if result.get("dedup"):
+        stats = result["dedup"]
+        print(f"Dedup: {stats['boilerplate_blocks_removed']} boilerplate blocks cut "
+              f"({stats['boilerplate_chars_removed']:,} chars, {stats['boilerplate_blocks']} distinct, "
+              f"{stats['pages']} pages), {stats['near_duplicate_chunks']} near-duplicate chunks dropped, "
+              f"{stats['embeddings_saved']} embedding calls saved")
+    if _embedding_cache is not None:
+        print(f"Embedding cache: {_embedding_cache.stats()}")
+    if _bulk_writer is not None and _bulk_writer.stats["batches"]:
+        print(f"Writes: {_bulk_writer.stats}")
+
+    if args.backend == "local" and args.ivf_lists:
+        lists = get_local_index().build_ivf(args.ivf_lists)
+        print(f"Built IVF index: {lists} lists over {get_local_index().count} rows")
 
 
 if __name__ == "__main__":
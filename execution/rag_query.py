@@ -7,9 +7,12 @@ Directive: directives/rag_pipeline.md
 """
 
 import argparse
+import base64
 import json
 import os
+import re
 import sys
+import time
 from datetime import datetime
 
 import numpy as np
@@ -25,17 +28,36 @@ SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
 DEFAULT_THRESHOLD = 0.65
 DEFAULT_TOP_K = 5
+# Context packing (pack_context)
+RELEVANCE_FLOOR_RATIO = 0.85   # drop passages below this fraction of the best similarity
+MIN_TRIM_TOKENS = 64           # a passage trimmed to fit the budget must keep at least this much
+MAX_OVERLAP_CHARS = 2000       # longest chunk overlap searched for when merging neighbours
+MIN_OVERLAP_CHARS = 20         # shorter boundary matches are coincidence, not chunk overlap
 DEFAULT_FETCH_K = 20
+EMBEDDING_DIM = 384
+RAG_BACKEND = os.getenv("RAG_BACKEND", "supabase")  # "supabase" | "local"
+LOCAL_INDEX_DIR = os.getenv("RAG_LOCAL_INDEX", ".tmp/rag_index")
 
 _model = None
 _supabase = None
+_local_index = None
+_embedding_cache = None
+_single_flight = None
 
 
 def get_model():
+    """The running embedding server's client if there is one, else the model loaded
+    in-process on EMBEDDING_BACKEND (torch, onnx or onnx-int8)."""
     global _model
     if _model is None:
-        from sentence_transformers import SentenceTransformer
-        _model = SentenceTransformer(EMBEDDING_MODEL)
+        try:
+            from execution.embedding_backend import load_model
+            from execution.embedding_server import connect
+        except ImportError:
+            sys.path.insert(0, os.path.dirname(__file__))
+            from embedding_backend import load_model
+            from embedding_server import connect
+        _model = connect(EMBEDDING_MODEL) or load_model(EMBEDDING_MODEL)
     return _model
 
 
@@ -50,10 +72,128 @@ def get_supabase():
     return _supabase
 
 
+def get_local_index():
+    global _local_index
+    if _local_index is None:
+        try:
+            from execution.local_index import LocalVectorIndex
+        except ImportError:
+            sys.path.insert(0, os.path.dirname(__file__))
+            from local_index import LocalVectorIndex
+        _local_index = LocalVectorIndex(LOCAL_INDEX_DIR, dim=EMBEDDING_DIM)
+    return _local_index
+
+
+def get_embedding_cache():
+    global _embedding_cache
+    if _embedding_cache is None:
+        try:
+            from execution.embedding_cache import EmbeddingCache
+        except ImportError:
+            sys.path.insert(0, os.path.dirname(__file__))
+            from embedding_cache import EmbeddingCache
+        _embedding_cache = EmbeddingCache(EMBEDDING_MODEL)
+    return _embedding_cache
+
+
+def get_single_flight():
+    """In-process single-flight for query embeddings (no lock files: results are arrays)."""
+    global _single_flight
+    if _single_flight is None:
+        try:
+            from execution.single_flight import SingleFlight
+        except ImportError:
+            sys.path.insert(0, os.path.dirname(__file__))
+            from single_flight import SingleFlight
+        _single_flight = SingleFlight(lock_dir=None)
+    return _single_flight
+
+
+def embed_query(query: str) -> np.ndarray:
+    """Normalized query embedding; the model is only loaded on a cache miss.
+
+    Concurrent calls for the same text (e.g. the semantic cache probe and
+    retrieval running side by side) share one encode.
+    """
+    cache = get_embedding_cache()
+    vector, _ = get_single_flight().do(cache.key(query), lambda: cache.encode(
+        [query], lambda texts: get_model().encode(texts, normalize_embeddings=True)
+    )[0])
+    return vector
+
+
+# ---------------------------------------------------------------------------
+# Stored embeddings (match_documents_with_embeddings)
+# ---------------------------------------------------------------------------
+
+def decode_embeddings(encoded: list[str], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Decode base64 pgvector binary payloads into an (n, dim) float32 matrix.
+
+    Each payload is pgvector's send format: int16 dim, int16 unused, then
+    `dim` big-endian float4 values. Postgres wraps base64 output at 76 chars;
+    b64decode discards the newlines.
+    """
+    row_bytes = 4 + 4 * dim
+    raw = b"".join(base64.b64decode(e) for e in encoded)
+    if len(raw) != row_bytes * len(encoded):
+        raise ValueError(f"Unexpected embedding payload size: {len(raw)} bytes for {len(encoded)} rows")
+
+    rows = np.frombuffer(raw, dtype=np.uint8).reshape(len(encoded), row_bytes)
+    return np.ascontiguousarray(rows[:, 4:]).view(">f4").astype(np.float32)
+
+
 # ---------------------------------------------------------------------------
 # MMR (Maximal Marginal Relevance)
 # ---------------------------------------------------------------------------
 
+def mmr_select_batch(
+    query_sims: np.ndarray,
+    gram: np.ndarray,
+    counts: np.ndarray,
+    k: int,
+    lambda_mult: float = 0.7,
+) -> list[list[int]]:
+    """Greedy MMR selection for a batch of queries.
+
+    query_sims: (Q, N) candidate-to-query similarities.
+    gram: (Q, N, N) candidate-to-candidate similarities, computed once.
+    counts: (Q,) number of real candidates per row; columns past it are padding.
+
+    Keeps a running max-redundancy vector per query, updated with one Gram row
+    after each pick, so each step is O(N) instead of O(N * |selected|).
+    """
+    n_queries, n_cands = query_sims.shape
+    rows = np.arange(n_queries)
+    picks_per_row = np.minimum(counts, k)
+
+    # Padding and already-selected candidates are masked with -inf
+    blocked = np.arange(n_cands)[None, :] >= counts[:, None]
+    max_redundancy = np.zeros((n_queries, n_cands))
+    selected = [[] for _ in range(n_queries)]
+
+    for step in range(int(picks_per_row.max(initial=0))):
+        if step == 0:
+            # First pick: most similar to query
+            scores = query_sims.copy()
+        else:
+            scores = lambda_mult * query_sims - (1 - lambda_mult) * max_redundancy
+        scores[blocked] = -np.inf
+        best = np.argmax(scores, axis=1)
+
+        active = step < picks_per_row
+        for q in rows[active]:
+            selected[q].append(int(best[q]))
+        blocked[rows[active], best[active]] = True
+
+        redundancy = gram[rows, best]
+        if step == 0:
+            max_redundancy = redundancy
+        else:
+            np.maximum(max_redundancy, redundancy, out=max_redundancy)
+
+    return selected
+
+
 def mmr_rerank(
     query_embedding: np.ndarray,
     doc_embeddings: list[np.ndarray],
@@ -65,50 +205,41 @@ def mmr_rerank(
 
     Balances relevance to query (lambda_mult) with diversity (1 - lambda_mult).
     """
-    if not documents:
-        return []
-    if len(documents) <= k:
-        return documents
-
-    query_emb = np.array(query_embedding).reshape(1, -1)
-    doc_embs = np.array(doc_embeddings)
-
-    # Cosine similarities to query
-    query_sims = np.dot(doc_embs, query_emb.T).flatten()
-
-    selected_indices = []
-    remaining_indices = list(range(len(documents)))
-
-    # First pick: most similar to query
-    best_idx = int(np.argmax(query_sims))
-    selected_indices.append(best_idx)
-    remaining_indices.remove(best_idx)
-
-    # Iteratively pick next best
-    while len(selected_indices) < k and remaining_indices:
-        best_score = -float("inf")
-        best_remaining = -1
+    return mmr_rerank_batch([query_embedding], [doc_embeddings], [documents], k, lambda_mult)[0]
 
-        for idx in remaining_indices:
-            # Relevance to query
-            relevance = query_sims[idx]
 
-            # Max similarity to already selected docs
-            selected_embs = doc_embs[selected_indices]
-            redundancy = float(np.max(np.dot(selected_embs, doc_embs[idx].reshape(-1, 1))))
+def mmr_rerank_batch(
+    query_embeddings: list[np.ndarray],
+    doc_embeddings: list[np.ndarray],
+    documents: list[list[dict]],
+    k: int = 5,
+    lambda_mult: float = 0.7,
+) -> list[list[dict]]:
+    """MMR-rerank the candidate lists of many queries in one vectorized pass.
 
-            # MMR score
-            score = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+    Candidate lists may differ in length; they are zero-padded to the longest.
+    Rows with k or fewer candidates are returned unchanged.
+    """
+    results = [[] if not docs else docs for docs in documents]
+    todo = [i for i, docs in enumerate(documents) if len(docs) > k]
+    if not todo:
+        return results
 
-            if score > best_score:
-                best_score = score
-                best_remaining = idx
+    # float64 throughout so scores match the reference per-candidate loop
+    counts = np.array([len(documents[i]) for i in todo])
+    dim = len(query_embeddings[todo[0]])
+    cands = np.zeros((len(todo), int(counts.max()), dim))
+    for row, i in enumerate(todo):
+        cands[row, :counts[row]] = np.asarray(doc_embeddings[i], dtype=np.float64)
+    queries = np.array([np.asarray(query_embeddings[i], dtype=np.float64).ravel() for i in todo])
 
-        if best_remaining >= 0:
-            selected_indices.append(best_remaining)
-            remaining_indices.remove(best_remaining)
+    query_sims = np.einsum("qnd,qd->qn", cands, queries)
+    gram = np.matmul(cands, cands.transpose(0, 2, 1))
 
-    return [documents[i] for i in selected_indices]
+    for row, picks in enumerate(mmr_select_batch(query_sims, gram, counts, k, lambda_mult)):
+        docs = documents[todo[row]]
+        results[todo[row]] = [docs[j] for j in picks]
+    return results
 
 
 # ---------------------------------------------------------------------------
@@ -121,25 +252,59 @@ def query_documents(
     top_k: int = DEFAULT_TOP_K,
     fetch_k: int = DEFAULT_FETCH_K,
     source_type: str = None,
+    reencode: bool = False,
+    backend: str = None,
+    cancel=None,
+    timings: dict | None = None,
 ) -> dict:
-    """Query the vector store and return relevant documents with MMR reranking."""
-
-    # 1. Generate query embedding
-    model = get_model()
-    query_embedding = model.encode(query, normalize_embeddings=True).tolist()
-
-    # 2. Search Supabase
-    sb = get_supabase()
-    params = {
-        "query_embedding": query_embedding,
-        "match_threshold": threshold,
-        "match_count": fetch_k,
-    }
-    if source_type:
-        params["filter_source_type"] = source_type
+    """Query the vector store and return relevant documents with MMR reranking.
+
+    By default candidates come back with their stored embeddings, so MMR needs
+    no extra model calls. `reencode=True` uses the original `match_documents`
+    RPC and re-embeds candidate texts instead.
+
+    `backend` is "supabase" (pgvector RPC) or "local" (LocalVectorIndex under
+    RAG_LOCAL_INDEX); defaults to RAG_BACKEND.
+
+    `cancel` (a threading.Event) is checked between stages; once set, the
+    remaining stages are skipped and the result has "cancelled": True.
+    Per-stage milliseconds (embed_ms, search_ms, mmr_ms) go into `timings`.
+    """
+    backend = backend or RAG_BACKEND
+    timings = timings if timings is not None else {}
+    cancelled = {"query": query, "documents": [], "count": 0, "cancelled": True,
+                 "timestamp": datetime.now().isoformat()}
+
+    # 1. Generate query embedding (cached)
+    start = time.perf_counter()
+    query_embedding = embed_query(query).tolist()
+    timings["embed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    if cancel is not None and cancel.is_set():
+        return cancelled
+
+    # 2. Search the vector store
+    start = time.perf_counter()
+    doc_embeddings = None
+    if backend == "local":
+        documents, doc_embeddings = get_local_index().search(
+            query_embedding, threshold=threshold, count=fetch_k, source_type=source_type,
+        )
+    else:
+        sb = get_supabase()
+        params = {
+            "query_embedding": query_embedding,
+            "match_threshold": threshold,
+            "match_count": fetch_k,
+        }
+        if source_type:
+            params["filter_source_type"] = source_type
 
-    result = sb.rpc("match_documents", params).execute()
-    documents = result.data or []
+        rpc = "match_documents" if reencode else "match_documents_with_embeddings"
+        result = sb.rpc(rpc, params).execute()
+        documents = result.data or []
+    timings["search_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    if cancel is not None and cancel.is_set():
+        return cancelled
 
     if not documents:
         return {
@@ -149,13 +314,18 @@ def query_documents(
             "timestamp": datetime.now().isoformat(),
         }
 
-    # 3. Extract embeddings for MMR (re-embed to compute diversity)
-    doc_texts = [d["content"] for d in documents]
-    doc_embeddings = model.encode(doc_texts, normalize_embeddings=True)
+    # 3. Candidate embeddings for MMR (the local backend returns them with the results)
+    start = time.perf_counter()
+    if doc_embeddings is None and reencode:
+        doc_texts = [d["content"] for d in documents]
+        doc_embeddings = get_model().encode(doc_texts, normalize_embeddings=True)
+    elif doc_embeddings is None:
+        doc_embeddings = decode_embeddings([d.pop("embedding") for d in documents])
     query_emb = np.array(query_embedding)
 
     # 4. Apply MMR
     reranked = mmr_rerank(query_emb, doc_embeddings, documents, k=top_k)
+    timings["mmr_ms"] = round((time.perf_counter() - start) * 1000, 1)
 
     return {
         "query": query,
@@ -183,6 +353,141 @@ def format_context_for_llm(documents: list[dict]) -> str:
     return "\n\n---\n\n".join(parts)
 
 
+def _count_tokens(texts: list[str]) -> list[int]:
+    try:
+        from execution.chunking import count_tokens
+    except ImportError:
+        sys.path.insert(0, os.path.dirname(__file__))
+        from chunking import count_tokens
+    return count_tokens(texts)
+
+
+def _join_overlapping(first: str, second: str) -> str:
+    """Concatenate neighbouring chunks, dropping the text they share.
+
+    Chunks of one source overlap (tail of chunk i == head of chunk i+1) and
+    repeat the same heading breadcrumb; both are kept only once. Overlap is
+    whole sentences, so a match only counts if it is at least
+    MIN_OVERLAP_CHARS long and starts and ends on whitespace; anything else
+    is joined as a new paragraph.
+    """
+    head, sep, body = second.partition("\n\n")
+    if sep and first.startswith(head + "\n\n"):
+        second = body
+    for size in range(min(len(first), len(second), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if not first.endswith(second[:size]):
+            continue
+        starts_clean = size == len(first) or first[-size - 1].isspace()
+        ends_clean = size == len(second) or second[size].isspace()
+        if starts_clean and ends_clean:
+            return first + second[size:]
+    return first + "\n\n" + second
+
+
+def merge_neighbours(documents: list[dict]) -> tuple[list[dict], int]:
+    """Dedupe chunks and merge adjacent chunk_index runs of a source into passages.
+
+    Returns (passages, chunks merged away). A passage keeps the best
+    similarity of its chunks and lists them in `chunk_indices`.
+    """
+    seen, unique = set(), []
+    for doc in documents:
+        key = (doc.get("source"), doc.get("chunk_index")) if doc.get("chunk_index") is not None else None
+        text_key = doc.get("content", "").strip()
+        if key in seen or text_key in seen:
+            continue
+        seen.update(k for k in (key, text_key) if k is not None)
+        unique.append(doc)
+
+    by_source: dict[str, list[dict]] = {}
+    for doc in unique:
+        by_source.setdefault(doc.get("source", "unknown"), []).append(doc)
+
+    passages = []
+    for source, docs in by_source.items():
+        docs.sort(key=lambda d: d.get("chunk_index") if d.get("chunk_index") is not None else -1)
+        current = None
+        for doc in docs:
+            idx = doc.get("chunk_index")
+            if current and idx is not None and current["chunk_indices"][-1] is not None \
+                    and idx == current["chunk_indices"][-1] + 1:
+                current["content"] = _join_overlapping(current["content"], doc["content"])
+                current["similarity"] = max(current["similarity"], doc.get("similarity", 0))
+                current["chunk_indices"].append(idx)
+                continue
+            current = {
+                **doc,
+                "source": source,
+                "similarity": doc.get("similarity", 0),
+                "chunk_indices": [idx],
+            }
+            passages.append(current)
+    return passages, len(unique) - len(passages)
+
+
+def _trim_to_tokens(text: str, budget: int) -> str:
+    """Longest prefix of whole sentences (or words) within `budget` tokens, formatting kept."""
+    ends = [m.end() for m in re.finditer(r"[.!?\n]\s+", text)] + [len(text)]
+    if len(ends) == 1:
+        ends = [m.end() for m in re.finditer(r"\s+", text)] + [len(text)]
+    starts = [0] + ends[:-1]
+    cut = 0
+    for end, tokens in zip(ends, _count_tokens([text[a:b] for a, b in zip(starts, ends)])):
+        if budget < tokens:
+            break
+        budget -= tokens
+        cut = end
+    return text[:cut].rstrip() + " …" if cut else ""
+
+
+def pack_context(documents: list[dict], budget_tokens: int) -> tuple[str, list[dict], dict]:
+    """Assemble an LLM context within a token budget.
+
+    Overlapping/duplicate chunks are deduped and adjacent chunks of a source
+    merged, passages below RELEVANCE_FLOOR_RATIO x the best similarity are
+    dropped, and the rest are added by relevance until the budget is spent
+    (the last one trimmed at a sentence boundary if enough room is left).
+    Returns (context, passages numbered as in the [Source N] labels, stats).
+    """
+    if not documents:
+        return "", [], {"tokens_before": 0, "tokens_after": 0, "saved_pct": 0.0, "merged": 0, "dropped": 0}
+
+    tokens_before = _count_tokens([format_context_for_llm(documents)])[0]
+    passages, merged = merge_neighbours(documents)
+    passages.sort(key=lambda p: -p["similarity"])
+    floor = passages[0]["similarity"] * RELEVANCE_FLOOR_RATIO
+
+    # Label + separator overhead per passage, measured on a representative label
+    overhead = _count_tokens(["[Source 10: x (relevance: 80%)]\n\n---\n\n"])[0]
+    packed, used = [], 0
+    for passage, tokens in zip(passages, _count_tokens([p["content"] for p in passages])):
+        if passage["similarity"] < floor:
+            break
+        room = budget_tokens - used - overhead - len(passage["source"]) // 4
+        if tokens <= room:
+            packed.append(passage)
+            used += tokens + overhead
+        elif room >= MIN_TRIM_TOKENS:
+            trimmed = _trim_to_tokens(passage["content"], room)
+            if trimmed:
+                packed.append({**passage, "content": trimmed, "trimmed": True})
+            break
+        else:
+            break
+
+    context = format_context_for_llm(packed)
+    tokens_after = _count_tokens([context])[0] if context else 0
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "saved_pct": round(100 * (1 - tokens_after / tokens_before), 1) if tokens_before else 0.0,
+        "merged": merged,
+        "dropped": len(passages) - len(packed),
+        "budget": budget_tokens,
+    }
+    return context, packed, stats
+
+
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
@@ -193,17 +498,31 @@ def main():
     parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="Number of results")
     parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Similarity threshold")
     parser.add_argument("--source-type", help="Filter by source type")
+    parser.add_argument("--fetch-k", type=int, default=DEFAULT_FETCH_K, help="Candidates fetched before MMR")
+    parser.add_argument("--backend", choices=["supabase", "local"], default=RAG_BACKEND,
+                        help="Vector store backend (default: RAG_BACKEND env or supabase)")
+    parser.add_argument("--reencode", action="store_true",
+                        help="Re-embed candidates for MMR instead of using stored embeddings")
     parser.add_argument("--format", choices=["json", "context"], default="json", help="Output format")
+    parser.add_argument("--budget", type=int, help="With --format context: pack into this many tokens")
     args = parser.parse_args()
 
     result = query_documents(
         query=args.query,
         top_k=args.top_k,
         threshold=args.threshold,
+        fetch_k=args.fetch_k,
         source_type=args.source_type,
+        reencode=args.reencode,
+        backend=args.backend,
     )
 
-    if args.format == "context":
+    if args.format == "context" and args.budget:
+        ctx, _, stats = pack_context(result["documents"], args.budget)
+        print(ctx if ctx else "No relevant documents found.")
+        print(f"\n✂️  {stats['tokens_before']} → {stats['tokens_after']} tokens (-{stats['saved_pct']}%), "
+              f"{stats['merged']} merged, {stats['dropped']} dropped", file=sys.stderr)
+    elif args.format == "context":
         ctx = format_context_for_llm(result["documents"])
         print(ctx if ctx else "No relevant documents found.")
     else:
@@ -0,0 +1,458 @@
+"""
+Response Cache — Execution Module
+Layered cache for chat_analysis responses: a bounded in-memory LRU with TTL,
+an optional SQLite tier that survives restarts, then the Supabase
+`query_cache` table. Lookups fall through the tiers and promote hits
+upward; Supabase writes and expired-row purges run on a background thread
+so they never add to response latency. With an embedding function, exact
+misses fall back to a semantic lookup: the closest earlier query in the same
+mode, via an in-memory vector index and then `match_query_cache`.
+
+Directive: directives/rag_pipeline.md
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+DEFAULT_TTL_HOURS = 24
+DEFAULT_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+# Empty string disables the on-disk tier
+DEFAULT_DB_PATH = os.getenv("RESPONSE_CACHE_DB", ".tmp/response_cache.sqlite")
+PURGE_INTERVAL_SECONDS = 3600   # expired rows are purged this often while the writer runs (at most, across runs)
+FLUSH_TIMEOUT_SECONDS = 10      # max wait at exit for pending Supabase writes
+# Cosine similarity for a semantic hit; 0 disables semantic lookups
+DEFAULT_SEMANTIC_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+
+TIERS = ("memory", "disk", "supabase", "semantic")
+
+
+def cache_key(query: str, mode: str) -> str:
+    """Same key as the original query_cache rows, so existing entries stay valid."""
+    return hashlib.md5(f"{query.strip().lower()}:{mode}".encode()).hexdigest()
+
+
+class SemanticIndex:
+    """Per-mode matrix of normalized query embeddings; search is one matvec.
+
+    Rows are appended into preallocated capacity (doubling), so inserts are
+    amortized O(1) and a lookup over a few thousand cached queries takes well
+    under a millisecond. Not thread-safe; ResponseCache holds its lock.
+    """
+
+    def __init__(self):
+        self._modes: dict[str, dict] = {}
+
+    def add(self, mode: str, key: str, vector, created_at: float) -> None:
+        vec = np.asarray(vector, dtype=np.float32)
+        part = self._modes.get(mode)
+        if part is None:
+            part = self._modes[mode] = {
+                "keys": [], "rows": {}, "n": 0,
+                "matrix": np.zeros((16, len(vec)), dtype=np.float32),
+                "created": np.zeros(16, dtype=np.float64),
+            }
+        row = part["rows"].get(key)
+        if row is None:
+            row = part["n"]
+            if row == len(part["matrix"]):
+                part["matrix"] = np.concatenate([part["matrix"], np.zeros_like(part["matrix"])])
+                part["created"] = np.concatenate([part["created"], np.zeros_like(part["created"])])
+            part["keys"].append(key)
+            part["rows"][key] = row
+            part["n"] += 1
+        part["matrix"][row] = vec
+        part["created"][row] = created_at
+
+    def search(self, mode: str, vector, threshold: float, min_created: float) -> tuple[str, float] | None:
+        """(key, similarity) of the closest fresh query with similarity >= threshold."""
+        part = self._modes.get(mode)
+        if part is None or not part["n"]:
+            return None
+        n = part["n"]
+        sims = part["matrix"][:n] @ np.asarray(vector, dtype=np.float32)
+        sims[part["created"][:n] <= min_created] = -1.0
+        best = int(np.argmax(sims))
+        if sims[best] < threshold:
+            return None
+        return part["keys"][best], float(sims[best])
+
+    def prune(self, min_created: float) -> None:
+        """Drop expired rows (rebuilds each mode's matrix)."""
+        for mode, part in list(self._modes.items()):
+            n = part["n"]
+            keep = np.flatnonzero(part["created"][:n] > min_created)
+            if len(keep) == n:
+                continue
+            keys = [part["keys"][i] for i in keep]
+            part.update(
+                keys=keys, rows={k: i for i, k in enumerate(keys)}, n=len(keys),
+                matrix=np.concatenate([part["matrix"][keep], np.zeros_like(part["matrix"][:16])]),
+                created=np.concatenate([part["created"][keep], np.zeros(16)]),
+            )
+
+    def __len__(self) -> int:
+        return sum(part["n"] for part in self._modes.values())
+
+
+class ResponseCache:
+    """memory LRU -> SQLite -> Supabase query_cache, with write-behind to Supabase.
+
+    `get_client` is called lazily and may return None when Supabase is not
+    configured; the cache then works with the local tiers only. `embed_fn`
+    (text -> normalized vector) enables the semantic tier.
+    """
+
+    def __init__(
+        self,
+        get_client=None,
+        ttl_hours: float = DEFAULT_TTL_HOURS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        db_path: str | None = DEFAULT_DB_PATH,
+        embed_fn=None,
+        semantic_threshold: float = DEFAULT_SEMANTIC_THRESHOLD,
+    ):
+        self._get_client = get_client or (lambda: None)
+        self.embed_fn = embed_fn if semantic_threshold > 0 else None
+        self.semantic_threshold = semantic_threshold
+        self._index = SemanticIndex()
+        self.ttl = timedelta(hours=ttl_hours)
+        self.max_entries = max_entries
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = {tier: 0 for tier in TIERS}
+        self.misses = 0
+        self.write_errors = 0
+
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("pragma journal_mode=wal")
+            self._db.execute(
+                "create table if not exists responses ("
+                "key text primary key, entry text not null, created_at real not null)"
+            )
+            self._db.execute("create table if not exists meta (name text primary key, value real)")
+            columns = {row[1] for row in self._db.execute("pragma table_info(responses)")}
+            if "embedding" not in columns:
+                self._db.execute("alter table responses add column embedding blob")
+            self._db.commit()
+            if self.embed_fn is not None:
+                self._load_index()
+
+        self._writes: queue.Queue = queue.Queue()
+        self._worker = None
+
+    # -- lookup -------------------------------------------------------------
+
+    def get(self, query: str, mode: str) -> dict | None:
+        """Fresh cached result for (query, mode) from the fastest tier that has it."""
+        key = cache_key(query, mode)
+        now = datetime.now(timezone.utc)
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._fresh(entry, now):
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return self._result(entry, "memory")
+            if entry is not None:
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "select entry from responses where key = ? and created_at > ?",
+                    (key, (now - self.ttl).timestamp()),
+                ).fetchone()
+                if row:
+                    entry = json.loads(row[0])
+                    self._remember(key, entry)
+                    self.hits["disk"] += 1
+                    return self._result(entry, "disk")
+
+        entry = self._get_remote(key, now)
+        if entry is not None:
+            with self._lock:
+                self._remember(key, entry)
+                self._store_local(key, entry)
+                self.hits["supabase"] += 1
+            return self._result(entry, "supabase")
+
+        if self.embed_fn is not None:
+            result = self._get_semantic(query, mode, now)
+            if result is not None:
+                return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    # -- semantic tier --------------------------------------------------------
+
+    def _load_index(self) -> None:
+        """Fill the vector index from fresh SQLite rows that have embeddings."""
+        min_created = (datetime.now(timezone.utc) - self.ttl).timestamp()
+        rows = self._db.execute(
+            "select key, entry, created_at, embedding from responses where embedding is not null and created_at > ?",
+            (min_created,),
+        ).fetchall()
+        for key, entry, created_at, blob in rows:
+            self._index.add(json.loads(entry)["mode"], key, np.frombuffer(blob, dtype=np.float32), created_at)
+
+    def _get_semantic(self, query: str, mode: str, now: datetime) -> dict | None:
+        vector = np.asarray(self.embed_fn(query), dtype=np.float32)
+        min_created = now - self.ttl
+
+        with self._lock:
+            match = self._index.search(mode, vector, self.semantic_threshold, min_created.timestamp())
+            if match is not None:
+                key, similarity = match
+                entry = self._memory.get(key)
+                if entry is None and self._db is not None:
+                    row = self._db.execute("select entry from responses where key = ?", (key,)).fetchone()
+                    entry = json.loads(row[0]) if row else None
+                if entry is not None:
+                    self.hits["semantic"] += 1
+                    return {**self._result(entry, "semantic"), "similarity": round(similarity, 4)}
+
+        client = self._get_client()
+        if client is None:
+            return None
+        try:
+            result = client.rpc("match_query_cache", {
+                "query_embedding": vector.tolist(),
+                "match_mode": mode,
+                "match_threshold": self.semantic_threshold,
+                "min_created_at": min_created.isoformat(),
+            }).execute()
+        except Exception as e:
+            print(f"⚠️  match_query_cache failed: {e}", file=sys.stderr)
+            return None
+        if not result.data:
+            return None
+
+        row = result.data[0]
+        entry = {
+            "query": row["query_text"],
+            "mode": row.get("mode"),
+            "response": row["response"],
+            "sources": row.get("sources") or [],
+            "created_at": row["created_at"].replace("Z", "+00:00"),
+            "embedding": vector.tolist(),
+        }
+        with self._lock:
+            # Stored under this paraphrase's own key, since `embedding` is its vector; the
+            # matched row keeps its own. Repeats of this query then hit locally (memory/disk)
+            key = cache_key(query, mode)
+            self._remember(key, entry)
+            self._store_local(key, entry)
+            self.hits["semantic"] += 1
+        return {**self._result(entry, "semantic"), "similarity": round(float(row["similarity"]), 4)}
+
+    def _get_remote(self, key: str, now: datetime) -> dict | None:
+        client = self._get_client()
+        if client is None:
+            return None
+        try:
+            result = (
+                client.table("query_cache").select("*")
+                .eq("query_hash", key)
+                .gt("created_at", (now - self.ttl).isoformat())
+                .limit(1).execute()
+            )
+        except Exception as e:
+            print(f"⚠️  query_cache lookup failed: {e}", file=sys.stderr)
+            return None
+        if not result.data:
+            return None
+        row = result.data[0]
+        return {
+            "query": row["query_text"],
+            "mode": row.get("mode"),
+            "response": row["response"],
+            "sources": row.get("sources") or [],
+            "created_at": row["created_at"].replace("Z", "+00:00"),
+        }
+
+    def _fresh(self, entry: dict, now: datetime) -> bool:
+        return now - datetime.fromisoformat(entry["created_at"]) < self.ttl
+
+    @staticmethod
+    def _result(entry: dict, tier: str) -> dict:
+        return {
+            "query": entry["query"],
+            "mode": entry["mode"],
+            "response": entry["response"],
+            "sources": entry.get("sources", []),
+            "cached": True,
+            "cache_tier": tier,
+            "timestamp": entry["created_at"],
+        }
+
+    # -- store --------------------------------------------------------------
+
+    def put(self, query: str, mode: str, response: str, sources: list) -> None:
+        """Store in the local tiers now and queue the Supabase upsert."""
+        key = cache_key(query, mode)
+        entry = {
+            "query": query,
+            "mode": mode,
+            "response": response,
+            "sources": sources,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if self.embed_fn is not None:
+            entry["embedding"] = np.asarray(self.embed_fn(query), dtype=np.float32).tolist()
+        with self._lock:
+            self._remember(key, entry)
+            self._store_local(key, entry)
+        has_client = self._get_client() is not None
+        if has_client or self._db is not None:
+            self._ensure_worker()  # also purges the SQLite tier, with or without Supabase
+        if has_client:
+            self._writes.put((key, entry))
+
+    def _remember(self, key: str, entry: dict) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _store_local(self, key: str, entry: dict) -> None:
+        created_at = datetime.fromisoformat(entry["created_at"]).timestamp()
+        vector = entry.get("embedding")
+        if vector is not None:
+            self._index.add(entry["mode"], key, vector, created_at)
+        if self._db is None:
+            return
+        self._db.execute(
+            "insert or replace into responses (key, entry, created_at, embedding) values (?, ?, ?, ?)",
+            (
+                key,
+                json.dumps({k: v for k, v in entry.items() if k != "embedding"}, ensure_ascii=False),
+                created_at,
+                np.asarray(vector, dtype=np.float32).tobytes() if vector is not None else None,
+            ),
+        )
+        self._db.commit()
+
+    # -- background writer / purge -------------------------------------------
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run_worker, name="response-cache-writer", daemon=True)
+                self._worker.start()
+                atexit.register(self.flush)
+
+    def _run_worker(self):
+        # Purges repeat for as long as the process lives, so a long batch or chat
+        # session doesn't grow the SQLite file and query_cache without bound
+        next_purge = 0.0
+        while True:
+            if time.monotonic() >= next_purge:
+                try:
+                    self.purge_expired()
+                except Exception as e:
+                    print(f"⚠️  response cache purge failed: {e}", file=sys.stderr)
+                next_purge = time.monotonic() + PURGE_INTERVAL_SECONDS
+            try:
+                key, entry = self._writes.get(timeout=max(0.0, next_purge - time.monotonic()))
+            except queue.Empty:
+                continue
+            try:
+                # created_at is set explicitly: an upsert over an expired row must refresh it
+                row = {
+                    "query_hash": key,
+                    "query_text": entry["query"],
+                    "response": entry["response"],
+                    "sources": entry["sources"],
+                    "mode": entry["mode"],
+                    "created_at": entry["created_at"],
+                }
+                if entry.get("embedding") is not None:
+                    row["query_embedding"] = entry["embedding"]
+                self._get_client().table("query_cache").upsert(row, on_conflict="query_hash").execute()
+            except Exception as e:
+                with self._lock:
+                    self.write_errors += 1
+                print(f"⚠️  query_cache write failed: {e}", file=sys.stderr)
+            finally:
+                self._writes.task_done()
+
+    def flush(self, timeout: float = FLUSH_TIMEOUT_SECONDS) -> bool:
+        """Wait for queued Supabase writes. False if they did not finish in time."""
+        deadline = time.monotonic() + timeout
+        while self._writes.unfinished_tasks:
+            if time.monotonic() > deadline:
+                print(f"⚠️  {self._writes.unfinished_tasks} query_cache writes still pending", file=sys.stderr)
+                return False
+            time.sleep(0.02)
+        return True
+
+    def purge_expired(self, force: bool = False) -> dict:
+        """Delete expired rows from SQLite and Supabase (at most once per PURGE_INTERVAL_SECONDS)."""
+        now = datetime.now(timezone.utc)
+        cutoff = now - self.ttl
+        purged = {"disk": 0, "supabase": 0}
+
+        with self._lock:
+            self._index.prune(cutoff.timestamp())
+            if self._db is not None:
+                last = self._db.execute("select value from meta where name = 'last_purge'").fetchone()
+                if not force and last and now.timestamp() - last[0] < PURGE_INTERVAL_SECONDS:
+                    return purged
+                purged["disk"] = self._db.execute(
+                    "delete from responses where created_at <= ?", (cutoff.timestamp(),)
+                ).rowcount
+                self._db.execute(
+                    "insert or replace into meta (name, value) values ('last_purge', ?)", (now.timestamp(),)
+                )
+                self._db.commit()
+
+        client = self._get_client()
+        if client is not None:
+            try:
+                result = client.table("query_cache").delete().lt("created_at", cutoff.isoformat()).execute()
+                purged["supabase"] = len(result.data or [])
+            except Exception as e:
+                print(f"⚠️  query_cache purge failed: {e}", file=sys.stderr)
+        return purged
+
+    # -- stats --------------------------------------------------------------
+
+    def stats(self) -> dict:
+        """Hits per tier and hit rates. A tier's rate is hits / lookups that reached it."""
+        with self._lock:
+            hits = dict(self.hits)
+            misses = self.misses
+        lookups = sum(hits.values()) + misses
+        reached = lookups
+        rates = {}
+        for tier in TIERS:
+            rates[tier] = round(hits[tier] / reached, 3) if reached else 0.0
+            reached -= hits[tier]
+        return {
+            "lookups": lookups,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(sum(hits.values()) / lookups, 3) if lookups else 0.0,
+            "tier_hit_rates": rates,
+            "semantic_entries": len(self._index),
+            "pending_writes": self._writes.unfinished_tasks,
+            "write_errors": self.write_errors,
+        }
@@ -0,0 +1,145 @@
+"""
+Scrape Cache — Execution Module
+URL-keyed cache for scrape_website. A page fetched within its page_type's
+TTL is not fetched again. An expired page is re-fetched, but if its
+normalized markdown hashes the same as last time no new file is written:
+the existing .tmp file is kept, so rag_ingest sees nothing new to embed.
+Changed content replaces the earlier file under its name, so a URL stays
+one rag_ingest source and its old chunks are replaced, not kept alongside.
+
+Firecrawl does not expose ETag/Last-Modified, so revalidation compares
+content hashes instead of asking the origin.
+
+Directive: directives/scrape_website.md
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+try:
+    from execution.scrape_scheduler import normalize_url
+except ImportError:
+    import sys
+    sys.path.insert(0, os.path.dirname(__file__))
+    from scrape_scheduler import normalize_url
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+# Empty string disables the cache
+DEFAULT_DB_PATH = os.getenv("SCRAPE_CACHE_DB", ".tmp/scrape_cache.sqlite")
+
+# How long a fetched page is served without asking Firecrawl again
+PAGE_TYPE_TTL_HOURS = {
+    "pricing": 24,
+    "blog": 24 * 7,
+    "about": 24 * 30,
+    "unknown": 24 * 3,
+}
+
+_WHITESPACE = re.compile(r"[ \t]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def content_hash(markdown: str) -> str:
+    """Hash of the markdown with formatting-only differences (whitespace, unicode forms) removed."""
+    text = unicodedata.normalize("NFKC", markdown).replace("\r\n", "\n")
+    text = "\n".join(_WHITESPACE.sub(" ", line).strip() for line in text.split("\n"))
+    text = _BLANK_LINES.sub("\n\n", text).strip()
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ScrapeCache:
+    """SQLite table of url -> (page_type, content hash, output path, fetched_at, bytes).
+
+    `lookup` serves fresh entries; `store` decides whether a fetched page
+    needs a new file. Thread-safe; counters feed `stats()`.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, ttl_hours: dict | None = None):
+        self.ttl_hours = {**PAGE_TYPE_TTL_HOURS, **(ttl_hours or {})}
+        self._lock = threading.Lock()
+        self.counts = {"lookups": 0, "hits": 0, "unchanged": 0, "changed": 0, "new": 0}
+        self.bytes_saved = {"fetch": 0, "write": 0}
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute(
+            "create table if not exists pages ("
+            " url text primary key, page_type text, content_hash text not null,"
+            " path text not null, fetched_at real not null, bytes integer not null)"
+        )
+        self._db.commit()
+
+    def ttl_seconds(self, page_type: str) -> float:
+        return self.ttl_hours.get(page_type, self.ttl_hours["unknown"]) * 3600
+
+    def lookup(self, url: str, page_type: str) -> str | None:
+        """Path of a cached page still within its TTL (and still on disk), else None."""
+        with self._lock:
+            self.counts["lookups"] += 1
+            row = self._db.execute(
+                "select path, fetched_at, bytes from pages where url = ?", (normalize_url(url),)
+            ).fetchone()
+            if row is None:
+                return None
+            path, fetched_at, size = row
+            if time.time() - fetched_at > self.ttl_seconds(page_type) or not os.path.exists(path):
+                return None
+            self.counts["hits"] += 1
+            self.bytes_saved["fetch"] += size
+            return path
+
+    def store(self, url: str, page_type: str, markdown: str, save) -> tuple[str, bool]:
+        """Record a freshly fetched page. Returns (path, written).
+
+        `save()` writes the output file and returns its path; it is only
+        called when the content is new or changed. Unchanged pages keep
+        their existing file and just get a new fetched_at. A changed page's
+        new file is moved over the earlier one, which keeps its path.
+        """
+        key = normalize_url(url)
+        digest = content_hash(markdown)
+        size = len(markdown.encode("utf-8"))
+        with self._lock:
+            row = self._db.execute("select content_hash, path from pages where url = ?", (key,)).fetchone()
+        if row is not None and row[0] == digest and os.path.exists(row[1]):
+            path, written, outcome = row[1], False, "unchanged"
+        else:
+            path, written, outcome = save(), True, "changed" if row is not None else "new"
+            if row is not None and row[1] != path and os.path.exists(row[1]):
+                # Same file name as before, so rag_ingest diffs the new version against
+                # the old one's chunks instead of indexing both under different sources
+                os.replace(path, row[1])
+                path = row[1]
+
+        with self._lock:
+            self.counts[outcome] += 1
+            if not written:
+                self.bytes_saved["write"] += size
+            self._db.execute(
+                "insert or replace into pages (url, page_type, content_hash, path, fetched_at, bytes)"
+                " values (?, ?, ?, ?, ?, ?)",
+                (key, page_type, digest, path, time.time(), size),
+            )
+            self._db.commit()
+        return path, written
+
+    def stats(self) -> dict:
+        lookups = self.counts["lookups"]
+        return {
+            **self.counts,
+            "hit_rate": round(self.counts["hits"] / lookups, 3) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved["fetch"] + self.bytes_saved["write"],
+            "fetch_bytes_saved": self.bytes_saved["fetch"],
+            "write_bytes_saved": self.bytes_saved["write"],
+        }
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,276 @@
+"""
+Scrape Scheduler — Execution Module
+Runs many page fetches on a bounded worker pool with a token-bucket rate
+limit per domain, hands each result back as soon as it arrives, and records
+progress in an append-only job state file so an interrupted run resumes
+where it stopped. Crawls pull their URLs from a CrawlFrontier instead of a
+fixed list. Knows nothing about Firecrawl: scrape_website passes in the
+fetch function.
+
+Directive: directives/scrape_website.md
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+JOB_DIR = os.getenv("SCRAPE_JOB_DIR", ".tmp/scrape_jobs")
+DEFAULT_WORKERS = 8
+DEFAULT_DOMAIN_RATE = 1.0    # requests per second per domain
+DEFAULT_DOMAIN_BURST = 2     # requests a domain may receive back to back
+MAX_ATTEMPTS = 3             # per URL per run; failures are retried again on resume
+BASE_DELAY_SECONDS = 2
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "mc_cid", "mc_eid", "ref", "_hsenc", "_hsmi"}  # plus any utm_*
+
+
+def domain_of(url: str) -> str:
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a page URL, so variants of one page share a cache entry.
+
+    Lowercases scheme and host, drops "www.", default ports, the fragment,
+    tracking parameters and a trailing slash, and sorts the query.
+    """
+    parts = urlparse(url.strip())
+    scheme = (parts.scheme or "https").lower()
+    host = domain_of(url)
+    if parts.port and not (scheme == "http" and parts.port == 80 or scheme == "https" and parts.port == 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not (k.lower().startswith("utm_") or k.lower() in TRACKING_PARAMS)
+    ))
+    return urlunparse((scheme, host, path, "", query, ""))
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token; returns how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class DomainLimiter:
+    """One TokenBucket per domain, created on first use."""
+
+    def __init__(self, rate: float = DEFAULT_DOMAIN_RATE, burst: int = DEFAULT_DOMAIN_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url: str):
+        if self.rate <= 0:
+            return
+        domain = domain_of(url)
+        with self._lock:
+            bucket = self._buckets.get(domain)
+            if bucket is None:
+                bucket = self._buckets[domain] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+
+# ---------------------------------------------------------------------------
+# Job state
+# ---------------------------------------------------------------------------
+
+def job_id_for(urls: list[str]) -> str:
+    """Stable id for a URL set, so re-running the same sweep resumes it."""
+    return hashlib.sha1("\n".join(sorted(set(urls))).encode("utf-8")).hexdigest()[:12]
+
+
+class JobState:
+    """Append-only JSONL log of per-URL outcomes; the last line for a URL wins.
+
+    One short line is appended (and flushed) per finished URL, so a crash
+    loses at most the pages in flight, and replaying the log is linear.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a crash
+                    self.entries[entry["url"]] = entry
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_done(self, url: str) -> bool:
+        return self.entries.get(url, {}).get("status") == "done"
+
+    def record(self, url: str, status: str, **fields):
+        entry = {"url": url, "status": status, "at": datetime.now().isoformat(), **fields}
+        with self._lock:
+            self.entries[url] = entry
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def counts(self) -> dict:
+        counts = defaultdict(int)
+        for entry in self.entries.values():
+            counts[entry["status"]] += 1
+        return dict(counts)
+
+    def close(self):
+        self._file.close()
+
+
+# ---------------------------------------------------------------------------
+# Scheduler
+# ---------------------------------------------------------------------------
+
+def interleave_by_domain(urls: list[str]) -> list[str]:
+    """Round-robin URLs across domains, so workers spread over sites instead of
+    queueing behind one domain's rate limit."""
+    queues: dict[str, deque] = defaultdict(deque)
+    for url in urls:
+        queues[domain_of(url)].append(url)
+    ordered = []
+    while queues:
+        for domain in list(queues):
+            ordered.append(queues[domain].popleft())
+            if not queues[domain]:
+                del queues[domain]
+    return ordered
+
+
+class ScrapeScheduler:
+    """Fetch URLs on `workers` threads, at most `rate` requests/s per domain.
+
+    `fetch(url)` returns a result (or raises); `on_result(url, result)` runs
+    on the calling thread as each fetch finishes and returns the fields to
+    record in the job state (e.g. the output path).
+    """
+
+    def __init__(
+        self,
+        fetch,
+        workers: int = DEFAULT_WORKERS,
+        rate: float = DEFAULT_DOMAIN_RATE,
+        burst: int = DEFAULT_DOMAIN_BURST,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self.fetch = fetch
+        self.workers = max(1, workers)
+        self.limiter = DomainLimiter(rate, burst)
+        self.max_attempts = max_attempts
+
+    def _fetch_with_retry(self, url: str):
+        for attempt in range(1, self.max_attempts + 1):
+            self.limiter.acquire(url)
+            try:
+                return self.fetch(url), attempt
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    raise
+                delay = BASE_DELAY_SECONDS * 2 ** (attempt - 1)
+                print(f"⚠️  {url}: {e} — retrying in {delay}s ({attempt}/{self.max_attempts})")
+                time.sleep(delay)
+
+    def run(self, urls: list[str], on_result, on_error=None, state: JobState | None = None) -> dict:
+        """Fetch every URL not already done in `state`; returns done/failed/skipped counts."""
+        pending = [u for u in dict.fromkeys(urls) if not (state and state.is_done(u))]
+        stats = {"done": 0, "failed": 0, "skipped": len(set(urls)) - len(pending)}
+        if stats["skipped"]:
+            print(f"⏭️  Resuming: {stats['skipped']} URLs already done")
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scrape") as pool:
+            futures = {pool.submit(self._fetch_with_retry, url): url for url in interleave_by_domain(pending)}
+            try:
+                while futures:
+                    finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        url = futures.pop(future)
+                        try:
+                            result, attempts = future.result()
+                            fields = on_result(url, result) or {}
+                            stats["done"] += 1
+                            if state:
+                                state.record(url, "done", attempts=attempts, **fields)
+                        except Exception as e:
+                            stats["failed"] += 1
+                            fields = (on_error(url, e) if on_error else None) or {}
+                            if state:
+                                state.record(url, "failed", error=str(e), **fields)
+            except KeyboardInterrupt:
+                # Only the fetches already running finish; the job state keeps what was done
+                for future in futures:
+                    future.cancel()
+                raise
+        return stats
+
+    def crawl(self, frontier, on_result, on_error=None) -> dict:
+        """Fetch URLs from a CrawlFrontier until it runs dry or its budget is spent.
+
+        `on_result(url, depth, result)` runs on the calling thread and returns
+        the links found on the page, which are pushed at depth + 1. At most
+        2 x `workers` fetches are queued at once, so the frontier keeps
+        breadth-first order instead of front-loading one level.
+        """
+        stats = {"done": 0, "failed": 0}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="crawl") as pool:
+            futures = {}
+            try:
+                while True:
+                    while len(futures) < self.workers * 2:
+                        item = frontier.pop()
+                        if item is None:
+                            break
+                        futures[pool.submit(self._fetch_with_retry, item[0])] = item
+                    if not futures:
+                        return stats
+                    finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        url, depth = futures.pop(future)
+                        try:
+                            result, _ = future.result()
+                            links = on_result(url, depth, result) or ()
+                            stats["done"] += 1
+                        except Exception as e:
+                            stats["failed"] += 1
+                            if on_error:
+                                on_error(url, e)
+                            continue
+                        for link in links:
+                            frontier.push(link, depth + 1)
+            except KeyboardInterrupt:
+                for future in futures:
+                    future.cancel()
+                raise
@@ -1,14 +1,21 @@
 """
 Website Scraper — Execution Script
 Scrapes external websites to extract content as clean markdown and structured data using Firecrawl.
+Batches run on a bounded worker pool with per-domain rate limiting and a
+resumable job state (execution/scrape_scheduler.py). Pages are cached per
+URL (execution/scrape_cache.py): fresh pages are not re-fetched and
+unchanged pages are not re-written. Crawls follow links breadth-first from
+seed URLs (execution/crawl_frontier.py) and stream pages to one JSONL file.
 
 Directive: directives/scrape_website.md
 """
 
 import argparse
+import hashlib
 import json
 import os
 import sys
+import threading
 from datetime import datetime
 from urllib.parse import urlparse
 
@@ -20,9 +27,83 @@ except ImportError:
     print("ERROR: firecrawl-py is not installed. Run 'pip install firecrawl-py'", file=sys.stderr)
     sys.exit(1)
 
+try:
+    from execution.crawl_frontier import DEFAULT_MAX_DEPTH, DEFAULT_MAX_PAGES, CrawlFrontier, extract_links
+    from execution.scrape_cache import DEFAULT_DB_PATH as SCRAPE_CACHE_DB, ScrapeCache
+    from execution.scrape_scheduler import (
+        DEFAULT_DOMAIN_BURST, DEFAULT_DOMAIN_RATE, DEFAULT_WORKERS, JOB_DIR, JobState, ScrapeScheduler, job_id_for,
+    )
+except ImportError:
+    sys.path.insert(0, os.path.dirname(__file__))
+    from crawl_frontier import DEFAULT_MAX_DEPTH, DEFAULT_MAX_PAGES, CrawlFrontier, extract_links
+    from scrape_cache import DEFAULT_DB_PATH as SCRAPE_CACHE_DB, ScrapeCache
+    from scrape_scheduler import (
+        DEFAULT_DOMAIN_BURST, DEFAULT_DOMAIN_RATE, DEFAULT_WORKERS, JOB_DIR, JobState, ScrapeScheduler, job_id_for,
+    )
+
 load_dotenv()
 
 API_KEY = os.getenv("FIRECRAWL_API_KEY")
+# Self-hosted Firecrawl or a local stub; unset = Firecrawl cloud
+API_URL = os.getenv("FIRECRAWL_API_URL")
+
+REFRESH = False   # --refresh: skip cache lookups (fetched pages still update the cache)
+
+_app = None
+_app_lock = threading.Lock()
+_cache = None
+
+
+def get_app():
+    """One FirecrawlApp (and its connection pool) shared by every scrape in the process."""
+    global _app
+    with _app_lock:
+        if _app is None:
+            # A self-hosted endpoint may not need a key
+            if not API_URL and (not API_KEY or API_KEY == "your_firecrawl_api_key_here"):
+                print("ERROR: FIRECRAWL_API_KEY not found or invalid in .env", file=sys.stderr)
+                sys.exit(1)
+            kwargs = {"api_url": API_URL} if API_URL else {}
+            _app = FirecrawlApp(api_key=API_KEY or "self-hosted", **kwargs)
+        return _app
+
+
+def get_scrape_cache() -> ScrapeCache | None:
+    """The shared scrape cache (None when disabled with SCRAPE_CACHE_DB="")."""
+    global _cache
+    if _cache is None and SCRAPE_CACHE_DB:
+        _cache = ScrapeCache(SCRAPE_CACHE_DB)
+    return _cache
+
+
+def print_cache_stats():
+    cache = get_scrape_cache()
+    if cache is None:
+        return
+    stats = cache.stats()
+    if not stats["lookups"] and not stats["unchanged"] + stats["changed"] + stats["new"]:
+        return
+    print(f"📊 Scrape cache: {stats['hits']}/{stats['lookups']} hits ({stats['hit_rate']:.1%}), "
+          f"{stats['unchanged']} unchanged / {stats['changed']} changed / {stats['new']} new after fetch; "
+          f"{format_bytes(stats['bytes_saved'])} saved ({format_bytes(stats['fetch_bytes_saved'])} not fetched, "
+          f"{format_bytes(stats['write_bytes_saved'])} not rewritten)")
+
+
+def format_bytes(n: int) -> str:
+    return f"{n / 1e6:.2f} MB" if n >= 1e6 else f"{n / 1e3:.1f} KB"
+
+
+def infer_page_type(url: str) -> str:
+    """Page type from the URL path (also picks the cache TTL)."""
+    # Inferred loosely; PRD 02 agents will use LLMs to strictly classify
+    if "/pricing" in url.lower():
+        return "pricing"
+    elif "/about" in url.lower():
+        return "about"
+    elif "/blog" in url.lower():
+        return "blog"
+    return "unknown"
+
 
 def get_domain(url: str) -> str:
     """Extract domain from URL for naming files."""
@@ -40,21 +121,14 @@ def save_scrape_result(url: str, content: str, status_code: int = 200, error: st
     os.makedirs(".tmp", exist_ok=True)
     domain = get_domain(url)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_path = f".tmp/scraped_{domain}_{timestamp}.json"
-    
-    # Inferred loosely; PRD 02 agents will use LLMs to strictly classify
-    page_type = "unknown"
-    if "/pricing" in url.lower():
-        page_type = "pricing"
-    elif "/about" in url.lower():
-        page_type = "about"
-    elif "/blog" in url.lower():
-        page_type = "blog"
-    
+    # URL hash keeps pages of one domain finished in the same second apart
+    url_hash = hashlib.md5(url.encode("utf-8")).hexdigest()[:8]
+    output_path = f".tmp/scraped_{domain}_{timestamp}_{url_hash}.json"
+
     result = {
         "url": url,
         "scraped_at": datetime.now().isoformat() + "Z",
-        "page_type": page_type,
+        "page_type": infer_page_type(url),
         "markdown": content,
         "status_code": status_code
     }
@@ -68,26 +142,47 @@ def save_scrape_result(url: str, content: str, status_code: int = 200, error: st
     return output_path
 
 
+def fetch_page(url: str) -> dict:
+    """Fetch one page through the shared client. Returns {"markdown", "status_code"}."""
+    # We only request markdown for now to keep the payload clean
+    scrape_result = get_app().scrape(url, formats=['markdown'])
+    metadata = getattr(scrape_result, "metadata", None)
+    status_code = getattr(metadata, "status_code", None) or getattr(metadata, "statusCode", None) or 200
+    return {"markdown": getattr(scrape_result, "markdown", "") or "", "status_code": status_code}
+
+
+def save_page(url: str, page: dict) -> tuple[str, bool]:
+    """Save a fetched page through the cache. Returns (path, written); an unchanged
+    page keeps its earlier file. Error pages are saved but never cached."""
+    save = lambda: save_scrape_result(url, page["markdown"], status_code=page["status_code"])  # noqa: E731
+    cache = get_scrape_cache()
+    if cache is None or page["status_code"] >= 400:
+        return save(), True
+    return cache.store(url, infer_page_type(url), page["markdown"], save)
+
+
 def scrape_single(url: str) -> str:
     """Scrapes a single website and saves the output."""
-    if not API_KEY or API_KEY == "your_firecrawl_api_key_here":
-        print("ERROR: FIRECRAWL_API_KEY not found or invalid in .env", file=sys.stderr)
-        sys.exit(1)
-        
-    app = FirecrawlApp(api_key=API_KEY)
-    
+    get_app()
+
+    cache = get_scrape_cache()
+    cached_path = cache.lookup(url, infer_page_type(url)) if cache and not REFRESH else None
+    if cached_path:
+        print(f"⏭️  Cache hit for {url}: {cached_path}")
+        return cached_path
+
     print(f"Scraping URL: {url} ...")
     try:
-        # We only request markdown for now to keep the payload clean
-        scrape_result = app.scrape(url, formats=['markdown'])
-        
-        md_content = getattr(scrape_result, "markdown", "")
+        page = fetch_page(url)
+        md_content = page["markdown"]
         if not md_content:
             print("WARNING: No markdown content returned.")
-        status_code = getattr(getattr(scrape_result, "metadata", None), "statusCode", 200)
 
-        output_path = save_scrape_result(url, md_content, status_code=status_code)
-        print(f"[SUCCESS] Saved clean markdown for {url} to {output_path}")
+        output_path, written = save_page(url, page)
+        if written:
+            print(f"[SUCCESS] Saved clean markdown for {url} to {output_path}")
+        else:
+            print(f"⏭️  Unchanged since last scrape; kept {output_path}")
         return output_path
         
     except Exception as e:
@@ -96,55 +191,193 @@ def scrape_single(url: str) -> str:
         return output_path
 
 
-def scrape_batch(urls: list[str]) -> list[str]:
-    """Scrapes multiple URLs. Firecrawl SDK provides batch capabilities, but we output individual files."""
-    if not API_KEY or API_KEY == "your_firecrawl_api_key_here":
-        print("ERROR: FIRECRAWL_API_KEY not found or invalid in .env", file=sys.stderr)
-        sys.exit(1)
-        
-    app = FirecrawlApp(api_key=API_KEY)
-    
-    print(f"Starting batch scrape for {len(urls)} URLs...")
-    try:
-        # Firecrawl native batch scraping
-        batch_result = app.batch_scrape(urls, formats=['markdown'])
-        
-        saved_paths = []
-        if batch_result and "data" in batch_result:
-            for item in batch_result["data"]:
-                url = item.get("metadata", {}).get("sourceURL", "") or item.get("url", "unknown")
-                md_content = item.get("markdown", "")
-                status_code = item.get("metadata", {}).get("statusCode", 200)
-                path = save_scrape_result(url, md_content, status_code=status_code)
-                saved_paths.append(path)
-                print(f"[SUCCESS] Saved {url} to {path}")
+def scrape_batch(
+    urls: list[str],
+    workers: int = DEFAULT_WORKERS,
+    rate: float = DEFAULT_DOMAIN_RATE,
+    burst: int = DEFAULT_DOMAIN_BURST,
+    job: str | None = None,
+    fresh: bool = False,
+) -> list[str]:
+    """Scrapes multiple URLs concurrently, saving each page as soon as it arrives.
+
+    At most `workers` requests are in flight and each domain gets at most
+    `rate` requests/s. Progress goes to .tmp/scrape_jobs/<job>.jsonl (job
+    defaults to a hash of the URL set), so re-running the same batch skips
+    pages that were already saved; `fresh` starts over.
+    """
+    get_app()
+
+    job = job or job_id_for(urls)
+    state_path = os.path.join(JOB_DIR, f"{job}.jsonl")
+    if fresh and os.path.exists(state_path):
+        os.remove(state_path)
+    state = JobState(state_path)
+
+    print(f"Starting batch scrape for {len(urls)} URLs ({workers} workers, {rate:g} req/s per domain, job {job})...")
+    saved_paths = []
+    cached = set()
+    cache = get_scrape_cache()
+    if cache is not None and not REFRESH:
+        for url in dict.fromkeys(urls):
+            cached_path = None if state.is_done(url) else cache.lookup(url, infer_page_type(url))
+            if cached_path:
+                state.record(url, "done", path=cached_path, cached=True)
+                saved_paths.append(cached_path)
+                cached.add(url)
+        if cached:
+            print(f"⏭️  {len(cached)} URLs fresh in the scrape cache")
+
+    def on_result(url: str, page: dict) -> dict:
+        path, written = save_page(url, page)
+        saved_paths.append(path)
+        if written:
+            print(f"[SUCCESS] Saved {url} to {path}")
         else:
-            print("WARNING: Unrecognized batch scrape response format.")
-        
-        return saved_paths
+            print(f"⏭️  Unchanged: {url} (kept {path})")
+        return {"path": path, "written": written}
 
-    except Exception as e:
-        print(f"[ERROR] Batch scrape failed: {e}", file=sys.stderr)
-        return []
+    def on_error(url: str, error: Exception) -> dict:
+        print(f"[ERROR] Failed to scrape {url}: {error}", file=sys.stderr)
+        return {}
+
+    scheduler = ScrapeScheduler(fetch_page, workers=workers, rate=rate, burst=burst)
+    try:
+        stats = scheduler.run([u for u in urls if u not in cached], on_result, on_error, state=state)
+    except KeyboardInterrupt:
+        print(f"\n⏸️  Interrupted after {len(saved_paths)} pages; re-run the same command to resume (state: {state_path})")
+        sys.exit(130)
+    finally:
+        state.close()
+
+    print(f"✅ Batch done: {stats['done']} fetched, {stats['failed']} failed, "
+          f"{len(cached)} cached, {stats['skipped']} already done")
+    if stats["failed"]:
+        print(f"⚠️  Re-run the same command to retry the failed URLs (state: {state_path})")
+    return saved_paths
+
+
+def scrape_crawl(
+    seeds: list[str],
+    max_depth: int = DEFAULT_MAX_DEPTH,
+    max_pages: int = DEFAULT_MAX_PAGES,
+    include: list[str] = (),
+    exclude: list[str] = (),
+    workers: int = DEFAULT_WORKERS,
+    rate: float = DEFAULT_DOMAIN_RATE,
+    burst: int = DEFAULT_DOMAIN_BURST,
+    output: str | None = None,
+) -> str:
+    """Crawls breadth-first from the seed URLs, streaming each page to one JSONL file.
+
+    Links are read from each page's markdown and followed on the seeds'
+    domains up to `max_depth` links deep, for at most `max_pages` fetches.
+    Each line is one page, with "markdown" last so rag_ingest can stream it.
+    Crawled pages bypass the scrape cache (it tracks one file per page).
+    """
+    get_app()
+
+    frontier = CrawlFrontier(seeds, max_depth=max_depth, max_pages=max_pages, include=include, exclude=exclude)
+    if not output:
+        os.makedirs(".tmp", exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = f".tmp/crawl_{get_domain(frontier.seeds[0])}_{timestamp}.jsonl"
+    print(f"Starting crawl from {len(frontier.seeds)} seed(s): depth {max_depth}, up to {max_pages} pages "
+          f"({workers} workers, {rate:g} req/s per domain) -> {output}")
+
+    scheduler = ScrapeScheduler(fetch_page, workers=workers, rate=rate, burst=burst)
+    with open(output, "a", encoding="utf-8") as out:
+
+        def on_result(url: str, depth: int, page: dict) -> list[str]:
+            if page["status_code"] >= 400:
+                raise RuntimeError(f"HTTP {page['status_code']}")
+            record = {
+                "url": url,
+                "scraped_at": datetime.now().isoformat() + "Z",
+                "page_type": infer_page_type(url),
+                "depth": depth,
+                "status_code": page["status_code"],
+                "markdown": page["markdown"],
+            }
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            print(f"[SUCCESS] depth {depth}: {url}")
+            return extract_links(page["markdown"], url) if depth < max_depth else []
+
+        def on_error(url: str, error: Exception):
+            print(f"[ERROR] Failed to scrape {url}: {error}", file=sys.stderr)
+
+        try:
+            stats = scheduler.crawl(frontier, on_result, on_error)
+        except KeyboardInterrupt:
+            print(f"\n⏸️  Interrupted after {frontier.issued} fetches; pages so far are in {output}")
+            sys.exit(130)
+
+    left = len(frontier.queue)
+    print(f"✅ Crawl done: {stats['done']} pages, {stats['failed']} failed; "
+          f"{frontier.stats['queued']} queued, {frontier.stats['duplicate']} duplicate links, "
+          f"{frontier.stats['filtered']} filtered out, {frontier.stats['too_deep']} too deep")
+    if left:
+        print(f"⚠️  Page budget reached with {left} URLs still queued (raise --max-pages to go further)")
+    return output
 
 
 def main():
     parser = argparse.ArgumentParser(description="Scrape websites into clean markdown using Firecrawl")
     parser.add_argument("--url", help="Single URL to scrape")
     parser.add_argument("--batch", help="Comma-separated list of URLs to scrape in batch")
-    
+    parser.add_argument("--urls-file", help="File with one URL per line to scrape in batch")
+    parser.add_argument("--crawl", help="Comma-separated seed URLs to crawl, following links on their domains")
+    parser.add_argument("--max-depth", type=int, default=DEFAULT_MAX_DEPTH,
+                        help=f"Crawl: links to follow from a seed (default: {DEFAULT_MAX_DEPTH})")
+    parser.add_argument("--max-pages", type=int, default=DEFAULT_MAX_PAGES,
+                        help=f"Crawl: page budget (default: {DEFAULT_MAX_PAGES})")
+    parser.add_argument("--include", action="append", default=[],
+                        help="Crawl: only follow URLs matching this regex (repeatable)")
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="Crawl: never follow URLs matching this regex (repeatable)")
+    parser.add_argument("--output", help="Crawl: JSONL file to append pages to (default: .tmp/crawl_<domain>_<ts>.jsonl)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Concurrent requests in batch and crawl mode (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--rate", type=float, default=DEFAULT_DOMAIN_RATE,
+                        help=f"Max requests per second per domain, 0 = unlimited (default: {DEFAULT_DOMAIN_RATE})")
+    parser.add_argument("--burst", type=int, default=DEFAULT_DOMAIN_BURST,
+                        help=f"Requests a domain may receive back to back (default: {DEFAULT_DOMAIN_BURST})")
+    parser.add_argument("--job", help="Job name for resumable state (default: hash of the URL list)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore saved job state and scrape every URL")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Fetch every page even if a fresh copy is cached (unchanged pages are still not rewritten)")
+    parser.add_argument("--api-url", help="Firecrawl endpoint (self-hosted or local stub); overrides FIRECRAWL_API_URL")
+
     args = parser.parse_args()
-    
+
+    global API_URL, REFRESH
+    if args.api_url:
+        API_URL = args.api_url
+    REFRESH = args.refresh
+
     if args.url:
         scrape_single(args.url)
-    elif args.batch:
-        urls = [u.strip() for u in args.batch.split(",") if u.strip()]
+    elif args.crawl:
+        seeds = [u.strip() for u in args.crawl.split(",") if u.strip()]
+        scrape_crawl(seeds, max_depth=args.max_depth, max_pages=args.max_pages, include=args.include,
+                     exclude=args.exclude, workers=args.workers, rate=args.rate, burst=args.burst,
+                     output=args.output)
+        return
+    elif args.batch or args.urls_file:
+        if args.urls_file:
+            with open(args.urls_file, "r", encoding="utf-8") as f:
+                urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        else:
+            urls = [u.strip() for u in args.batch.split(",") if u.strip()]
         if urls:
-            scrape_batch(urls)
+            scrape_batch(urls, workers=args.workers, rate=args.rate, burst=args.burst, job=args.job, fresh=args.fresh)
         else:
             print("ERROR: No valid URLs provided in batch argument.")
     else:
         parser.print_help()
+        return
+    print_cache_stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+"""
+Single Flight — Execution Module
+Coalesces identical concurrent requests: the first caller for a key runs the
+computation, and callers that arrive while it is in flight wait and share
+its result instead of making their own LLM call. Works across threads
+(events) and across processes on one machine (an flock'd lock file plus a
+result file per key).
+
+Directive: directives/chat_analysis.md
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process coalescing only
+    fcntl = None
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+LOCK_DIR = os.getenv("SINGLE_FLIGHT_DIR", ".tmp/locks")
+STALE_FILE_SECONDS = 3600   # lock/result files older than this are removed on first use
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """`do(key, fn)` runs fn once per key among overlapping callers.
+
+    Results shared across processes go through JSON, so fn must return a
+    JSON-serializable value. If the leader raises, in-process waiters get the
+    same exception and other processes run fn themselves.
+    """
+
+    def __init__(self, lock_dir: str | None = LOCK_DIR):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self._calls: dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.stats = {"leader": 0, "shared_thread": 0, "shared_process": 0}
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+            self._prune()
+
+    def do(self, key: str, fn) -> tuple[object, bool]:
+        """Return (result, shared). `shared` is True when another caller computed it."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            with self._lock:
+                self.stats["shared_thread"] += 1
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._do_across_processes(key, fn)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    # -- cross-process ------------------------------------------------------
+
+    def _do_across_processes(self, key: str, fn) -> tuple[object, bool]:
+        if not self.lock_dir:
+            return self._lead(fn), False
+
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        lock_path = os.path.join(self.lock_dir, f"{name}.lock")
+        result_path = os.path.join(self.lock_dir, f"{name}.json")
+
+        started = time.time()
+        with open(lock_path, "a+") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process holds the key: wait for it, then reuse what it wrote
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # 1s slack for filesystems with coarse mtimes
+                shared = self._read_result(result_path, since=started - 1)
+                if shared is not None:
+                    with self._lock:
+                        self.stats["shared_process"] += 1
+                    return shared["result"], True
+            os.utime(lock_path)  # keep an in-use lock file from looking stale to _prune
+            try:
+                result = self._lead(fn)
+                self._write_result(result_path, result)
+                return result, False
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _lead(self, fn):
+        with self._lock:
+            self.stats["leader"] += 1
+        return fn()
+
+    @staticmethod
+    def _read_result(path: str, since: float) -> dict | None:
+        """The result file, if it was written after `since` (i.e. by the call we waited on)."""
+        try:
+            if os.path.getmtime(path) < since:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_result(path: str, result) -> None:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"result": result}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except (TypeError, ValueError, OSError):
+            # Not JSON-serializable or disk trouble: waiters just compute themselves
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _prune(self):
+        cutoff = time.time() - STALE_FILE_SECONDS
+        for entry in os.scandir(self.lock_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+# ---------------------------------------------------------------------------
+# Shared instance
+# ---------------------------------------------------------------------------
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
@@ -0,0 +1,70 @@
+"""Cosine parity of the ONNX backends with torch, and backend-aware cache keys
+(run: python -m pytest execution/tests).
+
+The parity tests need onnxruntime, sentence_transformers and an ONNX export
+already in ONNX_MODEL_DIR (`python execution/rag_benchmark.py backends` makes
+one); they are skipped otherwise. EMBEDDING_PARITY_MODEL picks another model.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from embedding_backend import load_model, model_dir  # noqa: E402
+from embedding_cache import EmbeddingCache  # noqa: E402
+from rag_query import EMBEDDING_MODEL  # noqa: E402
+
+MODEL = os.getenv("EMBEDDING_PARITY_MODEL", EMBEDDING_MODEL)
+MIN_COSINE = 0.99   # same bar as `rag_benchmark.py backends --min-cosine`
+
+SENTENCES = [
+    "Acme's Pro plan costs $49 per user per month, billed annually.",
+    "Enterprise customers get SSO, audit logs and a named account manager.",
+    "The free tier is limited to three projects and 1 GB of storage.",
+    "Competitors in the mid-market segment mostly compete on integrations.",
+    "Strengths: strong brand recognition and a large partner ecosystem.",
+    "Weaknesses: slow release cadence and a dated mobile experience.",
+    "Threats include new entrants with usage-based pricing.",
+    "Series B funding of $40M was led by a growth equity firm in 2023.",
+    "Onboarding takes two weeks and includes four live training sessions.",
+    "Porter's five forces: supplier power is low because hosting is a commodity.",
+    "Annual billing saves twenty percent compared with monthly plans.",
+    "Support is available 24/7 by chat; phone support requires the Enterprise plan.",
+]
+
+
+@pytest.fixture(scope="module")
+def torch_vectors():
+    pytest.importorskip("sentence_transformers")
+    try:
+        model = load_model(MODEL, "torch")
+    except Exception as e:  # model not downloaded / offline
+        pytest.skip(f"torch model unavailable: {e}")
+    return model.encode(SENTENCES, normalize_embeddings=True)
+
+
+@pytest.mark.parametrize("backend, filename", [("onnx", "model.onnx"), ("onnx-int8", "model.int8.onnx")])
+def test_onnx_backend_matches_torch(request, backend, filename):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("tokenizers")
+    if not os.path.exists(os.path.join(model_dir(MODEL), filename)):
+        pytest.skip(f"no {backend} export in {model_dir(MODEL)}")
+    torch_vectors = request.getfixturevalue("torch_vectors")
+
+    vectors = load_model(MODEL, backend).encode(SENTENCES, normalize_embeddings=True)
+    cosines = np.sum(vectors * torch_vectors, axis=1)
+    assert cosines.mean() >= MIN_COSINE
+    assert cosines.min() >= MIN_COSINE
+
+
+def test_int8_cache_keys_differ_from_fp32():
+    torch_cache = EmbeddingCache(MODEL, db_path=None, backend="torch")
+    onnx_cache = EmbeddingCache(MODEL, db_path=None, backend="onnx")
+    int8_cache = EmbeddingCache(MODEL, db_path=None, backend="onnx-int8")
+    for text in SENTENCES:
+        assert torch_cache.key(text) == onnx_cache.key(text)
+        assert int8_cache.key(text) != torch_cache.key(text)
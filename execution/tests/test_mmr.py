@@ -0,0 +1,72 @@
+"""Parity of the vectorized MMR reranker with the original loop (run: python -m pytest execution/tests)."""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from rag_benchmark import mmr_rerank_reference  # noqa: E402
+from rag_query import mmr_rerank, mmr_rerank_batch  # noqa: E402
+
+
+def _candidates(seed: int, n: int, dim: int = 32):
+    rng = np.random.default_rng(seed)
+    query = rng.standard_normal(dim)
+    query /= np.linalg.norm(query)
+    embs = rng.standard_normal((n, dim))
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    docs = [{"id": i} for i in range(n)]
+    return query, list(embs), docs
+
+
+def _ids(docs):
+    return [d["id"] for d in docs]
+
+
+@pytest.mark.parametrize("fetch_k", [6, 20, 50, 100])
+@pytest.mark.parametrize("k", [1, 5, 8])
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.5, 0.7, 1.0])
+def test_matches_reference_loop(fetch_k, k, lambda_mult):
+    for seed in range(3):
+        query, embs, docs = _candidates(seed * 1000 + fetch_k, fetch_k)
+        expected = mmr_rerank_reference(query, embs, docs, k=k, lambda_mult=lambda_mult)
+        assert _ids(mmr_rerank(query, embs, docs, k=k, lambda_mult=lambda_mult)) == _ids(expected)
+
+
+def test_ties_pick_the_earliest_candidate_like_the_reference():
+    query, embs, docs = _candidates(7, 6)
+    # Exact duplicates tie on relevance and redundancy
+    embs = [embs[0], embs[1], embs[0], embs[1], embs[2], embs[2]]
+    for lambda_mult in (0.3, 0.7, 1.0):
+        expected = mmr_rerank_reference(query, embs, docs, k=4, lambda_mult=lambda_mult)
+        assert _ids(mmr_rerank(query, embs, docs, k=4, lambda_mult=lambda_mult)) == _ids(expected)
+
+
+def test_orthogonal_candidates_tie_on_relevance():
+    dim = 8
+    query = np.ones(dim) / np.sqrt(dim)
+    embs = list(np.eye(dim))  # every candidate has the same similarity to the query
+    docs = [{"id": i} for i in range(dim)]
+    expected = mmr_rerank_reference(query, embs, docs, k=5)
+    assert _ids(mmr_rerank(query, embs, docs, k=5)) == _ids(expected) == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("n, k", [(3, 5), (5, 5)])
+def test_k_at_least_n_returns_candidates_unchanged(n, k):
+    query, embs, docs = _candidates(n, n)
+    assert _ids(mmr_rerank(query, embs, docs, k=k)) == _ids(mmr_rerank_reference(query, embs, docs, k=k)) == list(range(n))
+
+
+def test_no_candidates():
+    query = np.ones(4) / 2
+    assert mmr_rerank(query, [], [], k=5) == mmr_rerank_reference(query, [], [], k=5) == []
+
+
+def test_batch_matches_per_query_reference():
+    lists = [_candidates(seed, n) for seed, n in enumerate([0, 3, 12, 40, 25])]
+    results = mmr_rerank_batch([q for q, _, _ in lists], [e for _, e, _ in lists], [d for _, _, d in lists], k=5)
+    for (query, embs, docs), got in zip(lists, results):
+        assert _ids(got) == _ids(mmr_rerank_reference(query, embs, docs, k=5))
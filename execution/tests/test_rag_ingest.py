@@ -0,0 +1,90 @@
+"""Dedup behaviour of rag_ingest on the local backend (run: python -m pytest execution/tests).
+
+Embeddings come from a hash of the chunk text, so no model is loaded.
+"""
+
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import rag_ingest  # noqa: E402
+
+FOOTER = "© 2026 Acme Inc. All rights reserved. Privacy · Terms · Cookies · Careers · Press kit."
+PRICING = (
+    "## Pricing\n\n"
+    "The Pro plan costs $49 per user per month and includes unlimited projects, priority support, "
+    "single sign-on and a 99.9% uptime commitment backed by service credits for every customer."
+)
+
+
+def fake_embeddings(texts, batch_size=rag_ingest.DEFAULT_BATCH_SIZE):
+    vectors = []
+    for text in texts:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        vec = np.random.default_rng(seed).standard_normal(rag_ingest.EMBEDDING_DIM)
+        vectors.append((vec / np.linalg.norm(vec)).tolist())
+    return vectors
+
+
+@pytest.fixture
+def ingest(tmp_path, monkeypatch):
+    """ingest_directory on a fresh local index under tmp_path."""
+    monkeypatch.setattr(rag_ingest, "LOCAL_INDEX_DIR", str(tmp_path / "index"))
+    monkeypatch.setattr(rag_ingest, "_local_index", None)
+    monkeypatch.setattr(rag_ingest, "generate_embeddings", fake_embeddings)
+
+    def run(source_dir, **kwargs):
+        return rag_ingest.ingest_directory(str(source_dir), backend="local", **kwargs)
+    return run
+
+
+def write_pages(directory, pages: dict[str, str]):
+    directory.mkdir(exist_ok=True)
+    for name, markdown in pages.items():
+        page = {"url": f"https://acme.example/{name}", "page_type": "pricing", "markdown": markdown}
+        (directory / f"scrape_{name}.json").write_text(json.dumps(page), encoding="utf-8")
+
+
+def test_dedup_state_does_not_leak_into_a_later_run(tmp_path, ingest):
+    pages = {f"p{i}": f"# Page {i}\n\nPage {i} describes feature number {i} in detail.\n\n{FOOTER}" for i in range(4)}
+    pages["copy"] = PRICING
+    pages["original"] = PRICING
+    write_pages(tmp_path / "scrapes", pages)
+
+    deduped = ingest(tmp_path / "scrapes", dedup=True)
+    assert deduped["dedup"]["boilerplate_blocks_removed"] == 4
+    assert deduped["dedup"]["near_duplicate_chunks"] == 1
+
+    plain = ingest(tmp_path / "scrapes", dedup=False)
+    assert "dedup" not in plain
+    # Without dedup the footer is kept and the duplicate page is indexed again
+    assert plain["chunks"] == 5
+
+
+def test_second_dedup_run_writes_and_deletes_nothing(tmp_path, ingest, monkeypatch):
+    pages = {f"p{i}": f"# Page {i}\n\nPage {i} describes feature number {i} in detail.\n\n{FOOTER}" for i in range(4)}
+    for name in ("copy_a", "copy_b", "copy_c"):
+        pages[name] = PRICING + " Prices exclude VAT." if name == "copy_c" else PRICING  # c: a near copy
+    write_pages(tmp_path / "scrapes", pages)
+
+    def indexed_sources():
+        return {source for _, source, _, _ in rag_ingest.get_local_index().entries()}
+
+    first = ingest(tmp_path / "scrapes", dedup=True, workers=4)
+    assert first["dedup"]["near_duplicate_chunks"] == 2
+    kept = indexed_sources()
+    assert "scrape_copy_a.json" in kept and not kept & {"scrape_copy_b.json", "scrape_copy_c.json"}
+
+    # Read the files in the opposite order: the same copy must survive
+    real_glob = rag_ingest.glob.glob
+    monkeypatch.setattr(rag_ingest.glob, "glob", lambda pattern: sorted(real_glob(pattern), reverse=True))
+    second = ingest(tmp_path / "scrapes", dedup=True, workers=4)
+    assert (second["chunks"], second["deleted"]) == (0, 0)
+    assert second["dedup"]["near_duplicate_chunks"] == 2
+    assert indexed_sources() == kept
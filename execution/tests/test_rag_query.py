@@ -0,0 +1,44 @@
+"""Regression checks for neighbour merging in rag_query (run: python -m pytest execution/tests)."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from rag_query import _join_overlapping  # noqa: E402
+
+
+def test_single_shared_character_is_not_overlap():
+    assert _join_overlapping("The Pro plan costs more", "e-mail support is included.") == (
+        "The Pro plan costs more\n\ne-mail support is included."
+    )
+
+
+def test_unrelated_neighbours_get_a_paragraph_break():
+    assert _join_overlapping("Billed per seat.", ".NET SDK is available.") == (
+        "Billed per seat.\n\n.NET SDK is available."
+    )
+
+
+def test_sentence_overlap_is_kept_once():
+    first = "Plans start at $8 per user. Annual billing saves twenty percent."
+    second = "Annual billing saves twenty percent. Enterprise adds SSO."
+    assert _join_overlapping(first, second) == (
+        "Plans start at $8 per user. Annual billing saves twenty percent. Enterprise adds SSO."
+    )
+
+
+def test_overlap_must_start_on_a_word_boundary():
+    first = "Support covers the whole rollout period"
+    second = "the whole rollout period and onboarding calls."
+    assert _join_overlapping(first, second) == (
+        "Support covers the whole rollout period and onboarding calls."
+    )
+    glued = "Support covers bathe whole rollout period"
+    assert _join_overlapping(glued, second) == glued + "\n\n" + second
+
+
+def test_repeated_breadcrumb_is_dropped():
+    first = "Pricing > Enterprise\n\nContracts are annual and include a named account manager."
+    second = "Pricing > Enterprise\n\nVolume discounts start at 500 seats."
+    assert _join_overlapping(first, second) == first + "\n\nVolume discounts start at 500 seats."
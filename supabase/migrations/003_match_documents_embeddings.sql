@@ -0,0 +1,50 @@
+-- ============================================
+-- RAG Pipeline — match_documents with stored embeddings
+-- Returns each candidate's stored vector so MMR reranking
+-- in execution/rag_query.py never re-encodes documents.
+-- ============================================
+
+-- Same filtering and ordering as public.match_documents, plus the stored
+-- embedding encoded as base64 of pgvector's binary send format:
+--   int16 dim | int16 unused | dim x float4 (big-endian)
+-- ~2 KB per 384-dim row instead of ~8 KB as a JSON float array.
+create or replace function public.match_documents_with_embeddings(
+  query_embedding vector(384),
+  match_threshold float default 0.65,
+  match_count int default 10,
+  filter_source_type text default null
+)
+returns table (
+  id bigint,
+  content text,
+  source text,
+  source_type text,
+  metadata jsonb,
+  chunk_index integer,
+  similarity float,
+  embedding text
+)
+language plpgsql
+as $$
+begin
+  return query
+    select
+      d.id,
+      d.content,
+      d.source,
+      d.source_type,
+      d.metadata,
+      d.chunk_index,
+      1 - (d.embedding <=> query_embedding) as similarity,
+      encode(vector_send(d.embedding), 'base64') as embedding
+    from public.documents d
+    where
+      (filter_source_type is null or d.source_type = filter_source_type)
+      and 1 - (d.embedding <=> query_embedding) > match_threshold
+    order by d.embedding <=> query_embedding
+    limit match_count;
+end;
+$$;
+
+-- Force API to reload schema cache
+notify pgrst, 'reload schema';
@@ -0,0 +1,28 @@
+-- ============================================
+-- RAG Pipeline — content-addressed incremental ingestion
+-- execution/rag_ingest.py compares per-chunk content hashes against
+-- this column and only upserts new/changed chunks.
+-- ============================================
+
+-- 1. Per-chunk SHA-256 of `content` (hex), same as hashlib.sha256 in Python
+alter table public.documents
+  add column if not exists content_hash text;
+
+update public.documents
+  set content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex')
+  where content_hash is null;
+
+-- 2. One row per (source, chunk_index): drop duplicates left by old --force runs,
+--    keeping the most recent insert
+delete from public.documents a
+  using public.documents b
+  where a.source = b.source
+    and a.chunk_index = b.chunk_index
+    and a.id < b.id;
+
+-- Conflict target for upserts
+create unique index if not exists documents_source_chunk_idx
+  on public.documents (source, chunk_index);
+
+-- Force API to reload schema cache
+notify pgrst, 'reload schema';
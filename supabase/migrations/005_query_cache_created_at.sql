@@ -0,0 +1,11 @@
+-- ============================================
+-- RAG Pipeline — query cache expiry
+-- execution/response_cache.py filters and purges rows older than the
+-- cache TTL by created_at.
+-- ============================================
+
+create index if not exists query_cache_created_at_idx
+  on public.query_cache (created_at);
+
+-- Force API to reload schema cache
+notify pgrst, 'reload schema';
@@ -0,0 +1,57 @@
+-- ============================================
+-- RAG Pipeline — semantic query cache
+-- execution/response_cache.py stores each cached query's bge-small
+-- embedding and reuses an answer when a new query in the same mode is
+-- close enough (cosine similarity >= SEMANTIC_CACHE_THRESHOLD).
+-- ============================================
+
+-- 1. Query embedding (null for rows cached before this migration)
+alter table public.query_cache
+  add column if not exists query_embedding vector(384);
+
+-- HNSW: no training step, so it stays accurate as the cache fills up
+create index if not exists query_cache_embedding_idx
+  on public.query_cache
+  using hnsw (query_embedding vector_cosine_ops);
+
+-- 2. Closest fresh cached query in a mode above a similarity threshold
+create or replace function public.match_query_cache(
+  query_embedding vector(384),
+  match_mode text default 'general',
+  match_threshold float default 0.92,
+  min_created_at timestamptz default now() - interval '24 hours'
+)
+returns table (
+  query_hash text,
+  query_text text,
+  response text,
+  sources jsonb,
+  mode text,
+  created_at timestamptz,
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  return query
+    select
+      q.query_hash,
+      q.query_text,
+      q.response,
+      q.sources,
+      q.mode,
+      q.created_at,
+      1 - (q.query_embedding <=> match_query_cache.query_embedding) as similarity
+    from public.query_cache q
+    where
+      q.query_embedding is not null
+      and q.mode = match_mode
+      and q.created_at > min_created_at
+      and 1 - (q.query_embedding <=> match_query_cache.query_embedding) >= match_threshold
+    order by q.query_embedding <=> match_query_cache.query_embedding
+    limit 1;
+end;
+$$;
+
+-- Force API to reload schema cache
+notify pgrst, 'reload schema';